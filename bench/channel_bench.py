@@ -0,0 +1,268 @@
+"""
+Benchmark suite of lab_channel
+- join/leave storms, point-to-point ping-pong, multicast fan-out, send_to_all broadcast
+  and receive_from_any of a large group
+- sweeps member counts (2 to 1024), payload sizes (10 B to 1 MB) and, for join/leave, n_bits
+- runs against a redis server, the in-process local backend and the shared memory store (lab_local_store)
+- all members live in this process, as handles of one channel (see Channel.member), except for the echo
+  member of ping_pong_process (redis and shared memory store only)
+- prints JSON with p50/p99 latency per operation and msgs/s, to be kept for tracking regressions
+- uses a namespace of its own, other keys on the redis server are kept
+
+Usage: python channel_bench.py [backends (redis,local,shared)] [seconds per measurement] [host] [port] > results.json
+       set VS2LAB_BENCH_QUICK=1 for a short sweep (smoke test)
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+
+from context import lab_channel, lab_local_store
+
+MEMBERS = [2, 8, 64, 256, 1024]
+PAYLOADS = [10, 1000, 100000, 1000000]
+N_BITS = [10, 16, 32]
+# largest amount of payload data moved by a single operation (members times payload size)
+MAX_VOLUME = 64 * 1000 * 1000
+
+QUICK_MEMBERS = [2, 64]
+QUICK_PAYLOADS = [10, 100000]
+QUICK_N_BITS = [10]
+
+
+def summary(latencies: list, messages: int, elapsed: float) -> dict:
+    """
+    Summarize a measurement.
+    :param latencies: operation latencies in seconds
+    :param messages: number of messages delivered
+    :param elapsed: duration of the measurement in seconds
+    :return: dict of number of operations, p50 and p99 latency in milliseconds and messages per second
+    """
+    latencies = sorted(latencies)
+    return {'ops': len(latencies),
+            'p50_ms': 1000 * latencies[len(latencies) // 2],
+            'p99_ms': 1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+            'msgs_per_s': messages / elapsed}
+
+
+def timed(operation, latencies: list):
+    """
+    Call an operation and record its latency.
+    :param operation: function to call
+    :param latencies: list of latencies to append to
+    :return: result of the operation
+    """
+    start = time.perf_counter()
+    result = operation()
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+def new_channel(backend: dict, n_bits: int = 16) -> lab_channel.Channel:
+    """
+    Create a channel in the namespace of the benchmark.
+    :param backend: keyword arguments of Channel selecting the backend
+    :param n_bits: number of bits of member ids
+    :return: Channel instance
+    """
+    return lab_channel.Channel(n_bits=n_bits, namespace='channel-bench-{}'.format(os.getpid()), **backend)
+
+
+def join_group(chan: lab_channel.Channel, size: int) -> list:
+    """
+    Join a group of members.
+    :param chan: channel
+    :param size: number of members
+    :return: list of member handles
+    """
+    return [chan.member(chan.join('bench')) for _ in range(size)]
+
+
+def drain(members: list, count: int) -> int:
+    """
+    Receive the queued messages of members.
+    :param members: member handles
+    :param count: number of messages queued per member
+    :return: number of received messages
+    """
+    received = 0
+    for member in members:
+        taken = 0
+        while taken < count:
+            messages = member.receive_many(None, count - taken, 1)
+            if len(messages) == 0:
+                break
+            taken += len(messages)
+        received += taken
+    return received
+
+
+def join_leave(backend: dict, size: int, n_bits: int, seconds: float) -> dict:
+    """
+    Storms of size members joining and then leaving, repeated for the duration of the measurement.
+    Latency per join or leave, msgs/s counts join and leave operations.
+    """
+    chan = new_channel(backend, n_bits)
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        pids = [timed(lambda: chan.join('bench'), latencies) for _ in range(size)]
+        for pid in pids:
+            timed(lambda: chan.member(pid).leave('bench'), latencies)
+    elapsed = time.perf_counter() - start
+    chan.clear()
+    chan.close()
+    return summary(latencies, len(latencies), elapsed)
+
+
+def serve_echo(echo) -> None:
+    """
+    Send received messages back to their senders, until receiving None.
+    :param echo: member handle
+    :return: None
+    """
+    while True:
+        received = echo.receive_from_any(5)
+        if received is None or received[1] is None:
+            return
+        echo.send_to({received[0]}, received[1])
+
+
+def echo_process(backend: dict, namespace: str, pid: int) -> None:
+    """
+    Run the echo member of ping_pong in a process of its own.
+    :param backend: keyword arguments of Channel selecting the backend
+    :param namespace: namespace of the benchmark channel
+    :param pid: member id of the echo member
+    :return: None
+    """
+    chan = lab_channel.Channel(namespace=namespace, **backend)
+    serve_echo(chan.member(pid))
+    chan.close()
+
+
+def ping_pong(backend: dict, payload: bytes, seconds: float, process: bool = False) -> dict:
+    """
+    Round trips of a message to an echo member in another thread, or in another process
+    (blocking receives on both sides). Latency per round trip, msgs/s counts both directions.
+    """
+    chan = new_channel(backend)
+    pinger, echo = join_group(chan, 2)
+    if process:
+        thread = multiprocessing.Process(target=echo_process, args=(backend, chan.namespace, echo.pid))
+    else:
+        thread = threading.Thread(target=serve_echo, args=(echo,), name='vs2lab-bench-echo')
+    thread.start()
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        timed(lambda: (pinger.send_to({echo.pid}, payload), pinger.receive_from({echo.pid}, 5)), latencies)
+    elapsed = time.perf_counter() - start
+    pinger.send_to({echo.pid}, None)
+    thread.join()
+    chan.clear()
+    chan.close()
+    return summary(latencies, 2 * len(latencies), elapsed)
+
+
+def fan_out(backend: dict, size: int, payload: bytes, seconds: float, broadcast: bool) -> dict:
+    """
+    Multicasts to all other members (or broadcasts with send_to_all), each round followed by
+    all receivers draining their inboxes. Latency per send operation, msgs/s counts delivered messages
+    (including the time the receivers take).
+    """
+    chan = new_channel(backend)
+    members = join_group(chan, size)
+    sender = members[0]
+    receivers = members if broadcast else members[1:]
+    others = {member.pid for member in members[1:]}
+    rounds = 10
+    latencies = []
+    delivered = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(rounds):
+            if broadcast:
+                timed(lambda: sender.send_to_all(payload), latencies)
+            else:
+                timed(lambda: sender.send_to(others, payload), latencies)
+        delivered += drain(receivers, rounds)
+    elapsed = time.perf_counter() - start
+    chan.clear()
+    chan.close()
+    return summary(latencies, delivered, elapsed)
+
+
+def receive_any(backend: dict, size: int, payload: bytes, seconds: float) -> dict:
+    """
+    One receiver taking a message of each other member of the group with receive_from_any, per round.
+    Latency per receive operation, msgs/s counts received messages (sending excluded).
+    """
+    chan = new_channel(backend)
+    members = join_group(chan, size)
+    receiver = members[0]
+    latencies = []
+    elapsed = 0.0
+    while elapsed < seconds:
+        for member in members[1:]:
+            member.send_to({receiver.pid}, payload)
+        start = time.perf_counter()
+        for _ in members[1:]:
+            timed(lambda: receiver.receive_from_any(5), latencies)
+        elapsed += time.perf_counter() - start
+    chan.clear()
+    chan.close()
+    return summary(latencies, len(latencies), elapsed)
+
+
+def run(backend_name: str, backend: dict, seconds: float, quick: bool) -> list:
+    """
+    Run all scenarios against a backend.
+    :return: list of result dicts
+    """
+    sizes = QUICK_MEMBERS if quick else MEMBERS
+    payloads = QUICK_PAYLOADS if quick else PAYLOADS
+    results = []
+
+    def record(scenario: str, result: dict, **parameters) -> None:
+        results.append(dict(scenario=scenario, backend=backend_name, **parameters, **result))
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    for n_bits in QUICK_N_BITS if quick else N_BITS:
+        for size in sizes:
+            if size <= 2 ** n_bits:
+                record('join_leave', join_leave(backend, size, n_bits, seconds), members=size, n_bits=n_bits)
+    for payload_size in payloads:
+        payload = os.urandom(payload_size)
+        record('ping_pong', ping_pong(backend, payload, seconds), members=2, payload=payload_size)
+        if backend_name != 'local':
+            record('ping_pong_process', ping_pong(backend, payload, seconds, True), members=2, payload=payload_size)
+        for size in sizes:
+            if size * payload_size > MAX_VOLUME:
+                continue
+            record('multicast', fan_out(backend, size, payload, seconds, False), members=size, payload=payload_size)
+            record('broadcast', fan_out(backend, size, payload, seconds, True), members=size, payload=payload_size)
+            record('receive_from_any', receive_any(backend, size, payload, seconds), members=size,
+                   payload=payload_size)
+    return results
+
+
+if __name__ == "__main__":
+    backends = sys.argv[1].split(',') if len(sys.argv) > 1 else ['redis', 'local']
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    redis_host = sys.argv[3] if len(sys.argv) > 3 else 'localhost'
+    redis_port = int(sys.argv[4]) if len(sys.argv) > 4 else 6379
+    short = bool(os.environ.get('VS2LAB_BENCH_QUICK'))
+
+    options = {'redis': dict(backend='redis', host_ip=redis_host, port_no=redis_port), 'local': dict(backend='local'),
+               'shared': dict(backend=lab_local_store.SharedStore(), share_threshold=None)}
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'host': socket.gethostname(),
+              'python': platform.python_version(), 'seconds': duration, 'quick': short, 'results': []}
+    for name in backends:
+        report['results'] += run(name, options[name], duration, short)
+    print(json.dumps(report, indent=1))
@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of the lab_channel message codecs
+- measures encode and decode time and encoded size per codec
+- payloads of different shapes and sizes (protocol tuples, lists, blobs)
+- needs no redis, codecs are measured in isolation
+
+Usage: python codec_bench.py [repetitions]
+"""
+
+import array
+import sys
+import timeit
+
+from context import lab_codec
+
+
+class DBList:
+    """Stand-in for the lab2 rpc DBList"""
+
+    def __init__(self, basic_list):
+        self.value = list(basic_list)
+
+
+def payloads() -> list:
+    """
+    Build the benchmark payloads.
+    :return: list of (name, message) tuples
+    """
+    result = [('tuple', (42, '17', 'ENTER'))]
+    for size in [100, 10000, 1000000]:
+        result.append(('list[{}B]'.format(size), ['entry-{:06d}'.format(i) for i in range(size // 12)]))
+        result.append(('DBList[{}B]'.format(size), DBList('entry-{:06d}'.format(i) for i in range(size // 12))))
+        result.append(('bytes[{}B]'.format(size), b'x' * size))
+        result.append(('array[{}B]'.format(size), array.array('d', range(size // 8))))
+    return result
+
+
+def measure(codec: lab_codec.Codec, message: object, repetitions: int) -> tuple:
+    """
+    Time encoding and decoding of a message.
+    :return: (encode microseconds, decode microseconds, encoded size) or None if unsupported
+    """
+    try:
+        data = codec.encode(message)
+        codec.decode(data)
+    except (TypeError, ValueError):
+        return None
+    encode = min(timeit.repeat(lambda: codec.encode(message), number=repetitions, repeat=3)) / repetitions
+    decode = min(timeit.repeat(lambda: codec.decode(data), number=repetitions, repeat=3)) / repetitions
+    return encode * 1e6, decode * 1e6, len(data)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print("{:16} {:8} {:>12} {:>12} {:>10}".format('payload', 'codec', 'encode [us]', 'decode [us]', 'size [B]'))
+    for name, message in payloads():
+        for codec in lab_codec.CODECS.values():
+            result = measure(codec, message, n)
+            if result is None:
+                print("{:16} {:8} {:>12}".format(name, codec.name, 'unsupported'))
+            else:
+                print("{:16} {:8} {:12.1f} {:12.1f} {:10d}".format(name, codec.name, *result))
@@ -0,0 +1,95 @@
+"""
+Benchmark of the server-side Lua scripts of lab_channel
+- compares channel operations with scripts (one atomic call each) against
+  the pipelined client-side variants (strict and cached validation)
+- groups of 8, 64 and 256 members within this process
+- needs a running redis server (uses a namespace of its own, other keys are kept)
+
+Usage: python lua_bench.py [host] [port] [seconds per measurement]
+"""
+
+import os
+import sys
+import time
+
+from context import lab_channel
+
+VARIANTS = [
+    ('pipelined/strict', dict(scripts=False, strict=True)),
+    ('pipelined/cached', dict(scripts=False, strict=False)),
+    ('lua scripts', dict(scripts=True)),
+]
+
+
+def ops_per_second(operation, seconds: float) -> float:
+    """
+    Repeat an operation for some time.
+    :param operation: function to call
+    :param seconds: duration of the measurement
+    :return: number of calls per second
+    """
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        operation()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def run(host: str, port: int, size: int, options: dict, seconds: float) -> dict:
+    """
+    Measure multicast, selective receive and leave/join for a group of members.
+    :return: dict of operation names and ops/sec
+    """
+    namespace = 'lua-bench-{}'.format(os.getpid())
+    lab_channel.Channel(host_ip=host, port_no=port, namespace=namespace).clear()
+
+    # one channel instance per member, all bound within this process
+    channels = [lab_channel.Channel(n_bits=16, host_ip=host, port_no=port, namespace=namespace, **options)
+                for _ in range(size)]
+    members = [chan.join('bench') for chan in channels]
+    for chan, member in zip(channels, members):
+        chan.bind(member)
+    sender, receiver = channels[0], channels[1]
+    others = set(members[1:])
+
+    def multicast():
+        sender.send_to(others, ('DATA', 42))
+
+    def drain():
+        # every receiver gets one message per multicast, empty the inboxes again
+        sender.channel.delete(*[namespace + ':inbox:' + member for member in members[1:]])
+
+    def receive():
+        sender.send_to({members[1]}, ('DATA', 42))
+        receiver.receive_from({members[0]}, 1)
+
+    def leave_join():
+        chan = channels[-1]
+        chan.leave('bench')
+        chan.bind(chan.join('bench'))
+
+    result = {
+        'multicast': ops_per_second(multicast, seconds),
+    }
+    drain()
+    result['send+receive_from'] = ops_per_second(receive, seconds)
+    result['leave+join'] = ops_per_second(leave_join, seconds)
+    for chan in channels:
+        chan.close()
+    channels[0].clear()
+    return result
+
+
+if __name__ == "__main__":
+    redis_host = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
+    redis_port = int(sys.argv[2]) if len(sys.argv) > 2 else 6379
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+
+    print("{:>8} {:18} {:>14} {:>18} {:>12}".format(
+        'members', 'variant', 'multicast/s', 'send+receive/s', 'leave+join/s'))
+    for group_size in [8, 64, 256]:
+        for name, variant in VARIANTS:
+            ops = run(redis_host, redis_port, group_size, variant, duration)
+            print("{:>8} {:18} {:14.0f} {:18.0f} {:12.0f}".format(
+                group_size, name, ops['multicast'], ops['send+receive_from'], ops['leave+join']))
@@ -7,8 +7,8 @@ lab_logging.setup(stream_level=logging.DEBUG)
 logger = logging.getLogger('vs2lab.lab2.channel.runsrv')
 
 chan = lab_channel.Channel()
-chan.channel.flushall()
-logger.info('Flushed all redis keys.')
+chan.clear()  # just our namespace (VS2LAB_NAMESPACE) if set
+logger.info('Cleared the keys of the channel.')
 
 server = channel.Server()
 server.run()
@@ -7,8 +7,8 @@ lab_logging.setup(stream_level=logging.INFO)
 logger = logging.getLogger('vs2lab.lab2.rpc.runsrv')
 
 chan = lab_channel.Channel()
-chan.channel.flushall()
-logger.debug('Flushed all redis keys.')
+chan.clear()  # just our namespace (VS2LAB_NAMESPACE) if set
+logger.debug('Cleared the keys of the channel.')
 
 srv = rpc.Server()
 srv.run()
@@ -120,7 +120,7 @@ class ChordNode:
 
         # Initialize the node
         # Get all nodes from channel for bootstrapping
-        nodes = {node.decode() for node in self.channel.channel.smembers('node')}
+        nodes = self.channel.subgroup('node')
         others = list(nodes - {str(self.node_id)})
         for other_node in others:  # for all other ring nodes
             # register current ring locally (might change later)
@@ -138,17 +138,16 @@ class ChordNode:
             request = message[1]  # And the actual request
 
             # If sender is a node (that stays in the ring) then update known nodes
-            if request[0] != constChord.LEAVE and self.channel.channel.sismember('node', sender):
+            if request[0] != constChord.LEAVE and sender in self.channel.subgroup('node'):
                 self.add_node(sender)  # remember sender node
 
             if request[0] == constChord.STOP:  # this node is requested to shutdown
-                self.logger.debug("Node {:04n} received STOP from {:04n}."
-                                  .format(self.node_id, int(sender)))
+                self.logger.debug("Node %04d received STOP from %04d.", self.node_id, int(sender))
                 break
 
             if request[0] == constChord.LOOKUP_REQ:  # A lookup request
-                self.logger.info("Node {:04n} received LOOKUP {:04n} from {:04n}."
-                                 .format(self.node_id, int(request[1]), int(sender)))
+                self.logger.info("Node %04d received LOOKUP %04d from %04d.",
+                                 self.node_id, int(request[1]), int(sender))
 
                 # look up and return local successor 
                 next_id: int = self.local_successor_node(request[1])
@@ -160,13 +159,11 @@ class ChordNode:
 
             elif request[0] == constChord.JOIN:
                 # Join request (the node was already registered above)
-                self.logger.debug("Node {:04n} received JOIN from {:04n}."
-                                  .format(self.node_id, int(sender)))
+                self.logger.debug("Node %04d received JOIN from %04d.", self.node_id, int(sender))
                 # we don't care for storage re-location in this example
                 continue
             elif request[0] == constChord.LEAVE:  # Leave request
-                self.logger.info("Node {:04n} received LEAVE from {:04n}."
-                                 .format(self.node_id, int(sender)))
+                self.logger.info("Node %04d received LEAVE from %04d.", self.node_id, int(sender))
                 self.delete_node(sender)  # update known nodes
 
             self.recompute_finger_table()  # adjust finger-table based on updated node set
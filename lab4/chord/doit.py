@@ -8,6 +8,7 @@ Chord Application
 """
 
 import logging
+import os
 import sys
 import multiprocessing as mp
 
@@ -31,19 +32,20 @@ class DummyChordClient:
     def run(self):
         print("Implement me pls...")
         self.channel.send_to(  # a final multicast
-            {i.decode() for i in list(self.channel.channel.smembers('node'))},
+            self.channel.subgroup('node'),
             constChord.STOP)
 
 
-def create_and_run(num_bits, node_class, enter_bar, run_bar):
+def create_and_run(num_bits, node_class, enter_bar, run_bar, namespace):
     """
     Create and run a node (server or client role)
     :param num_bits: address range of the channel
     :param node_class: class of node
     :param enter_bar: barrier syncing channel population 
     :param run_bar: barrier syncing node creation
+    :param namespace: namespace of the channel
     """
-    chan = lab_channel.Channel(n_bits=num_bits)
+    chan = lab_channel.Channel(n_bits=num_bits, namespace=namespace)
     node = node_class(chan)
     enter_bar.wait()  # wait for all nodes to join the channel
     node.enter()  # do what is needed to enter the ring
@@ -60,9 +62,9 @@ if __name__ == "__main__":  # if script is started from command line
         m = int(sys.argv[1])
         n = int(sys.argv[2])
 
-    # Flush communication channel
-    chan = lab_channel.Channel()
-    chan.channel.flushall()
+    # Use a communication channel of our own, other runs may share the redis
+    namespace = 'chord-{}'.format(os.getpid())
+    chan = lab_channel.Channel(namespace=namespace)
 
     # we need to spawn processes for support of windows
     mp.set_start_method('spawn')
@@ -77,7 +79,7 @@ if __name__ == "__main__":  # if script is started from command line
         nodeproc = mp.Process(
             target=create_and_run,
             name="ChordNode-" + str(i),
-            args=(m, chord_node.ChordNode, bar1, bar2))
+            args=(m, chord_node.ChordNode, bar1, bar2, namespace))
         children.append(nodeproc)
         nodeproc.start()
 
@@ -85,10 +87,13 @@ if __name__ == "__main__":  # if script is started from command line
     clientproc = mp.Process(
         target=create_and_run,
         name="ChordClient",
-        args=(m, DummyChordClient, bar1, bar2))
+        args=(m, DummyChordClient, bar1, bar2, namespace))
     clientproc.start()
     clientproc.join()
 
     # wait for node processes to finish
     for nodeproc in children:
         nodeproc.join()
+
+    # remove what is left of this run
+    chan.clear()
@@ -7,6 +7,7 @@ Application with a critical section (CS)
 - terminates a random process to simulate a crash fault
 """
 
+import os
 import sys
 import time 
 import logging
@@ -21,15 +22,16 @@ lab_logging.setup(stream_level=logging.INFO, file_level=logging.DEBUG)
 logger = logging.getLogger("vs2lab.lab5.mutex.doit")
 
 
-def create_and_run(num_bits, proc_class, enter_bar, run_bar):
+def create_and_run(num_bits, proc_class, enter_bar, run_bar, namespace):
     """
     Create and run a peer
     :param num_bits: address range of the channel
     :param node_class: class of peer
     :param enter_bar: barrier syncing channel population 
     :param run_bar: barrier syncing bootstrap
+    :param namespace: namespace of the channel
     """
-    chan = lab_channel.Channel(n_bits=num_bits)
+    chan = lab_channel.Channel(n_bits=num_bits, namespace=namespace)
     proc = proc_class(chan)
     enter_bar.wait()  # wait for all peers to join the channel
     proc.init()  # do some bootstrapping
@@ -46,9 +48,9 @@ if __name__ == "__main__":  # if script is started from command line
         m = int(sys.argv[1])
         n = int(sys.argv[2])
 
-    # Flush communication channel
-    chan = lab_channel.Channel()
-    chan.channel.flushall()
+    # Use a communication channel of our own, other runs may share the redis
+    namespace = 'mutex-{}'.format(os.getpid())
+    chan = lab_channel.Channel(namespace=namespace)
 
     # we need to spawn processes for support of windows
     mp.set_start_method('spawn')
@@ -63,7 +65,7 @@ if __name__ == "__main__":  # if script is started from command line
         peer_proc = mp.Process(
             target=create_and_run,
             name="Peer-" + str(i),
-            args=(m, Process, bar1, bar2))
+            args=(m, Process, bar1, bar2, namespace))
         children.append(peer_proc)
         peer_proc.start()
 
@@ -81,3 +83,6 @@ if __name__ == "__main__":  # if script is started from command line
     # wait for peer procs to finish
     for peer_proc in children:
         peer_proc.join()
+
+    # remove what is left of this run (e.g. by the crashed process)
+    chan.clear()
@@ -3,6 +3,7 @@ import random
 import time
 
 from constMutex import ENTER, RELEASE, ALLOW
+from context import lab_logging
 
 
 class Process:
@@ -98,11 +99,11 @@ class Process:
             self.clock = max(self.clock, msg[0])  # Adjust clock value...
             self.clock = self.clock + 1  # ...and increment
 
-            self.logger.debug("{} received {} from {}.".format(
-                self.__mapid(),
-                "ENTER" if msg[2] == ENTER
-                else "ALLOW" if msg[2] == ALLOW
-                else "RELEASE", self.__mapid(msg[1])))
+            self.logger.debug("%s received %s from %s.",
+                              lab_logging.lazy(self.__mapid),
+                              "ENTER" if msg[2] == ENTER
+                              else "ALLOW" if msg[2] == ALLOW
+                              else "RELEASE", lab_logging.lazy(self.__mapid, msg[1]))
 
             if msg[2] == ENTER:
                 self.queue.append(msg)  # Append an ENTER request
@@ -138,8 +139,8 @@ class Process:
             # and random is true
             if len(self.all_processes) > 1 and \
                     random.choice([True, False]):
-                self.logger.debug("{} wants to ENTER CS at CLOCK {}."
-                    .format(self.__mapid(), self.clock))
+                self.logger.debug("%s wants to ENTER CS at CLOCK %s.",
+                                  lab_logging.lazy(self.__mapid), self.clock)
 
                 self.__request_to_enter()
                 while not self.__allowed_to_enter():
@@ -147,8 +148,8 @@ class Process:
 
                 # Stay in CS for some time ...
                 sleep_time = random.randint(0, 2000)
-                self.logger.debug("{} enters CS for {} milliseconds."
-                    .format(self.__mapid(), sleep_time))
+                self.logger.debug("%s enters CS for %s milliseconds.",
+                                  lab_logging.lazy(self.__mapid), sleep_time)
                 print(" CS <- {}".format(self.__mapid()))
                 time.sleep(sleep_time/1000)
 
@@ -9,6 +9,7 @@ Application performing a distributed commit
 
 import multiprocessing as mp
 import logging
+import os
 
 import coordinator
 import participant
@@ -19,15 +20,16 @@ lab_logging.setup(stream_level=logging.INFO, file_level=logging.DEBUG)
 logger = logging.getLogger("vs2lab.lab6.2pc.2pc")
 
 
-def create_and_run(num_bits, proc_class, enter_bar, run_bar):
+def create_and_run(num_bits, proc_class, enter_bar, run_bar, namespace):
     """
     Create and run a participant
     :param num_bits: address range of the channel
     :param node_class: class of participant
     :param enter_bar: barrier syncing channel population
     :param run_bar: barrier syncing bootstrap
+    :param namespace: namespace of the channel
     """
-    chan = lab_channel.Channel(n_bits=num_bits)
+    chan = lab_channel.Channel(n_bits=num_bits, namespace=namespace)
     proc = proc_class(chan)
     enter_bar.wait()  # wait for all participants to join the channel
     proc.init()  # do some bootstrapping
@@ -39,9 +41,9 @@ if __name__ == "__main__":  # if script is started from command line
     m = 8  # Number of bits for process ids
     n = 3  # Number of participants in the group
 
-    # Flush communication channel
-    chan = lab_channel.Channel()
-    chan.channel.flushall()
+    # Use a communication channel of our own, other runs may share the redis
+    namespace = '2pc-{}'.format(os.getpid())
+    chan = lab_channel.Channel(namespace=namespace)
 
     # we need to spawn processes for support of windows
     mp.set_start_method('spawn')
@@ -56,7 +58,7 @@ if __name__ == "__main__":  # if script is started from command line
         participant_proc = mp.Process(
             target=create_and_run,
             name="Participant-" + str(i),
-            args=(m, participant.Participant, bar1, bar2))
+            args=(m, participant.Participant, bar1, bar2, namespace))
         participants.append(participant_proc)
         participant_proc.start()
 
@@ -64,7 +66,7 @@ if __name__ == "__main__":  # if script is started from command line
     coordinator_proc = mp.Process(
         target=create_and_run,
         name="Coordinator",
-        args=(m, coordinator.Coordinator, bar1, bar2))
+        args=(m, coordinator.Coordinator, bar1, bar2, namespace))
     coordinator_proc.start()
 
     # wait for coordinator to finish
@@ -73,3 +75,6 @@ if __name__ == "__main__":  # if script is started from command line
     # wait for participants to finish
     for participant_proc in participants:
         participant_proc.join()
+
+    # remove what is left of this run
+    chan.clear()
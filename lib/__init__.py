@@ -1 +1,2 @@
-__all__ = ['lab_channel.py', 'lab_logging.py']
+__all__ = ['lab_channel.py', 'lab_codec.py', 'lab_local_store.py', 'lab_logging.py', 'lab_metrics.py', 'lab_netem.py',
+           'lab_shared_memory.py', 'lab_trace.py']
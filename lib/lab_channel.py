@@ -1,12 +1,870 @@
+import bisect
+import collections
+import contextvars
+import hashlib
+import itertools
 import logging
 import os
-import pickle
 import random
+import threading
+import time
 
 import redis
+import redis.asyncio
 
+from . import lab_codec, lab_local_store, lab_metrics, lab_shared_memory, lab_trace
 
-class Channel:
+# members bound to the current thread or task context, per channel (mapping of channel keys to bindings).
+# The mapping is copied on every change, as contexts created meanwhile share it with their parent.
+_BINDINGS = contextvars.ContextVar('vs2lab.channel.bindings', default={})
+# members the current context acts as during calls of member handles, ahead of _BINDINGS: the innermost call
+# as (channel key, binding, enclosing call), so calls do not copy the mapping
+_CALLS = contextvars.ContextVar('vs2lab.channel.calls', default=None)
+_CHANNEL_KEYS = itertools.count()
+
+
+class InboxFull(AssertionError):
+    """
+    A message could not be sent, because the inbox of a receiver has reached its length limit.
+    Nothing of the failed send operation has been delivered.
+    """
+
+
+class ChannelBase:
+    """
+    Common parts of Channel and AsyncChannel: member id space, redis key layout and envelope format.
+    See Channel for a description of the redis data structures.
+    """
+
+    EVENTS = 'member-events'
+    GROUP = 'members'
+    LIMITS = 'inbox-limits'
+    LEASES = 'leases'
+    HOSTS = 'member-hosts'
+    # envelope tag of handles to shared payloads, and the initial reference count of a payload while it is sent
+    SHARED_TAG = b'h'
+    SHARED_REFS = 1 << 40
+    # envelope tag of handles to shared memory segments
+    SEGMENT_TAG = b's'
+    # priority lanes of inboxes, highest priority first
+    LANES: tuple = ('control', 'data')
+    OVERFLOW_POLICIES = ('raise', 'block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, n_bits: int = 5, codec='pickle', compression=None, level: int = None,
+                 threshold: int = 1024, max_inbox: int = None, overflow: str = 'raise',
+                 overflow_timeout: float = 5, trace=None, share_threshold: int = 4096, share_ttl: int = 3600,
+                 namespace: str = None):
+        # namespace isolating the keys of this channel from other channels on the same redis (None: global keys),
+        # the environment variable VS2LAB_NAMESPACE sets it for all channels
+        self.namespace: str = namespace or os.environ.get('VS2LAB_NAMESPACE') or None
+        self.prefix: str = self.namespace + ':' if self.namespace else ''
+        # keys of the global member set and hashes, and the event channel, in this namespace
+        self._members: str = self._key('members')
+        self._limits: str = self._key(self.LIMITS)
+        self._leases: str = self._key(self.LEASES)
+        self._hosts: str = self._key(self.HOSTS)
+        self._events: str = self._key(self.EVENTS)
+        # codec (or codec name) to serialize messages send by this channel
+        self.codec: lab_codec.Codec = lab_codec.get(codec)
+        # compressor (or compressor name, None to disable) for serialized messages of at least threshold bytes
+        self.compressor: lab_codec.Compressor = lab_codec.compressor(compression, level)
+        self.threshold: int = threshold
+        # sizes of messages passed to the compressor, before and after compression
+        self.compression_stats: dict = {'messages': 0, 'compressed': 0, 'bytes_in': 0, 'bytes_out': 0, 'saved': 0}
+        # length limit of receiver inboxes without a limit of their own (None for unbounded)
+        self.max_inbox: int = max_inbox
+        # what to do with messages to full inboxes, and how long to block for policy 'block'
+        assert overflow in self.OVERFLOW_POLICIES, 'unknown overflow policy'
+        self.overflow: str = overflow
+        self.overflow_timeout: float = overflow_timeout
+        # tracer of this os process if tracing is enabled (trace directory or True for the working directory),
+        # the environment variable VS2LAB_TRACE enables tracing for all channels
+        trace = trace or os.environ.get('VS2LAB_TRACE')
+        self.tracer: lab_trace.Tracer = lab_trace.tracer('.' if trace is True else trace) if trace else None
+        # minimum envelope size of multicasts and broadcasts to be sent as handles to a shared payload (None: never)
+        # and the time to live of shared payloads in seconds
+        self.share_threshold: int = share_threshold
+        self.share_ttl: int = share_ttl
+        # create dict of local pid bindings, and the key of the context bindings of this channel (see _binding)
+        self.os_members = {}
+        self._context_key: int = next(_CHANNEL_KEYS)
+        # Number of bits for pid addresses
+        self.n_bits: int = n_bits
+        # Maximum corresponding pid
+        self.MAXPROC: int = pow(2, n_bits)
+
+    @staticmethod
+    def _decode_set(raw) -> set:
+        return {i.decode() for i in raw}
+
+    # Lua functions of the send scripts for inboxes of type ARGV[2]: the number of undelivered envelopes and
+    # dropping the oldest of them. Delivered entries of a stream inbox stay pending in the consumer group
+    # 'members' (GROUP) until they are acknowledged, they are older than all undelivered entries.
+    INBOX_FUNCTIONS = """
+            local stream = ARGV[2] == 'stream'
+            local function depth(key)
+                if not stream then
+                    return redis.call('LLEN', key), nil
+                end
+                local pending = redis.pcall('XPENDING', key, 'members')
+                if type(pending) ~= 'table' or pending.err or pending[1] == 0 then
+                    return redis.call('XLEN', key), '-'
+                end
+                return redis.call('XLEN', key) - pending[1], '(' .. pending[3]
+            end
+            local function trim(key, limit)
+                local n, first = depth(key)
+                if n <= limit then
+                    return 0
+                end
+                if stream then
+                    for _, entry in ipairs(redis.call('XRANGE', key, first, '+', 'COUNT', n - limit)) do
+                        redis.call('XDEL', key, entry[1])
+                    end
+                else
+                    redis.call('LTRIM', key, -limit, -1)
+                end
+                return n - limit
+            end
+    """
+
+    # Server-side scripts of the core operations. Each one validates membership and does its work atomically.
+    SCRIPTS = {
+        # KEYS: members, inbox limits, inbox per push
+        # ARGV: caller, inbox type, overflow policy, default inbox limit (0 for none),
+        #       number of pushes n, n receivers, n envelope indices, envelopes
+        'multicast': INBOX_FUNCTIONS + """
+            local policy = ARGV[3]
+            local n = tonumber(ARGV[5])
+            if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+                return redis.error_reply('unknown sender')
+            end
+            local limits = {}
+            local depths = {}
+            for i = 1, n do
+                local receiver = ARGV[5 + i]
+                if redis.call('SISMEMBER', KEYS[1], receiver) == 0 then
+                    return redis.error_reply('unknown receiver')
+                end
+                local key = KEYS[2 + i]
+                if not limits[key] then
+                    limits[key] = tonumber(redis.call('HGET', KEYS[2], receiver)) or tonumber(ARGV[4])
+                    depths[key] = depth(key)
+                end
+                depths[key] = depths[key] + 1
+                if limits[key] > 0 and depths[key] > limits[key] and (policy == 'raise' or policy == 'block') then
+                    return redis.error_reply('inbox full')
+                end
+            end
+            local dropped = 0
+            for i = 1, n do
+                local key = KEYS[2 + i]
+                local limit = limits[key]
+                if policy == 'drop_newest' and limit > 0 and depth(key) >= limit then
+                    dropped = dropped + 1
+                else
+                    local envelope = ARGV[5 + 2 * n + tonumber(ARGV[5 + n + i])]
+                    if stream then
+                        redis.call('XADD', key, '*', 'e', envelope)
+                    else
+                        redis.call('RPUSH', key, envelope)
+                    end
+                    if policy == 'drop_oldest' and limit > 0 then
+                        dropped = dropped + trim(key, limit)
+                    end
+                end
+            end
+            return dropped
+        """,
+        # KEYS: members, inbox limits
+        # ARGV: caller, inbox type, inbox key prefix, overflow policy, default inbox limit (0 for none), envelope,
+        #       inbox key suffix (lane)
+        'broadcast': INBOX_FUNCTIONS + """
+            local policy = ARGV[4]
+            if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+                return redis.error_reply('unknown sender')
+            end
+            local members = redis.call('SMEMBERS', KEYS[1])
+            local limits = {}
+            for _, member in ipairs(members) do
+                limits[member] = tonumber(redis.call('HGET', KEYS[2], member)) or tonumber(ARGV[5])
+                if limits[member] > 0 and depth(ARGV[3] .. member .. ARGV[7]) >= limits[member]
+                        and (policy == 'raise' or policy == 'block') then
+                    return redis.error_reply('inbox full')
+                end
+            end
+            local dropped = 0
+            for _, member in ipairs(members) do
+                local key = ARGV[3] .. member .. ARGV[7]
+                local limit = limits[member]
+                if policy == 'drop_newest' and limit > 0 and depth(key) >= limit then
+                    dropped = dropped + 1
+                else
+                    if stream then
+                        redis.call('XADD', key, '*', 'e', ARGV[6])
+                    else
+                        redis.call('RPUSH', key, ARGV[6])
+                    end
+                    if policy == 'drop_oldest' and limit > 0 then
+                        dropped = dropped + trim(key, limit)
+                    end
+                end
+            end
+            return {#members, dropped}
+        """,
+        # KEYS: control inbox, data inbox, stashed sender set
+        # ARGV: stash key prefix, '1' for any sender or '0', maximum number n of envelopes, wanted senders
+        'receive': """
+            local any = ARGV[2] == '1'
+            local n = tonumber(ARGV[3])
+            local wanted = {}
+            for i = 4, #ARGV do
+                wanted[ARGV[i]] = true
+            end
+            local result = {}
+            local stashed = redis.call('SMEMBERS', KEYS[3])
+            for lane, suffix in ipairs({':control', ''}) do
+                -- stashed set elements are sender ids with the lane suffix
+                for _, element in ipairs(stashed) do
+                    local sender = string.match(element, '^[^:]+')
+                    if #result < n and element == sender .. suffix and (any or wanted[sender]) then
+                        local stash = ARGV[1] .. element
+                        while #result < n do
+                            local envelope = redis.call('LPOP', stash)
+                            if not envelope then
+                                break
+                            end
+                            table.insert(result, envelope)
+                        end
+                        if redis.call('LLEN', stash) == 0 then
+                            redis.call('SREM', KEYS[3], element)
+                        end
+                    end
+                end
+                while #result < n do
+                    local envelope = redis.call('LPOP', KEYS[lane])
+                    if not envelope then
+                        break
+                    end
+                    local sender = string.sub(envelope, 1, string.find(envelope, '\\0', 1, true) - 1)
+                    if any or wanted[sender] then
+                        table.insert(result, envelope)
+                    else
+                        redis.call('RPUSH', ARGV[1] .. sender .. suffix, envelope)
+                        redis.call('SADD', KEYS[3], sender .. suffix)
+                    end
+                end
+            end
+            return result
+        """,
+        # KEYS: members, subgroup, inbox, stashed sender set, stream inbox, inbox limits, leases, lease key,
+        #       control inbox, member hosts
+        # ARGV: member, event channel, event, stash key prefix
+        'leave': """
+            if redis.call('SREM', KEYS[1], ARGV[1]) == 0 then
+                return redis.error_reply('member unknown')
+            end
+            redis.call('SREM', KEYS[2], ARGV[1])
+            for _, sender in ipairs(redis.call('SMEMBERS', KEYS[4])) do
+                redis.call('DEL', ARGV[4] .. sender)
+            end
+            redis.call('DEL', KEYS[3], KEYS[4], KEYS[5], KEYS[9])
+            redis.call('HDEL', KEYS[6], ARGV[1])
+            redis.call('HDEL', KEYS[7], ARGV[1])
+            redis.call('HDEL', KEYS[10], ARGV[1])
+            redis.call('DEL', KEYS[8])
+            redis.call('PUBLISH', ARGV[2], ARGV[3])
+            return 1
+        """,
+        # KEYS: members, leases, inbox limits, member hosts
+        # ARGV: lease key prefix, inbox key prefix, stream key prefix, stashed sender set key prefix,
+        #       stash key prefix, event channel, subgroup key prefix (namespace)
+        'reap': """
+            local reaped = {}
+            for _, pid in ipairs(redis.call('HKEYS', KEYS[2])) do
+                if redis.call('EXISTS', ARGV[1] .. pid) == 0 then
+                    local subgroup = redis.call('HGET', KEYS[2], pid)
+                    redis.call('SREM', KEYS[1], pid)
+                    redis.call('SREM', ARGV[7] .. subgroup, pid)
+                    for _, sender in ipairs(redis.call('SMEMBERS', ARGV[4] .. pid)) do
+                        redis.call('DEL', ARGV[5] .. pid .. ':' .. sender)
+                    end
+                    redis.call('DEL', ARGV[2] .. pid, ARGV[2] .. pid .. ':control', ARGV[3] .. pid, ARGV[4] .. pid)
+                    redis.call('HDEL', KEYS[2], pid)
+                    redis.call('HDEL', KEYS[3], pid)
+                    redis.call('HDEL', KEYS[4], pid)
+                    redis.call('PUBLISH', ARGV[6], 'leave ' .. pid .. ' ' .. subgroup)
+                    table.insert(reaped, pid)
+                end
+            end
+            return reaped
+        """,
+        # KEYS: shared payloads
+        # ARGV: '1' to release the references or '0' to keep them
+        'resolve': """
+            local payloads = {}
+            for i, key in ipairs(KEYS) do
+                payloads[i] = redis.call('HGET', key, 'd')
+                if ARGV[1] == '1' and redis.call('HINCRBY', key, 'n', -1) <= 0 then
+                    redis.call('DEL', key)
+                end
+            end
+            return payloads
+        """,
+    }
+
+    def _multicast_call(self, caller: str, batch: list, inbox: str = 'list', lane: str = 'data') -> tuple:
+        """
+        Construct keys and arguments of the multicast script.
+        :param caller: member identifier of the sender
+        :param batch: list of (destination list, envelope) tuples
+        :param inbox: kind of inboxes
+        :param lane: priority lane
+        :return: tuple of keys and args
+        """
+        pushes = [(destination, i + 1) for i, (dests, _) in enumerate(batch) for destination in dests]
+        keys = [self._members, self._limits] + [self._lane_key(destination, inbox, lane) for destination, _ in pushes]
+        args = [caller, inbox, self.overflow, self.max_inbox or 0, len(pushes)] \
+            + [destination for destination, _ in pushes] + [index for _, index in pushes] \
+            + [envelope for _, envelope in batch]
+        return keys, args
+
+    def _broadcast_call(self, caller: str, envelope: bytes, inbox: str = 'list', lane: str = 'data') -> tuple:
+        """
+        Construct keys and arguments of the broadcast script.
+        """
+        inbox_key = self._stream_key if inbox == 'stream' else self._inbox_key
+        return [self._members, self._limits], [caller, inbox, inbox_key(''), self.overflow, self.max_inbox or 0,
+                                               envelope, self._lane_suffix(lane) if inbox == 'list' else '']
+
+    def _receive_call(self, caller: str, sender_set, max_n: int = 1) -> tuple:
+        """
+        Construct keys and arguments of the receive script.
+        """
+        keys = [self._inbox_key(caller, 'control'), self._inbox_key(caller), self._stashed_key(caller)]
+        if sender_set is None:
+            return keys, [self._stash_key(caller, ''), '1', max_n]
+        return keys, [self._stash_key(caller, ''), '0', max_n] + list(sender_set)
+
+    def _leave_call(self, pid: str, subgroup: str) -> tuple:
+        """
+        Construct keys and arguments of the leave script.
+        """
+        keys = [self._members, self._key(subgroup), self._inbox_key(pid), self._stashed_key(pid), self._stream_key(pid),
+                self._limits, self._leases, self._lease_key(pid), self._inbox_key(pid, 'control'), self._hosts]
+        return keys, [pid, self._events, 'leave {} {}'.format(pid, subgroup), self._stash_key(pid, '')]
+
+    def _reap_call(self) -> tuple:
+        """
+        Construct keys and arguments of the reap script.
+        """
+        return [self._members, self._leases, self._limits, self._hosts], [
+            self._lease_key(''), self._inbox_key(''), self._stream_key(''), self._stashed_key(''),
+            self._stash_key('', '')[:-1], self._events, self.prefix]
+
+    @staticmethod
+    def _script_failed(error: Exception) -> None:
+        """
+        Turn validation errors reported by scripts into assertion errors (like the client-side checks).
+        :param error: redis error raised by a script call
+        :return: None, other errors are re-raised
+        """
+        if 'inbox full' in str(error):
+            raise InboxFull('inbox full') from None
+        for reason in ('unknown sender', 'unknown receiver', 'member unknown'):
+            if reason in str(error):
+                raise AssertionError(reason) from None
+        raise error
+
+    PROBES = 32
+
+    def _candidate_ids(self):
+        """
+        Generate member ids to claim: PROBES random ids first. Only if all of them have been taken already
+        (the id space is nearly full), a None is generated, and the member set sent back into the generator
+        yields a random free id. Then None is generated again before the next free id, and so on.
+        Shared by the sync and async join operations, which try to add the candidates to the member set.
+        """
+        for _ in range(self.PROBES):
+            yield str(random.randrange(self.MAXPROC))
+        while True:
+            members = yield None
+            yield self._free_id(members)
+
+    def _free_id(self, members: set) -> str:
+        """
+        Pick a random id that is not in the member set, in O(m log m) for m members
+        (without building the id space, which may have 2^64 ids).
+        :param members: set of member ids
+        :return: free member id
+        """
+        taken = sorted(int(pid) for pid in members)
+        assert len(taken) < self.MAXPROC, 'no free member id'
+        # the index-th free id: skip all taken ids up to it
+        new_pid = random.randrange(self.MAXPROC - len(taken))
+        for pid in taken:
+            if pid > new_pid:
+                break
+            new_pid += 1
+        return str(new_pid)
+
+    def _claim_id(self, sadd, smembers) -> str:
+        """
+        Claim an unused random member id by adding it to the global member set (see _candidate_ids).
+        :param sadd: function adding a value to a redis set (returns the number of added values)
+        :param smembers: function retrieving a redis set
+        :return: the new member id
+        """
+        candidates = self._candidate_ids()
+        for new_pid in candidates:
+            if new_pid is None:
+                new_pid = candidates.send(self._decode_set(smembers(self._members)))
+            if sadd(self._members, new_pid) == 1:
+                return new_pid
+
+    def _binding(self):
+        """
+        Retrieve the member the current context acts as on this channel: the member of the innermost
+        member handle call (see _call_as), or else the member bound to the context.
+        :return: binding (see bind), None if there is none
+        """
+        call = _CALLS.get()
+        while call is not None:
+            if call[0] == self._context_key:
+                return call[1]
+            call = call[2]
+        return _BINDINGS.get().get(self._context_key)
+
+    def _set_binding(self, binding) -> None:
+        """
+        Bind a member to the current context for this channel.
+        :param binding: binding (see bind)
+        :return: None
+        """
+        bindings = dict(_BINDINGS.get())
+        bindings[self._context_key] = binding
+        _BINDINGS.set(bindings)
+
+    def _unbind(self, binding) -> None:
+        """
+        Remove the binding of the current context for this channel, if it is the given one.
+        :param binding: binding (see bind)
+        :return: None
+        """
+        bindings = _BINDINGS.get()
+        if bindings.get(self._context_key) == binding:
+            bindings = dict(bindings)
+            del bindings[self._context_key]
+            _BINDINGS.set(bindings)
+
+    def _key(self, name: str) -> str:
+        """
+        Construct the redis key (or pub/sub channel) of a name in the namespace of the channel.
+        :param name: global key name or subgroup
+        :return: redis key
+        """
+        return self.prefix + name
+
+    def _pattern(self) -> str:
+        """
+        Construct the SCAN pattern matching all keys of the namespace (glob characters of the namespace escaped).
+        :return: key pattern
+        """
+        return ''.join('[' + c + ']' if c in '*?[' else c for c in self.prefix) + '*'
+
+    @staticmethod
+    def _lane_suffix(lane: str) -> str:
+        """
+        Construct the key suffix of a priority lane (none for data, so data inboxes keep their names).
+        :param lane: priority lane
+        :return: key suffix
+        """
+        return '' if lane == 'data' else ':' + lane
+
+    def _inbox_key(self, receiver: str, lane: str = 'data') -> str:
+        """
+        Construct inbox name of a receiver.
+        :param receiver: member identifier
+        :param lane: priority lane
+        :return: redis key
+        """
+        return self.prefix + 'inbox:' + receiver + self._lane_suffix(lane)
+
+    def _lane_key(self, receiver: str, inbox: str, lane: str) -> str:
+        """
+        Construct the name of the queue of a receiver to push to (stream inboxes have a single lane).
+        :param receiver: member identifier
+        :param inbox: kind of inboxes
+        :param lane: priority lane
+        :return: redis key
+        """
+        return self._stream_key(receiver) if inbox == 'stream' else self._inbox_key(receiver, lane)
+
+    # points per shard on the hash ring
+    SHARD_POINTS = 64
+
+    @staticmethod
+    def _hash(name: str) -> int:
+        """
+        Hash a name to a position on the hash ring.
+        :param name: member id or shard point name
+        :return: 64 bit position
+        """
+        return int.from_bytes(hashlib.md5(name.encode()).digest()[:8], 'big')
+
+    @classmethod
+    def _ring(cls, names: list) -> list:
+        """
+        Construct the consistent hash ring of shards. Every shard owns SHARD_POINTS points,
+        so adding a shard only moves about 1/n of all members to it.
+        :param names: shard names (e.g. host:port)
+        :return: sorted list of (position, shard index) tuples
+        """
+        return sorted((cls._hash('{}#{}'.format(name, point)), i)
+                      for i, name in enumerate(names) for point in range(cls.SHARD_POINTS))
+
+    @classmethod
+    def _shard_index(cls, ring: list, member: str) -> int:
+        """
+        Look up the shard of a member: the shard owning the first point on the ring at or after its hash.
+        :param ring: hash ring (see _ring)
+        :param member: member identifier
+        :return: shard index
+        """
+        i = bisect.bisect_left(ring, (cls._hash(member), -1))
+        return ring[i % len(ring)][1]
+
+    def _lease_key(self, member: str) -> str:
+        """
+        Construct the key of the lease of a member.
+        :param member: member identifier
+        :return: redis key
+        """
+        return self.prefix + 'lease:' + member
+
+    def _stream_key(self, receiver: str) -> str:
+        """
+        Construct name of the stream inbox of a receiver.
+        :param receiver: member identifier
+        :return: redis key
+        """
+        return self.prefix + 'stream:' + receiver
+
+    def _stash_key(self, receiver: str, sender: str, lane: str = 'data') -> str:
+        """
+        Construct name of the stash holding skipped envelopes from sender to receiver.
+        :param receiver: member identifier
+        :param sender: member identifier, or an element of the stashed sender set (sender id with lane suffix)
+        :param lane: priority lane
+        :return: redis key
+        """
+        return '{}stash:{}:{}{}'.format(self.prefix, receiver, sender, self._lane_suffix(lane))
+
+    def _payload_key(self, payload_id: str) -> str:
+        """
+        Construct the key of a shared payload.
+        :param payload_id: unique id
+        :return: redis key
+        """
+        return self.prefix + 'payload:' + payload_id
+
+    def _segment_key(self, name: str) -> str:
+        """
+        Construct the key of the reference count of a shared memory segment.
+        :param name: segment name
+        :return: redis key
+        """
+        return self.prefix + 'segment:' + name
+
+    def _stashed_key(self, receiver: str) -> str:
+        """
+        Construct name of the set of senders with a non-empty stash for receiver
+        (sender ids, with suffix ':<lane>' for stashes of lanes other than data).
+        :param receiver: member identifier
+        :return: redis key
+        """
+        return self.prefix + 'stashed:' + receiver
+
+    def _envelope(self, sender: str, message: object) -> bytes:
+        """
+        Tag a message with its sender and the codec used to serialize it.
+        Serialized messages of at least threshold bytes are compressed (if enabled and it saves space).
+        :param sender: member identifier
+        :param message: the message object
+        :return: serialized envelope
+        """
+        data = self.codec.encode(message)
+        stamp = b'' if self.tracer is None else lab_trace.TAG + self.tracer.stamp(sender)
+        if self.compressor is not None and len(data) + 1 >= self.threshold:
+            packed = self.compressor.compress(self.codec.tag + data)
+            stats = self.compression_stats
+            stats['messages'] += 1
+            stats['bytes_in'] += len(data) + 1
+            stats['bytes_out'] += min(len(packed), len(data) + 1)
+            if len(packed) < len(data) + 1:
+                stats['compressed'] += 1
+                stats['saved'] += len(data) + 1 - len(packed)
+                return b''.join([sender.encode(), b'\x00', stamp, self.compressor.tag, packed])
+        return b''.join([sender.encode(), b'\x00', stamp, self.codec.tag, data])
+
+    @staticmethod
+    def _body_offset(envelope: bytes) -> int:
+        """
+        Locate the tag of the serialized message in an envelope (behind sender id and trace stamp).
+        :param envelope: serialized envelope
+        :return: offset of the codec, compressor or shared payload tag
+        """
+        offset = envelope.index(b'\x00') + 1
+        if envelope[offset:offset + 1] == lab_trace.TAG:
+            offset += 1 + lab_trace.STAMP.size
+        return offset
+
+    def _shares(self, envelope: bytes, receivers) -> bool:
+        """
+        Check whether an envelope is to be sent as a handle to a shared payload.
+        :param envelope: serialized envelope
+        :param receivers: number of receivers (None if unknown)
+        :return: True if the payload is to be shared
+        """
+        return self.share_threshold is not None and len(envelope) >= self.share_threshold \
+            and (receivers is None or receivers > 1)
+
+    def _handles(self, envelopes: list) -> dict:
+        """
+        Find handles to shared payloads among received envelopes.
+        :param envelopes: received envelopes
+        :return: dict of envelope indices and payload keys
+        """
+        handles = {}
+        for i, envelope in enumerate(envelopes):
+            offset = self._body_offset(envelope)
+            if envelope[offset:offset + 1] == self.SHARED_TAG:
+                handles[i] = envelope[offset + 1:].decode()
+        return handles
+
+    def _segments(self, envelopes: list) -> dict:
+        """
+        Find handles to shared memory segments among received envelopes.
+        :param envelopes: received envelopes
+        :return: dict of envelope indices and (segment name, payload size) tuples
+        """
+        segments = {}
+        for i, envelope in enumerate(envelopes):
+            offset = self._body_offset(envelope)
+            if envelope[offset:offset + 1] == self.SEGMENT_TAG:
+                name, size = envelope[offset + 1:].decode().split(' ')
+                segments[i] = name, int(size)
+        return segments
+
+    def _resolved(self, envelopes: list, handles: dict, payloads: list) -> list:
+        """
+        Replace handles by envelopes with their shared payloads. Messages with expired payloads are dropped.
+        :param envelopes: received envelopes
+        :param handles: dict of envelope indices and payload keys (see _handles)
+        :param payloads: payloads in the order of handles (None if expired)
+        :return: list of envelopes
+        """
+        payloads = dict(zip(handles, payloads))
+        resolved = []
+        for i, envelope in enumerate(envelopes):
+            if i not in handles:
+                resolved.append(envelope)
+            elif payloads[i] is None:
+                self.logger.error("Shared payload %s has expired, message dropped", handles[i])
+            else:
+                resolved.append(envelope[:self._body_offset(envelope)] + payloads[i])
+        return resolved
+
+    @staticmethod
+    def _open(envelope: bytes) -> tuple:
+        """
+        Split an envelope into sender id and message.
+        :param envelope: serialized envelope
+        :return: tuple of sender id and message object
+        """
+        split = envelope.index(b'\x00')
+        body = memoryview(envelope)[split + 1:]
+        if body[:1] == lab_trace.TAG:
+            # skip the trace stamp
+            body = body[1 + lab_trace.STAMP.size:]
+        assert body[:1] != ChannelBase.SHARED_TAG, 'unresolved shared payload'
+        assert body[:1] != ChannelBase.SEGMENT_TAG, 'unresolved shared memory segment'
+        return envelope[:split].decode(), ChannelBase._decode(body)
+
+    @staticmethod
+    def _decode(body: memoryview) -> object:
+        """
+        Deserialize the body of an envelope (tag byte and serialized message).
+        :param body: envelope body
+        :return: message object
+        """
+        tag, data = body[:1].tobytes(), body[1:]
+        compressor = lab_codec.compressor_by_tag(tag)
+        if compressor is not None:
+            # compressed data starts with the codec tag
+            data = memoryview(compressor.decompress(data))
+            tag, data = data[:1].tobytes(), data[1:]
+        return lab_codec.by_tag(tag).decode(data)
+
+    def _lane_of(self, inbox_key: bytes) -> str:
+        """
+        Get the priority lane of an inbox.
+        :param inbox_key: redis key of the inbox, as returned by blpop
+        :return: priority lane
+        """
+        for lane in self.LANES:
+            if lane != 'data' and inbox_key.endswith(self._lane_suffix(lane).encode()):
+                return lane
+        return 'data'
+
+    @staticmethod
+    def _sender_of(envelope: bytes) -> str:
+        """
+        Extract the sender id of an envelope without deserializing the message.
+        :param envelope: serialized envelope
+        :return: sender id
+        """
+        return envelope[:envelope.index(b'\x00')].decode()
+
+
+class _Prefetcher:
+    """
+    Background thread moving the envelopes of a member from its inbox lanes into local buffers,
+    from which receive operations of the member are served (see Channel, prefetch).
+    """
+
+    def __init__(self, name: str, fetch, size: int, logger: logging.Logger):
+        """
+        :param name: thread name
+        :param fetch: function taking up to n envelopes per lane off the inbox, blocking a while for the first one,
+                      returns a list of (lane, envelope) tuples
+        :param size: number of envelopes buffered before fetching pauses, unless a receive operation waits
+                     for envelopes of senders that are not buffered (it may not be served otherwise)
+        :param logger: logger for fetch errors
+        """
+        self.size: int = size
+        self.__fetch = fetch
+        self.__logger = logger
+        # per lane in priority order: envelopes in FIFO order
+        self.__lanes: dict = {lane: collections.deque() for lane in ChannelBase.LANES}
+        self.__count: int = 0
+        # number of take() calls waiting for envelopes
+        self.__waiting: int = 0
+        self.__cond = threading.Condition()
+        self.__stopped: bool = False
+        self.__thread = threading.Thread(target=self.__run, name=name, daemon=True)
+
+    def start(self) -> None:
+        """
+        Start fetching. Envelopes put before (e.g. stashed ones) stay ahead of all fetched envelopes.
+        :return: None
+        """
+        self.__thread.start()
+
+    def put(self, lane: str, envelopes: list) -> None:
+        """
+        Add envelopes to the buffer of a lane (regardless of its size).
+        :param lane: priority lane
+        :param envelopes: envelopes in FIFO order
+        :return: None
+        """
+        with self.__cond:
+            self.__lanes[lane] += envelopes
+            self.__count += len(envelopes)
+            self.__cond.notify_all()
+
+    def __run(self) -> None:
+        while True:
+            with self.__cond:
+                while self.__count >= self.size and self.__waiting == 0 and not self.__stopped:
+                    self.__cond.wait()
+                if self.__stopped:
+                    return
+                room = max(1, self.size - self.__count)
+            try:
+                fetched = self.__fetch(room)
+            except redis.RedisError as error:
+                self.__logger.error("Prefetching failed: %s", error)
+                time.sleep(0.1)
+                continue
+            for lane in ChannelBase.LANES:
+                envelopes = [envelope for envelope_lane, envelope in fetched if envelope_lane == lane]
+                if envelopes:
+                    self.put(lane, envelopes)
+
+    def __pick(self, sender_set, max_n: int) -> list:
+        # the caller holds the lock
+        result = []
+        for envelopes in self.__lanes.values():
+            if sender_set is None:
+                while envelopes and len(result) < max_n:
+                    result.append(envelopes.popleft())
+            else:
+                picked = []
+                for i, envelope in enumerate(envelopes):
+                    if len(result) + len(picked) == max_n:
+                        break
+                    if ChannelBase._sender_of(envelope) in sender_set:
+                        picked.append(i)
+                result += [envelopes[i] for i in picked]
+                for i in reversed(picked):
+                    del envelopes[i]
+        self.__count -= len(result)
+        return result
+
+    def take(self, sender_set, max_n: int, timeout: float) -> list:
+        """
+        Take up to max_n buffered envelopes of any sender in sender_set, control lane first, FIFO order per sender.
+        Blocks until at least one is available.
+        :param sender_set: set of sender ids or None for any sender
+        :param max_n: maximum number of envelopes
+        :param timeout: timeout in seconds, 0 blocks forever
+        :return: list of envelopes, empty on timeout
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        with self.__cond:
+            while True:
+                result = self.__pick(sender_set, max_n)
+                if result:
+                    # there is room for the fetcher again
+                    self.__cond.notify_all()
+                    return result
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return result
+                # a full buffer of other senders' envelopes must not pause the fetcher now
+                self.__waiting += 1
+                self.__cond.notify_all()
+                try:
+                    self.__cond.wait(remaining)
+                finally:
+                    self.__waiting -= 1
+
+    def stop(self) -> None:
+        """
+        Stop fetching (the thread ends after its current fetch).
+        :return: None
+        """
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify_all()
+
+    def drain(self) -> dict:
+        """
+        Wait for the thread to end after stop() and hand out the envelopes that have not been received.
+        :return: dict of lanes and lists of buffered envelopes
+        """
+        if self.__thread.is_alive():
+            self.__thread.join()
+        with self.__cond:
+            buffered = {lane: list(envelopes) for lane, envelopes in self.__lanes.items()}
+            for envelopes in self.__lanes.values():
+                envelopes.clear()
+            self.__count = 0
+        return buffered
+
+
+class Channel(ChannelBase):
     """
     Channel implements a communication channel for persistent asynchronous message exchange between member processes.
     Member processes (short: members) have to explicitly join a common global channel and obtain an identifier.
@@ -15,261 +873,1852 @@ class Channel:
     Members can use the channel to send/receive a message to/from a set of members or all other members.
     Messages might be any serializable object.
 
-    Internally, the channel manages a set of queues.
-    A queue is associates with two channel members: a sender and a receiver.
-    It holds all messages from the sender to the receiver.
-    Send operations of a caller push messages to respective caller-receiver queues for a set of receivers.
-    Receive operations of a caller pop messages from respective sender-caller queues for a set of senders.
+    Internally, every member owns a single inbox queue.
+    Send operations of a caller push sender-tagged envelopes to the inboxes of a set of receivers.
+    Receive operations of a caller pop envelopes off its own inbox.
+    If the caller only wants messages of certain senders, envelopes of other senders are moved aside
+    into per-sender stash queues of the caller. They are served first by later receive operations.
+    Since an envelope of a sender is only stashed if all older envelopes of that sender have been
+    stashed or delivered before, messages are always delivered in FIFO order per sender.
 
     Queues are implemented as redis lists.
-    The key is a string representation of a list containing sender and receiver ids.
-    That is, sender and receiver can always be identified by parsing the queue keys.
+    An envelope is the sender id, a zero byte, the tag byte of the codec used by the sender
+    and the serialized message (see lab_codec). That is, the sender can always be identified
+    without deserializing the message, and receivers decode messages of any codec.
+    Tracing channels insert a trace stamp (see lab_trace) between the zero byte and the codec tag.
+    With compression enabled, serialized messages of at least threshold bytes are compressed together
+    with their codec tag and prefixed by the tag byte of the compressor instead. Receivers decompress
+    such envelopes automatically. compression_stats counts compressed messages and bytes saved.
 
     Redis data Structures:
 
-    Global Member Set
-        Key: "members"
-        Value: redis set of member ID strings
-    Subgroup Member Sets
-        Key: <subgroup>
-        Value: redis set of member ID strings
-    Global Queue List (containing all possible queue keys)
-        Key: "xchan"
-        Value: redis list of queue identifier objects
-    Queues
-        Key: "['<member1>','<member2>']"
-        Value: redis list of message objects send fom member1 to member2
-    """
+    Global Member Set
+        Key: "members"
+        Value: redis set of member ID strings
+    Subgroup Member Sets
+        Key: <subgroup>
+        Value: redis set of member ID strings
+    Inboxes
+        Key: "inbox:<receiver>" (data lane) and "inbox:<receiver>:control" (control lane)
+        Value: redis list of envelopes send to the receiver
+    Stashes
+        Key: "stash:<receiver>:<sender>" (data lane) and "stash:<receiver>:<sender>:control" (control lane)
+        Value: redis list of envelopes from sender that were skipped by receive operations of the receiver
+    Stashed Sender Sets
+        Key: "stashed:<receiver>"
+        Value: redis set of sender ID strings with a non-empty stash ("<sender>:control" for control lane stashes)
+    Stream Inboxes (with inbox='stream')
+        Key: "stream:<receiver>"
+        Value: redis stream of entries with the envelope in field "e",
+               read by the receiver as consumer "<receiver>" of consumer group "members"
+    Shared Payloads
+        Key: "payload:<random id>"
+        Value: redis hash with the envelope body in field "d" and the number of inboxes holding a handle in field "n"
+    Shared Memory Segments
+        Key: "segment:<segment name>"
+        Value: redis hash with the number of inboxes holding a handle to the segment in field "n"
+    Member Hosts
+        Key: "member-hosts"
+        Value: redis hash of member ID strings and the identity of their host (see lab_shared_memory)
+    Inbox Limits
+        Key: "inbox-limits"
+        Value: redis hash of member ID strings and the length limits they have set for their inboxes
+    Leases (of members joined with a lease)
+        Key: "leases"
+        Value: redis hash of member ID strings and their subgroups
+        Key: "lease:<member>"
+        Value: a string expiring after the lease time, unless renewed
+    Membership Events
+        Pub/sub channel: "member-events"
+        Messages: "join <member> <subgroup>", "leave <member> <subgroup>" and "limit <member> <limit>"
+
+    Namespaces:
+
+    With namespace='<name>' (or the environment variable VS2LAB_NAMESPACE), all keys above and the
+    event channel are prefixed by "<name>:", e.g. "<name>:members" and "<name>:inbox:<receiver>".
+    Channels of different namespaces share a redis without seeing each other, member ids are unique
+    per namespace only. clear() deletes the keys of one namespace (SCAN and UNLINK, no FLUSHALL),
+    so several experiments or benchmark runs can use the same redis at the same time.
+
+    Membership Cache:
+
+    Member and subgroup sets only change when members join or leave, so a channel keeps local copies
+    of them for validating send and receive operations. Join and leave publish membership events
+    that invalidate the local copies of all channels. Lookups of ids missing from the cache are
+    always re-checked against redis, so newly joined members are never rejected.
+    In strict mode, the cache is bypassed and every validation is done by redis.
+
+    Members per Process:
+
+    Operations act as the member bound by the caller. bind() binds a member to the os process and to the current
+    thread or asyncio task context, so one channel instance can serve many members, each in its own thread or task.
+    Threads and tasks that have not bound a member act as the member bound last by the os process (as before
+    contexts existed). member(pid) returns a handle (see Member) that calls operations as its member without any
+    binding, e.g. for thousands of members driven by one thread. All of them share the connection pool of the channel.
+
+    Prefetching:
+
+    With prefetch=<n>, a background thread per receiving member keeps moving envelopes off the inbox lanes of
+    the member into local buffers (up to about n envelopes per lane), and receive operations are served from them,
+    filtering senders locally. So receive operations of protocol loops take microseconds instead of a round trip.
+    FIFO order per sender and the priority of the control lane are kept. Envelopes stashed before are buffered first.
+    Buffered envelopes no longer count in inbox_depth(). close() puts those not received yet back in front of
+    the inbox, leave() drops them with the inbox. Prefetching needs list inboxes.
+
+    Server-Side Scripts:
+
+    On redis, multicast/broadcast sends, the non-blocking part of receive operations and leave are
+    registered Lua scripts (see SCRIPTS) called via EVALSHA. Each of them validates membership and does
+    its work in a single atomic call. Without script support (or with scripts=False), the same operations
+    are done by pipelines, validated by the membership cache.
+
+    Storage Backends:
+
+    By default, a channel connects to the redis server at host_ip:port_no, which needs to be redis >= 6.2
+    (LPOP with a count and SMISMEMBER are used, older servers fail with "unknown command" or
+    "wrong number of arguments"). With backend='local', it uses
+    the process-wide in-memory store of lab_local_store instead, so members in threads of one process
+    can communicate without any redis server. Members in several processes of one host can use a
+    lab_local_store.SharedStore created by their parent process as backend (inboxes are ring buffers in
+    shared memory, no server either). Any other redis-py compatible client object can be passed as backend, too.
+
+    Stream Inboxes:
+
+    With inbox='stream', inboxes are redis streams read via a consumer group (redis >= 5 is required,
+    and all members need to use the same kind of inbox). Messages returned by a receive operation are only
+    acknowledged (and deleted from the stream) by the next receive operation of the member or by ack().
+    A member that crashes before, gets them delivered again after restarting with the same member id
+    (at-least-once delivery). Envelopes skipped by selective receive operations simply stay pending in the
+    stream, so there are no stashes. receive_batch() returns up to max_n messages per call.
+    Inbox depths and limits count the entries not delivered yet, like the envelopes queued in list inboxes.
+
+    Tracing:
+
+    With trace=<directory> (or the environment variable VS2LAB_TRACE set to a directory), envelopes carry a trace
+    stamp and send/receive events are recorded to a per-process ring buffer in that directory. Merge the buffers
+    with "python -m lib.lab_trace <directory>". Without tracing, envelopes and operations are unchanged.
+
+    Shared Payloads:
+
+    Multicasts and broadcasts of envelopes of at least share_threshold bytes store the serialized message once,
+    under a payload key with a reference count and a time to live (share_ttl), and push just a handle
+    (tag byte 'h' and the payload key) to the inboxes. Receive operations resolve handles and release
+    their reference; the last one deletes the payload. Payloads whose handles are dropped without being
+    received (by leave, reaping, inbox limits) expire after share_ttl. Stream inboxes may deliver entries again,
+    so their receivers never release payloads, which expire instead.
+
+    Shared Memory:
+
+    With shm_threshold set, envelopes of at least shm_threshold bytes sent by send_to() or send_to_all() to members
+    that have all joined on this host are not pushed through redis. The serialized message is copied into a
+    shared memory segment (see lab_shared_memory) with a reference count in redis, and a handle with the segment
+    name is pushed instead. Receivers map the segment and decode the message right from it, so memoryviews sent
+    with the pickle5 codec arrive as views of the segment without any copy. Such segments stay mapped until
+    the receiver calls release(message), all others are unmapped immediately. The last receiver unlinks the
+    segment. Segments whose handles are dropped unreceived are removed by reap() after share_ttl.
+
+    Bounded Inboxes:
+
+    Members can limit the length of their own inbox with limit_inbox(), and a channel can set a default
+    limit (max_inbox) for receivers that have not. What happens to messages sent to a full inbox depends on the
+    overflow policy of the sending channel: 'raise' fails the send operation with InboxFull (nothing is
+    delivered), 'block' retries it until there is room or overflow_timeout has passed (then it raises),
+    'drop_oldest' trims the inbox to the limit after pushing, and 'drop_newest' does not push to full inboxes.
+    Dropped messages are counted in the messages_dropped metric of the sender. Senders can adapt their rate
+    by checking inbox_depth(). With scripts, limits are enforced atomically. Otherwise, inbox depths are
+    read before pushing, so concurrent senders may overshoot a limit a bit.
+
+    Leases:
+
+    Members that never leave (e.g. terminated processes) would stay registered forever and keep their queues.
+    With lease=<seconds>, members joined by a channel hold a lease key that expires after lease seconds.
+    A heartbeat thread of the channel renews the leases of its members every lease/3 seconds and reaps members
+    whose lease has expired: they are removed from the member and subgroup sets, and all their queues are deleted
+    (like on leave). reap() does the same on demand. Members without lease (the default) are never reaped,
+    so messages to crashed members keep being queued, as some labs expect.
+
+    Priority Lanes:
+
+    Inboxes have two lanes, 'control' and 'data' (the default). Send operations take a lane argument, e.g.
+    send_to({pid}, ('ELECTION', 3), lane='control') for protocol messages that must not wait behind a backlog
+    of bulk data. Receive operations always serve the control lane first (its stashes, then its inbox) and
+    block on both lanes. Messages are delivered in FIFO order per sender and lane, but a control message may
+    overtake data messages sent before it. Inbox limits apply to each lane separately, inbox_depth() counts both.
+    Stream inboxes have a single lane, the lane argument is ignored there.
+
+    Sharding:
+
+    With shards=[(host, port), ...] (or redis clients), queues are spread over several redis servers.
+    The inbox, stream and stashes of a member are placed on a shard by consistent hashing of its id
+    (SHARD_POINTS points per shard on a hash ring), so every member blocks on a single server.
+    The first shard (primary) holds all other keys: membership, subgroups, limits, leases and shared payloads.
+    Sends push to each shard in one round trip. Server-side scripts need all keys of a call on one server,
+    so sharded channels do not use them, and strict mode validates members before pushing instead of
+    compensating afterwards. AsyncChannel is not sharded.
+    """
+
+    def __init__(self, n_bits: int = 5, host_ip: str = 'localhost', port_no: int = 6379, strict: bool = False,
+                 codec='pickle', backend='redis', inbox: str = 'list', scripts: bool = True,
+                 compression=None, level: int = None, threshold: int = 1024, metrics: bool = True,
+                 max_inbox: int = None, overflow: str = 'raise', overflow_timeout: float = 5, lease: float = None,
+                 trace=None, share_threshold: int = 4096, share_ttl: int = 3600, shm_threshold: int = None,
+                 prefetch: int = None, shards: list = None, namespace: str = None):
+        super().__init__(n_bits, codec, compression, level, threshold, max_inbox, overflow, overflow_timeout, trace,
+                         share_threshold, share_ttl, namespace)
+        # minimum envelope size of messages to members on this host to be sent in shared memory segments
+        # (None: never), and segments mapped by received messages still in use (see release)
+        self.shm_threshold: int = shm_threshold if lab_shared_memory.AVAILABLE else None
+        self.__mapped: list = []
+        self.__mapped_lock = threading.Lock()
+        # all members bound to this channel or used by handles
+        # (the member bound to the current context is held by _BINDINGS, with the os pid binding it)
+        self.__bound: set = set()
+        # lease time of members joined by this channel in seconds (None for no lease)
+        self.lease: float = lease
+        # members holding a lease renewed by this channel, and the heartbeat thread renewing them
+        self.__leased: set = set()
+        self.__heartbeat = None
+        self.__stopped = threading.Event()
+        # operation latencies, traffic and inbox depths (see stats)
+        self.metrics = lab_metrics.Metrics(metrics)
+        # kind of inboxes: 'list' or 'stream'
+        assert inbox in ('list', 'stream'), 'unknown inbox type'
+        self.inbox: str = inbox
+        # per receiving member: skipped stream entries and entries to be acknowledged
+        self.__streams: dict = {}
+        # number of envelopes per receiving member to move ahead into a local buffer (None: no prefetching),
+        # and the prefetchers of the members
+        assert prefetch is None or inbox == 'list', 'prefetching needs list inboxes'
+        self.prefetch: int = prefetch
+        self.__prefetchers: dict = {}
+        self.__prefetchers_lock = threading.Lock()
+        # create client of the storage backend
+        if shards:
+            # redis endpoints holding the queues, the first one (primary) holds all other keys, too
+            self.__shards: list = [redis.StrictRedis(host=shard[0], port=shard[1], db=0)
+                                   if isinstance(shard, tuple) else shard for shard in shards]
+            self.__ring: list = self._ring(['{}:{}'.format(*shard) if isinstance(shard, tuple) else 'shard-{}'.format(i)
+                                            for i, shard in enumerate(shards)])
+            self.channel = self.__shards[0]
+        elif backend == 'redis':
+            self.channel = redis.StrictRedis(host=host_ip, port=port_no, db=0)
+        elif backend == 'local':
+            self.channel = lab_local_store.client()
+        else:
+            self.channel = backend
+        if not shards:
+            self.__shards = [self.channel]
+            self.__ring = None
+        # shard index per member id
+        self.__shard_of: dict = {}
+        # Validate membership by the backend instead of the local cache
+        # (always for backends without pub/sub, lookups are cheap there)
+        self.strict: bool = strict or not hasattr(self.channel, 'pubsub')
+        # registered server-side scripts (if enabled and supported by the backend, scripts need all keys on one shard)
+        self.__scripts: dict = None
+        if scripts and hasattr(self.channel, 'register_script') and self.__ring is None:
+            self.__scripts = {name: self.channel.register_script(src) for name, src in self.SCRIPTS.items()}
+        # local copies of member and subgroup sets (keyed by redis key)
+        self.__cache: dict = {}
+        # incremented by every invalidation, guards against caching stale reads
+        self.__generation: int = 0
+        self.__cache_lock = threading.Lock()
+        # pub/sub listener thread for membership events (started on first cached lookup)
+        self.__listener = None
+        # create instance logger
+        self.logger = logging.getLogger('vs2lab.channel.Channel')
+        self.logger.debug('New Channel created.')
+
+    def __invalidate(self, event=None) -> None:
+        """
+        Drop all cached member and subgroup sets.
+        :param event: the pub/sub message that triggered the invalidation (if any)
+        :return: None
+        """
+        with self.__cache_lock:
+            self.__generation += 1
+            self.__cache = {}
+
+    def __listen(self) -> None:
+        """
+        Subscribe to membership events, unless already done.
+        We wait for the subscription to be confirmed before the cache is filled,
+        so that no event can slip through between reading a set and subscribing.
+        :return: None
+        """
+        if self.__listener is not None:
+            return
+        pubsub = self.channel.pubsub()
+        pubsub.subscribe(**{self._events: self.__invalidate})
+        while pubsub.get_message(timeout=1) is None:
+            pass
+        pubsub.ignore_subscribe_messages = True
+        self.__invalidate()
+        self.__listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self) -> None:
+        """
+        Stop listening for membership events.
+        :return: None
+        """
+        if self.__listener is not None:
+            self.__listener.stop()
+            self.__listener = None
+        if self.__heartbeat is not None:
+            self.__stopped.set()
+            self.__heartbeat.join()
+            self.__heartbeat = None
+        with self.__prefetchers_lock:
+            prefetchers, self.__prefetchers = self.__prefetchers, {}
+        for prefetcher in prefetchers.values():
+            prefetcher.stop()
+        for pid, prefetcher in prefetchers.items():
+            # put envelopes that have not been received back in front of the inbox
+            for lane, envelopes in prefetcher.drain().items():
+                if envelopes:
+                    self.__queues(pid).lpush(self._inbox_key(pid, lane), *reversed(envelopes))
+        self.__invalidate()
+
+    def __cached(self, key: str, load):
+        """
+        Retrieve a value derived from a redis key, from the local cache unless in strict mode.
+        :param key: redis key
+        :param load: function reading the value from redis
+        :return: the value
+        """
+        if self.strict:
+            return load()
+        self.__listen()
+        with self.__cache_lock:
+            cached = self.__cache.get(key)
+            generation = self.__generation
+        if cached is not None:
+            return cached
+        value = load()
+        with self.__cache_lock:
+            if generation == self.__generation:
+                self.__cache[key] = value
+        return value
+
+    def __cached_set(self, key: str) -> set:
+        """
+        Retrieve a member or subgroup set, from the local cache unless in strict mode.
+        :param key: redis key of the set
+        :return: set of member ids
+        """
+        return self.__cached(key, lambda: self._decode_set(self.channel.smembers(key)))
+
+    def __limits(self, destinations) -> dict:
+        """
+        Look up the effective inbox limits of receivers (limit set by the receiver or max_inbox).
+        :param destinations: iterable of member ids
+        :return: dict of bounded receivers and their limits
+        """
+        limits = self.__cached(self._limits, lambda: {k.decode(): int(v)
+                                                      for k, v in self.channel.hgetall(self._limits).items()})
+        result = {}
+        for destination in destinations:
+            limit = limits.get(destination, self.max_inbox)
+            if limit:
+                result[destination] = limit
+        return result
+
+    def __queues(self, pid: str):
+        """
+        Get the client of the shard holding the queues of a member.
+        :param pid: member identifier
+        :return: redis client
+        """
+        if self.__ring is None:
+            return self.channel
+        index = self.__shard_of.get(pid)
+        if index is None:
+            index = self.__shard_of[pid] = self._shard_index(self.__ring, pid)
+        return self.__shards[index]
+
+    def __by_shard(self, items: list, member=lambda item: item) -> list:
+        """
+        Group items by the shard holding the queues of their member.
+        :param items: list of items
+        :param member: function getting the member id of an item
+        :return: list of (redis client, list of items) tuples
+        """
+        if self.__ring is None:
+            return [(self.channel, items)]
+        groups = {}
+        for item in items:
+            groups.setdefault(id(self.__queues(member(item))), []).append(item)
+        return [(self.__queues(member(group[0])), group) for group in groups.values()]
+
+    def __known(self, pids) -> bool:
+        """
+        Check if all given ids are members.
+        Ids that are missing in the cache are re-checked by redis.
+        :param pids: iterable of member ids
+        :return: True if all ids are members
+        """
+        pids = [str(pid) for pid in pids]
+        members = self.__cached_set(self._members)
+        missing = [pid for pid in pids if pid not in members]
+        if len(missing) == 0:
+            return True
+        if not all(self.channel.smismember(self._members, missing)):
+            return False
+        # someone joined and we have not been notified yet
+        self.__invalidate()
+        return True
+
+    def join(self, subgroup: str) -> str:
+        """
+        Join a process as a member to the global channel and associate it with a (sub)group. 
+        Only members can communicate over the channel. 
+        Subgroups can be used to retrieve a specific set of processes later (e.g. all servers).
+        :param subgroup: an identifier for the grouping
+        :return: global member id of the process.
+        """
+        with self.metrics.timer('op_seconds', 'join'):
+            # SADD only adds an id that is not yet a member, so claiming a random id is atomic
+            # without a transaction. Random probing costs O(1) per attempt for any id space size.
+            new_pid = self._claim_id(self.channel.sadd, self.channel.smembers)
+            with self.channel.pipeline() as pipe:
+                pipe.sadd(self._key(subgroup), new_pid)
+                pipe.hset(self._hosts, new_pid, lab_shared_memory.HOST)
+                if self.lease:
+                    pipe.set(self._lease_key(new_pid), subgroup, px=int(self.lease * 1000))
+                    pipe.hset(self._leases, new_pid, subgroup)
+                pipe.publish(self._events, 'join {} {}'.format(new_pid, subgroup))
+                pipe.execute()
+            self.__invalidate()
+            if self.lease:
+                self.__leased.add(new_pid)
+                self.__start_heartbeat()
+            self.logger.info("Member %s joining %s.", new_pid, subgroup)
+
+            return new_pid
+
+    def leave(self, subgroup: str):
+        """
+        Unregister a process from the global channel (and subgroup).
+        Messages that have not been received yet are deleted.
+        :param subgroup: subgroup identifier
+        :return: None
+        """
+        with self.metrics.timer('op_seconds', 'leave'):
+            # retrieve member id of the caller
+            os_pid: int = os.getpid()
+            pid: str = self.__caller()
+            self.logger.info("Member %s leaving %s", pid, subgroup)
+
+            # remove global member element, member id from subgroup set and all queues of the member
+            if self.__scripts is not None:
+                keys, args = self._leave_call(pid, subgroup)
+                try:
+                    self.__scripts['leave'](keys=keys, args=args)
+                except redis.ResponseError as error:
+                    self._script_failed(error)
+            else:
+                assert self.channel.sismember(self._members, pid), 'member unknown'
+                self.__drop_queues(pid)
+                with self.channel.pipeline() as pipe:
+                    pipe.srem(self._members, pid)
+                    pipe.srem(self._key(subgroup), pid)
+                    pipe.hdel(self._limits, pid)
+                    pipe.hdel(self._leases, pid)
+                    pipe.hdel(self._hosts, pid)
+                    pipe.delete(self._lease_key(pid))
+                    pipe.publish(self._events, 'leave {} {}'.format(pid, subgroup))
+                    pipe.execute()
+            # remove bindings
+            if self.os_members.get(os_pid) == pid:
+                del self.os_members[os_pid]
+            self._unbind((os_pid, pid))
+            self.__bound.discard(pid)
+            self.__streams.pop(pid, None)
+            with self.__prefetchers_lock:
+                prefetcher = self.__prefetchers.pop(pid, None)
+            if prefetcher is not None:
+                prefetcher.stop()
+            self.__leased.discard(pid)
+            self.__invalidate()
+
+    def __start_heartbeat(self) -> None:
+        """
+        Start the heartbeat thread, unless already running.
+        :return: None
+        """
+        if self.__heartbeat is not None:
+            return
+        self.__stopped.clear()
+        self.__heartbeat = threading.Thread(target=self.__beat, name='vs2lab-channel-heartbeat', daemon=True)
+        self.__heartbeat.start()
+
+    def __beat(self) -> None:
+        """
+        Renew the leases of our members and reap expired ones every lease/3 seconds, until the channel is closed.
+        :return: None
+        """
+        while not self.__stopped.wait(self.lease / 3):
+            try:
+                self.renew()
+                self.reap()
+            except redis.RedisError as error:
+                # the next beat may do better, leases last for three beats
+                self.logger.warning("Heartbeat failed: %s", error)
+
+    def renew(self) -> None:
+        """
+        Renew the leases of all members joined by this channel (done by the heartbeat thread).
+        :return: None
+        """
+        pids = list(self.__leased)
+        with self.channel.pipeline(transaction=False) as pipe:
+            for pid in pids:
+                pipe.pexpire(self._lease_key(pid), int(self.lease * 1000))
+            renewed = pipe.execute()
+        for pid, alive in zip(pids, renewed):
+            if not alive:
+                self.logger.warning("Lease of member %s has expired", pid)
+
+    def reap(self) -> list:
+        """
+        Remove all members whose lease has expired, with all their queues.
+        With shm_threshold set, shared memory segments older than share_ttl are removed, too.
+        :return: list of reaped member ids
+        """
+        if self.shm_threshold is not None:
+            lab_shared_memory.sweep(self.share_ttl)
+        if self.__scripts is not None:
+            keys, args = self._reap_call()
+            reaped = [pid.decode() for pid in self.__scripts['reap'](keys=keys, args=args)]
+        else:
+            leases = {k.decode(): v.decode() for k, v in self.channel.hgetall(self._leases).items()}
+            pids = list(leases)
+            with self.channel.pipeline(transaction=False) as pipe:
+                for pid in pids:
+                    pipe.exists(self._lease_key(pid))
+                alive = pipe.execute()
+            reaped = [pid for pid, live in zip(pids, alive) if not live]
+            for pid in reaped:
+                self.__drop_queues(pid)
+                with self.channel.pipeline() as pipe:
+                    pipe.srem(self._members, pid)
+                    pipe.srem(self._key(leases[pid]), pid)
+                    pipe.hdel(self._limits, pid)
+                    pipe.hdel(self._leases, pid)
+                    pipe.hdel(self._hosts, pid)
+                    pipe.publish(self._events, 'leave {} {}'.format(pid, leases[pid]))
+                    pipe.execute()
+        if reaped:
+            self.__invalidate()
+            self.logger.info("Reaped members %s", reaped)
+        return reaped
+
+    def __drop_queues(self, pid: str) -> None:
+        """
+        Delete all queues of a member (inbox lanes, stream and stashes).
+        :param pid: member identifier
+        :return: None
+        """
+        queues = self.__queues(pid)
+        stashes = [self._stash_key(pid, sender)
+                   for sender in self._decode_set(queues.smembers(self._stashed_key(pid)))]
+        queues.delete(*[self._inbox_key(pid, lane) for lane in self.LANES], self._stashed_key(pid),
+                      self._stream_key(pid), *stashes)
+
+    def clear(self, batch_size: int = 1000) -> int:
+        """
+        Delete all keys of the namespace of the channel on all shards (all keys if it has no namespace).
+        Keys are scanned and unlinked in batches, so redis keeps serving other namespaces meanwhile.
+        Use it instead of flushall() to start an experiment afresh or to clean up after it.
+        :param batch_size: number of keys scanned and unlinked per round trip
+        :return: number of deleted keys
+        """
+        deleted = 0
+        for client in self.__shards:
+            batch = []
+            for key in client.scan_iter(match=self._pattern(), count=batch_size):
+                batch.append(key)
+                if len(batch) == batch_size:
+                    deleted += client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += client.unlink(*batch)
+        self.__invalidate()
+        return deleted
+
+    def exists(self, pid: str) -> bool:
+        """
+        Check if pid is in global member set
+        :param pid: process identifier
+        :return: boolean value, true if pid is a member
+        """
+        if self.strict:
+            return self.channel.sismember(self._members, pid)
+        return self.__known([pid])
+
+    def bind(self, pid: str) -> int:
+        """
+        Associate os pid and the current context (thread or asyncio task) with channel member id.
+        Thus a caller does not need to provide its id for every subsequent call.
+        Calls from a context that has bound a member act as that member, all others as the member
+        bound last by the os process.
+        :param pid: identifier of process member
+        :return: os pid value
+        """
+        # retrieve os pid and map to given member id
+        os_pid: int = os.getpid()
+        self.os_members[os_pid] = pid
+        self._set_binding((os_pid, pid))
+        self.__bound.add(pid)
+        self.logger.debug("Member %s bound %s", pid, os_pid)
+        return os_pid
+
+    def member(self, pid: str) -> 'Member':
+        """
+        Get a handle of a member, for calling channel operations as that member without binding it.
+        :param pid: identifier of member
+        :return: Member handle
+        """
+        self.__bound.add(pid)
+        return Member(self, pid)
+
+    def _call_as(self, pid: str, operation, *args, **kwargs):
+        """
+        Call a channel operation as a member (see Member).
+        :param pid: identifier of member
+        :param operation: bound method of this channel
+        :return: result of the operation
+        """
+        token = _CALLS.set((self._context_key, (os.getpid(), pid), _CALLS.get()))
+        try:
+            return operation(*args, **kwargs)
+        finally:
+            _CALLS.reset(token)
+
+    def __caller(self) -> str:
+        """
+        Look up the member id of the caller: the member bound to the current context, if bound by this os process
+        (not inherited by a forked child), or else the member bound to the os pid.
+        :return: member id
+        """
+        os_pid: int = os.getpid()
+        binding = self._binding()
+        if binding is not None and binding[0] == os_pid:
+            return binding[1]
+        return self.os_members[os_pid]
+
+    def caller(self) -> str:
+        """
+        Retrieve the member id the current context acts as (see bind).
+        :return: member id
+        """
+        return self.__caller()
+
+    def subgroup(self, subgroup: str) -> set:
+        """
+        Retrieve members of a subgroup.
+        :param subgroup: subgroup string identifier
+        :return: set of member process identifiers
+        """
+        return set(self.__cached_set(self._key(subgroup)))
+
+    def members(self) -> set:
+        """
+        Retrieve all members of the channel.
+        :return: set of member process identifiers
+        """
+        return set(self.__cached_set(self._members))
+
+    def limit_inbox(self, limit: int = None) -> None:
+        """
+        Limit the length of the inbox of the calling member. Senders apply their overflow policy
+        to messages that would exceed the limit (see class doc).
+        :param limit: maximum number of queued messages, None to remove the limit
+        :return: None
+        """
+        pid: str = self.__caller()
+        assert self.exists(pid), 'member unknown'
+        with self.channel.pipeline() as pipe:
+            if limit:
+                pipe.hset(self._limits, pid, limit)
+            else:
+                pipe.hdel(self._limits, pid)
+            pipe.publish(self._events, 'limit {} {}'.format(pid, limit or 0))
+            pipe.execute()
+        self.__invalidate()
+
+    def new_trace(self) -> None:
+        """
+        Start a new trace with the next message of the calling member (if tracing is enabled, see lab_trace).
+        :return: None
+        """
+        if self.tracer is not None:
+            self.tracer.new_trace(self.__caller())
+
+    def inbox_depth(self, pid: str = None) -> int:
+        """
+        Retrieve the number of messages queued in the inbox of a member (without stashed messages).
+        Senders may use it to adapt their rate to slow receivers.
+        :param pid: member identifier, None for the calling member
+        :return: inbox length
+        """
+        if pid is None:
+            pid = self.__caller()
+        return self.__depths([pid])[0]
+
+    def stats(self) -> dict:
+        """
+        Take a snapshot of the metrics of this channel instance:
+        counters messages_in/out and bytes_in/out per member, histograms op_seconds per operation
+        (failures counted in op_seconds_errors), receive_wait_seconds (blocked in BLPOP/XREADGROUP) and
+        receive_processing_seconds (the rest of receive operations) per member, gauges inbox_depth
+        of the locally bound members (queried now) and the compression statistics.
+        :return: dict with 'counters', 'gauges' and 'histograms' (see lab_metrics.Metrics.snapshot)
+        """
+        members = sorted(self.__bound | set(self.os_members.values()))
+        for pid, depth in zip(members, self.__depths(members)):
+            self.metrics.gauge('inbox_depth', pid, depth)
+        for name, value in self.compression_stats.items():
+            self.metrics.gauge('compression', name, value, label='stat')
+        return self.metrics.snapshot()
 
-    def __init__(self, n_bits: int = 5, host_ip: str = 'localhost', port_no: int = 6379):
-        # create redis client
-        self.channel = redis.StrictRedis(host=host_ip, port=port_no, db=0)
-        # create dict of local pid bindings
-        self.os_members = {}
-        # Number of bits for pid addresses
-        self.n_bits: int = n_bits
-        # Maximum corresponding pid
-        self.MAXPROC: int = pow(2, n_bits)
-        # create instance logger
-        self.logger = logging.getLogger('vs2lab.channel.Channel')
-        self.logger.debug('New Channel created.')
+    def dump_stats(self, path: str) -> None:
+        """
+        Write the metrics of this channel instance (see stats) to a file in the Prometheus text format.
+        :param path: file name
+        :return: None
+        """
+        self.stats()
+        self.metrics.dump(path)
 
-    @staticmethod
-    def __decode_set(raw) -> set:
-        return {i.decode() for i in raw}
+    def __push(self, pipe, destination: str, envelope: bytes, lane: str) -> None:
+        """
+        Queue a push of an envelope to the inbox of destination.
+        :param pipe: redis pipeline
+        :param destination: member identifier of the receiver
+        :param envelope: serialized envelope
+        :param lane: priority lane
+        :return: None
+        """
+        if self.inbox == 'stream':
+            pipe.xadd(self._stream_key(destination), {'e': envelope})
+        else:
+            pipe.rpush(self._inbox_key(destination, lane), envelope)
 
-    def join(self, subgroup: str) -> str:
+    def __deliver(self, caller: str, batch: list, lane: str) -> int:
         """
-        Join a process as a member to the global channel and associate it with a (sub)group. 
-        Only members can communicate over the channel. 
-        Subgroups can be used to retrieve a specific set of processes later (e.g. all servers).
-        :param subgroup: an identifier for the grouping
-        :return: global member id of the process.
+        Validate caller and destinations and push envelopes to the destination inboxes in one round trip.
+        With scripts, this is a single atomic script call.
+        Otherwise and unless in strict mode, validation uses the membership cache.
+        In strict mode, membership is checked while watching the member set, and the pushes are done in a
+        transaction that fails (and is retried) if the member set has changed meanwhile. So nothing is delivered
+        to members that have left, and nothing at all if validation fails.
+        Sharded channels validate before pushing in one round trip per shard.
+        Inbox limits are applied according to the overflow policy (see class doc).
+        :param caller: member identifier of the sender
+        :param batch: list of (destination list, envelope) tuples
+        :param lane: priority lane
+        :return: number of dropped envelopes
         """
-        # For concurrently assigning unique member ids, we need to use a transaction
-        # atomically reading and writing the member set. This can be implemented by
-        # means of the pipeline construct.
+        if self.__scripts is not None:
+            keys, args = self._multicast_call(caller, batch, self.inbox, lane)
+            try:
+                return self.__scripts['multicast'](keys=keys, args=args)
+            except redis.ResponseError as error:
+                self._script_failed(error)
+
+        destinations: list = list({d for dests, _ in batch for d in dests})
+        if not self.strict:
+            assert self.__known([caller]), 'unknown sender'
+            assert self.__known(destinations), 'unknown receiver'
+        elif self.__ring is not None:
+            # queues and members live on different shards, validate first
+            known = dict(zip([caller] + destinations, self.channel.smismember(self._members, [caller] + destinations)))
+            assert known[caller], 'unknown sender'
+            assert all(known.values()), 'unknown receiver'
+        pushes, trims, dropped = self.__plan(batch, self.__limits(destinations), lane)
+
+        if not self.strict or self.__ring is not None:
+            self.__push_all(pushes, trims, lane)
+            return dropped
+
         with self.channel.pipeline() as pipe:
-            while 1:
+            while True:
                 try:
-                    # Put a WATCH on the key that holds the member set
-                    pipe.watch('members')
-                    # After WATCHing, the pipeline is put into immediate execution
-                    # mode until we tell it to start buffering commands again.
-                    # This allows us to get the current value of the global member set
-                    raw_members = pipe.smembers('members')
-                    members = self.__decode_set(raw_members)
-                    # Now construct new/unused random member id
-                    remaining_ids = list(set([str(i) for i in range(self.MAXPROC)]) - members)
-                    new_pid = random.choice(remaining_ids)
-                    # Then we can put the pipeline back into buffered mode with MULTI
+                    pipe.watch(self._members)
+                    known = dict(zip([caller] + destinations, pipe.smismember(self._members, [caller] + destinations)))
+                    assert known[caller], 'unknown sender'
+                    assert all(known.values()), 'unknown receiver'
                     pipe.multi()
-                    # Add new member id to global member set and subgroup
-                    pipe.sadd('members', new_pid)
-                    pipe.sadd(subgroup, new_pid)
-                    # and finally, execute the pipeline (the set command)
+                    for destination, envelope in pushes:
+                        self.__push(pipe, destination, envelope, lane)
+                    self.__trim(pipe, trims, lane)
                     pipe.execute()
-                    # if a WatchError wasn't raised during execution,
-                    # everything we just did happened atomically.
                     break
                 except redis.WatchError:
-                    # another client must have changed 'members' between
-                    # the time we started WATCHing it and the pipeline's execution.
-                    # our best bet is to just retry.
+                    continue  # members joined or left meanwhile, validate again
+        if self.inbox == 'stream' and trims:
+            self.__trim_streams(trims)
+        return dropped
+
+    def __push_all(self, pushes: list, trims: dict, lane: str) -> None:
+        """
+        Push envelopes and trim inboxes in one round trip per shard (stream inboxes are trimmed afterwards).
+        :param pushes: list of (destination, envelope) pushes
+        :param trims: dict of receivers and their inbox limits
+        :param lane: priority lane
+        :return: None
+        """
+        for queues, group in self.__by_shard(pushes, lambda push: push[0]):
+            with queues.pipeline(transaction=False) as pipe:
+                for destination, envelope in group:
+                    self.__push(pipe, destination, envelope, lane)
+                self.__trim(pipe, {d: trims[d] for d, _ in group if d in trims} if self.__ring else trims, lane)
+                pipe.execute()
+        if self.inbox == 'stream' and trims:
+            self.__trim_streams(trims)
+
+    def __plan(self, batch: list, limits: dict, lane: str) -> tuple:
+        """
+        Apply the overflow policy to the pushes of a batch, based on the current depths of bounded inboxes.
+        :param batch: list of (destination list, envelope) tuples
+        :param limits: dict of bounded receivers and their limits
+        :param lane: priority lane
+        :return: tuple of the list of (destination, envelope) pushes, dict of inboxes to trim to their limits
+                 and number of dropped envelopes
+        """
+        pushes = [(destination, envelope) for dests, envelope in batch for destination in dests]
+        if len(limits) == 0:
+            return pushes, {}, 0
+        bounded = list(limits)
+        depths = dict(zip(bounded, self.__depths(bounded, lane)))
+        if self.overflow == 'drop_oldest':
+            for destination, _ in pushes:
+                if destination in depths:
+                    depths[destination] += 1
+            return pushes, limits, sum(max(0, depths[d] - limits[d]) for d in bounded)
+
+        kept = []
+        for destination, envelope in pushes:
+            if destination in limits:
+                if depths[destination] >= limits[destination]:
+                    # raise or block: nothing has been pushed yet
+                    if self.overflow != 'drop_newest':
+                        raise InboxFull('inbox full')
                     continue
-        self.logger.info("Member {} joining {}.".format(new_pid, subgroup))
-
-        # construct bidirectional queue names for new member and all existing members (if any)
-        if len(members) > 0:
-            xchan: list = [[new_pid, other] for other in members] + [[other, new_pid] for other in members]
-            # push queue names to global list of all possible transfer queues
-            for xc in xchan:
-                self.channel.rpush('xchan', pickle.dumps(xc))
-        return new_pid
+                depths[destination] += 1
+            kept.append((destination, envelope))
+        return kept, {}, len(pushes) - len(kept)
 
-    def leave(self, subgroup: str):
+    def __trim(self, pipe, trims: dict, lane: str) -> None:
         """
-        Unregister a process from the global channel (and subgroup).
-        :param subgroup: subgroup identifier
+        Queue trimming inboxes to their limits, dropping the oldest envelopes.
+        :param pipe: redis pipeline
+        :param trims: dict of receivers and their inbox limits
+        :param lane: priority lane
         :return: None
         """
-        # retrieve member id via os pid and validate it
-        os_pid: int = os.getpid()
-        pid: str = self.os_members[os_pid]
-        assert self.channel.sismember('members', pid), 'member unknown'
-        self.logger.info("Member {} leaving {}".format(pid, subgroup))
+        if self.inbox == 'stream':
+            return  # see __trim_streams
+        for destination, limit in trims.items():
+            pipe.ltrim(self._inbox_key(destination, lane), -limit, -1)
+
+    def __trim_streams(self, trims: dict) -> None:
+        """
+        Trim stream inboxes to their limits after pushing, deleting the oldest undelivered entries
+        (delivered entries are kept for redelivery until they are acknowledged).
+        :param trims: dict of receivers and their inbox limits
+        :return: None
+        """
+        for queues, group in self.__by_shard(list(trims)):
+            for pid, (depth, first) in zip(group, self.__stream_depths(queues, group)):
+                if depth > trims[pid]:
+                    key = self._stream_key(pid)
+                    queues.xdel(key, *[entry_id for entry_id, _ in queues.xrange(key, first, '+',
+                                                                               count=depth - trims[pid])])
 
-        # remove binding and global member element
-        del self.os_members[os_pid]
-        self.channel.srem('members', pid)
+    def __stream_depths(self, queues, pids: list) -> list:
+        """
+        Count the undelivered entries of stream inboxes in one round trip. Entries delivered to the member
+        stay pending in its consumer group until acknowledged, they are older than all undelivered entries.
+        :param queues: redis client of the shard holding the streams
+        :param pids: list of member ids
+        :return: list of (number of undelivered entries, XRANGE start of the undelivered entries) tuples
+        """
+        with queues.pipeline(transaction=False) as pipe:
+            for pid in pids:
+                pipe.xlen(self._stream_key(pid))
+                pipe.xpending(self._stream_key(pid), self.GROUP)
+            results = pipe.execute(raise_on_error=False)
+        depths = []
+        for length, pending in zip(results[::2], results[1::2]):
+            if isinstance(pending, redis.ResponseError) or pending['pending'] == 0:
+                # no consumer group yet (or nothing delivered)
+                depths.append((length, '-'))
+            else:
+                last = pending['max'].decode() if isinstance(pending['max'], bytes) else pending['max']
+                depths.append((length - pending['pending'], '(' + last))
+        return depths
 
-        # decode member set binary elements to string list
-        raw_members: set = self.channel.smembers('members')
-        members: set = self.__decode_set(raw_members)
+    def __backpressure(self, send):
+        """
+        Call a send function. With overflow policy 'block', retry it while inboxes are full,
+        backing off exponentially up to 50 ms, until overflow_timeout has passed.
+        :param send: function performing the send operation
+        :return: result of send
+        """
+        deadline = None
+        delay = 0.001
+        while True:
+            try:
+                return send()
+            except InboxFull:
+                if self.overflow != 'block':
+                    raise
+                if deadline is None:
+                    deadline = time.monotonic() + self.overflow_timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                time.sleep(min(delay, remaining))
+                delay = min(2 * delay, 0.05)
 
-        # construct bidirectional queue names for new member and all existing members (if any)
-        if len(members) > 0:
-            xchan: list = [[pid, other] for other in members] + [[other, pid] for other in members]
-            # pop queue names from global list of all possible transfer queues
-            for xc in xchan:
-                self.channel.lrem('xchan', 0, pickle.dumps(xc))
+    def __depths(self, pids: list, lane: str = None) -> list:
+        """
+        Read the current inbox lengths of members in one round trip per shard
+        (undelivered entries of stream inboxes, see __stream_depths).
+        :param pids: list of member ids
+        :param lane: priority lane (None for the sum of all lanes)
+        :return: list of inbox lengths
+        """
+        lanes = self.LANES if lane is None else (lane,)
+        depths = {}
+        for queues, group in self.__by_shard(pids):
+            if self.inbox == 'stream':
+                depths.update(zip(group, [depth for depth, _ in self.__stream_depths(queues, group)]))
+                continue
+            with queues.pipeline(transaction=False) as pipe:
+                for pid in group:
+                    for name in lanes:
+                        pipe.llen(self._inbox_key(pid, name))
+                lengths = pipe.execute()
+            lengths = [sum(lengths[i:i + len(lanes)]) for i in range(0, len(lengths), len(lanes))]
+            depths.update(zip(group, lengths))
+        return [depths[pid] for pid in pids]
 
-        # remove member id from subgroup set
-        self.channel.srem(subgroup, pid)
+    def send_to(self, destination_set: set, message: object, lane: str = 'data') -> None:
+        """
+        Sends an asynchronous, persistent multicast message.
+        The message is serialized once and delivered to all destinations in a single round trip.
+        :param destination_set: a set of member identifiers
+        :param message: the message object to be send (see 'message format' in class doc)
+        :param lane: priority lane (see class doc)
+        :return: None
+        """
+        with self.metrics.timer('op_seconds', 'send_to'):
+            # destination_set needs to contain string identifiers
+            assert all(type(k) is str for k in destination_set), 'type error'
+            assert lane in self.LANES, 'unknown lane'
 
-    def exists(self, pid: str) -> bool:
+            # lookup member id by pid, it is validated on delivery
+            caller: str = self.__caller()
+            self.logger.debug("%s sends %s to %s", caller, message, destination_set)
+
+            # push message to inboxes of all destinations
+            envelope = self._envelope(caller, message)
+            receivers, dropped = self.__send(envelope, destination_set, lambda handle: (
+                len(destination_set),
+                self.__backpressure(lambda: self.__deliver(caller, [(set(destination_set), handle)], lane))))
+            self.__sent(caller, len(envelope), receivers, dropped)
+
+    def send_many(self, batch: list, lane: str = 'data') -> None:
+        """
+        Sends a burst of asynchronous, persistent multicast messages in a single round trip.
+        :param batch: list of (destination_set, message) tuples
+        :param lane: priority lane (see class doc)
+        :return: None
+        """
+        with self.metrics.timer('op_seconds', 'send_many'):
+            # destination sets need to contain string identifiers
+            assert all(type(k) is str for dests, _ in batch for k in dests), 'type error'
+            assert lane in self.LANES, 'unknown lane'
+
+            # lookup member id by pid, it is validated on delivery
+            caller: str = self.__caller()
+            self.logger.debug("%s sends %d messages", caller, len(batch))
+
+            envelopes = [(set(dests), self._envelope(caller, message)) for dests, message in batch]
+            dropped = self.__backpressure(lambda: self.__deliver(caller, envelopes, lane))
+            for dests, envelope in envelopes:
+                self.__sent(caller, len(envelope), len(dests))
+            self.__sent(caller, 0, 0, dropped)
+
+    def send_to_all(self, message: object, lane: str = 'data') -> None:
+        """
+        Sends an asynchronous, persistent broadcast message.
+        The message is delivered to all inboxes of currently registered members.
+        :param message: the message object to be send
+        :param lane: priority lane (see class doc)
+        :return: None
+        """
+        with self.metrics.timer('op_seconds', 'send_to_all'):
+            assert lane in self.LANES, 'unknown lane'
+            # lookup member id by pid and validate it against the current member set
+            caller: str = self.__caller()
+            self.logger.debug("%s sends %s to all members", caller, message)
+            envelope = self._envelope(caller, message)
+            receivers, dropped = self.__send(envelope, None, lambda handle: (
+                self.__backpressure(lambda: self.__broadcast(caller, handle, lane))))
+            self.__sent(caller, len(envelope), receivers, dropped)
+
+    def __send(self, envelope: bytes, receivers, push) -> tuple:
+        """
+        Push an envelope, or a handle to its payload if it is large and has several receivers (shared payload)
+        or all receivers are on this host (shared memory segment).
+        The payload is stored with a huge reference count first, which is corrected once the number
+        of pushed handles is known. So receivers cannot release it too early.
+        :param envelope: serialized envelope
+        :param receivers: set of receiver ids (None for all members)
+        :param push: function pushing an envelope, returning the number of receivers and dropped envelopes
+        :return: tuple of the number of receivers and dropped envelopes
+        """
+        offset = self._body_offset(envelope)
+        segment = None
+        if self.__colocated(envelope, receivers):
+            segment = lab_shared_memory.Segment(size=len(envelope) - offset)
+            segment.buffer[:len(envelope) - offset] = memoryview(envelope)[offset:]
+            segment.close()
+            key = self._segment_key(segment.name)
+            handle = self.SEGMENT_TAG + '{} {}'.format(segment.name, len(envelope) - offset).encode()
+        elif self._shares(envelope, None if receivers is None else len(receivers)) \
+                and (receivers is not None or self.__population() > 1):
+            key = self._payload_key(os.urandom(8).hex())
+            handle = self.SHARED_TAG + key.encode()
+        else:
+            return push(envelope)
+        with self.channel.pipeline() as pipe:
+            if segment is None:
+                pipe.hset(key, 'd', envelope[offset:])
+            pipe.hset(key, 'n', self.SHARED_REFS)
+            pipe.expire(key, self.share_ttl)
+            pipe.execute()
+        pushed = 0
+        try:
+            receivers, dropped = push(envelope[:offset] + handle)
+            # inboxes trimmed by drop_oldest may have lost other handles, their payloads expire
+            pushed = receivers - (dropped if self.overflow == 'drop_newest' else 0)
+            return receivers, dropped
+        finally:
+            if self.channel.hincrby(key, 'n', pushed - self.SHARED_REFS) <= 0:
+                self.channel.delete(key)
+                if segment is not None:
+                    lab_shared_memory.unlink(segment.name)
+
+    def __population(self) -> int:
+        """
+        Count the members, i.e. the receivers of a broadcast (by the membership cache unless in strict mode).
+        Only needed for broadcasts large enough to be shared, a broadcast to a single member is sent inline.
+        :return: number of members
+        """
+        if self.strict:
+            return self.channel.scard(self._members)
+        return len(self.__cached_set(self._members))
+
+    def __colocated(self, envelope: bytes, receivers) -> bool:
+        """
+        Check whether an envelope is to be sent in a shared memory segment.
+        :param envelope: serialized envelope
+        :param receivers: set of receiver ids (None for all members)
+        :return: True if shared memory is enabled, the envelope is large enough and all receivers are on this host
+        """
+        if self.shm_threshold is None or len(envelope) < self.shm_threshold:
+            return False
+        hosts = self.__cached(self._hosts, lambda: {k.decode(): v.decode()
+                                                    for k, v in self.channel.hgetall(self._hosts).items()})
+        if receivers is None:
+            receivers = self.__cached_set(self._members)
+        return all(hosts.get(pid) == lab_shared_memory.HOST for pid in receivers)
+
+    def __broadcast(self, caller: str, envelope: bytes, lane: str) -> tuple:
+        """
+        Validate the caller and push an envelope to the inboxes of all members.
+        :param caller: member identifier of the sender
+        :param envelope: serialized envelope
+        :param lane: priority lane
+        :return: tuple of the number of members and the number of dropped envelopes
+        """
+        if self.__scripts is not None:
+            keys, args = self._broadcast_call(caller, envelope, self.inbox, lane)
+            try:
+                return tuple(self.__scripts['broadcast'](keys=keys, args=args))
+            except redis.ResponseError as error:
+                self._script_failed(error)
+
+        members = self.__cached_set(self._members)
+        assert caller in members or self.__known([caller]), 'unknown sender'
+        pushes, trims, dropped = self.__plan([(members, envelope)], self.__limits(members), lane)
+
+        # push message to inboxes of all members in one round trip (per shard)
+        self.__push_all(pushes, trims, lane)
+        return len(members), dropped
+
+    def __sent(self, caller: str, size: int, receivers: int, dropped: int = 0) -> None:
+        """
+        Count an envelope pushed to the inboxes of some receivers.
+        :param caller: member identifier of the sender
+        :param size: envelope size in bytes
+        :param receivers: number of inboxes
+        :param dropped: number of envelopes dropped due to full inboxes
+        :return: None
+        """
+        self.metrics.count('messages_out', caller, receivers)
+        self.metrics.count('bytes_out', caller, size * receivers)
+        if dropped:
+            self.metrics.count('messages_dropped', caller, dropped)
+
+    def __received(self, caller: str, envelopes, start: float, wait: float) -> list:
+        """
+        Open received envelopes and count them.
+        :param caller: member identifier of the receiver
+        :param envelopes: received envelopes
+        :param start: time.perf_counter() at the start of the receive operation
+        :param wait: time spent blocking for new envelopes (within BLPOP or XREADGROUP)
+        :return: list of (sender id, message) tuples
+        """
+        handles = self._handles(envelopes)
+        if handles:
+            envelopes = self._resolved(envelopes, handles, self.__resolve(list(handles.values())))
+        segments = self._segments(envelopes)
+        if segments:
+            messages = self.__map(envelopes, segments)
+        else:
+            messages = [self._open(envelope) for envelope in envelopes]
+        if self.tracer is not None:
+            self.tracer.received(caller, envelopes, time.time() - (time.perf_counter() - start))
+        self.metrics.count('messages_in', caller, len(envelopes))
+        self.metrics.count('bytes_in', caller, sum(len(envelope) for envelope in envelopes))
+        self.metrics.observe('receive_wait_seconds', caller, wait, label='member')
+        self.metrics.observe('receive_processing_seconds', caller, time.perf_counter() - start - wait, label='member')
+        self.logger.debug("%s received %s", caller, messages)
+        return messages
+
+    def __map(self, envelopes: list, segments: dict) -> list:
+        """
+        Open received envelopes, decoding messages in shared memory segments from the mapped segments.
+        The references of the caller are released (except for stream inboxes), the last one unlinks the segment.
+        Segments stay mapped while the decoded messages use them (see release).
+        Messages whose segment is gone (expired or on another host) are dropped.
+        :param envelopes: received envelopes
+        :param segments: dict of envelope indices and (segment name, payload size) tuples (see _segments)
+        :return: list of (sender id, message) tuples
+        """
+        messages = []
+        mapped = []
+        for i, envelope in enumerate(envelopes):
+            if i not in segments:
+                messages.append(self._open(envelope))
+                continue
+            name, size = segments[i]
+            try:
+                segment = lab_shared_memory.Segment(name)
+            except FileNotFoundError:
+                self.logger.error("Shared memory segment %s is gone, message dropped", name)
+                continue
+            with segment.buffer[:size] as body:
+                messages.append((self._sender_of(envelope), self._decode(body)))
+            mapped.append(segment)
+
+        if self.inbox != 'stream':
+            with self.channel.pipeline() as pipe:
+                for name, _ in segments.values():
+                    pipe.hincrby(self._segment_key(name), 'n', -1)
+                counts = pipe.execute()
+            unused = [name for (name, _), count in zip(segments.values(), counts) if count <= 0]
+            if unused:
+                self.channel.delete(*[self._segment_key(name) for name in unused])
+                for name in unused:
+                    lab_shared_memory.unlink(name)
+        with self.__mapped_lock:
+            self.__mapped += [segment for segment in mapped if not segment.close()]
+        return messages
+
+    def release(self, message: object = None) -> int:
+        """
+        Unmap the shared memory segments of received messages that are no longer in use.
+        Messages decoded without copying (e.g. memoryviews of the pickle5 codec) keep their segment mapped.
+        The memoryviews of message (a memoryview, or within tuples, lists and dict values) are released first.
+        :param message: a received message that is not used anymore
+        :return: number of segments still mapped
+        """
+        values = [message]
+        while values:
+            value = values.pop()
+            if type(value) is memoryview:
+                value.release()
+            elif type(value) in (tuple, list):
+                values += value
+            elif type(value) is dict:
+                values += value.values()
+        with self.__mapped_lock:
+            self.__mapped = [segment for segment in self.__mapped if not segment.close()]
+            return len(self.__mapped)
+
+    def __resolve(self, keys: list) -> list:
+        """
+        Fetch shared payloads and release the references of the caller (except for stream inboxes).
+        :param keys: payload keys
+        :return: list of payloads (None if expired)
+        """
+        release = self.inbox != 'stream'
+        if self.__scripts is not None:
+            return self.__scripts['resolve'](keys=keys, args=['1' if release else '0'])
+        with self.channel.pipeline() as pipe:
+            for key in keys:
+                pipe.hget(key, 'd')
+                if release:
+                    pipe.hincrby(key, 'n', -1)
+            results = pipe.execute()
+        if not release:
+            return results
+        unused = [key for key, count in zip(keys, results[1::2]) if count <= 0]
+        if unused:
+            self.channel.delete(*unused)
+        return results[0::2]
+
+    def __take(self, caller: str, sender_set, max_n: int) -> list:
+        """
+        Take up to max_n envelopes of the caller from any sender in sender_set without blocking.
+        Stashed envelopes are taken first, then the inbox is scanned, stashing envelopes of other senders.
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :param max_n: maximum number of envelopes
+        :return: list of envelopes in FIFO order per sender
+        """
+        if self.__scripts is not None:
+            keys, args = self._receive_call(caller, sender_set, max_n)
+            return self.__scripts['receive'](keys=keys, args=args)
+
+        queues = self.__queues(caller)
+        result: list = []
+        stashed: set = self._decode_set(queues.smembers(self._stashed_key(caller)))
+        for lane in self.LANES:
+            # stashed set elements are sender ids with the lane suffix
+            for element in stashed:
+                sender = element.split(':')[0]
+                if element != sender + self._lane_suffix(lane) or not (sender_set is None or sender in sender_set):
+                    continue
+                with queues.pipeline() as pipe:
+                    pipe.lpop(self._stash_key(caller, element), max_n - len(result))
+                    pipe.llen(self._stash_key(caller, element))
+                    envelopes, remaining = pipe.execute()
+                if remaining == 0:
+                    queues.srem(self._stashed_key(caller), element)
+                result += envelopes or []
+                if len(result) == max_n:
+                    # stashes of wanted senders may not be empty, so their inbox envelopes need to wait
+                    return result
+
+            while len(result) < max_n:
+                envelopes = queues.lpop(self._inbox_key(caller, lane), max_n - len(result))
+                if not envelopes:
+                    break
+                self.__stash(caller, sender_set, envelopes, result, lane)
+        return result
+
+    def __stash(self, caller: str, sender_set, envelopes: list, result: list, lane: str) -> None:
+        """
+        Append wanted envelopes to result, stash all others.
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :param envelopes: envelopes popped off the inbox
+        :param result: list of wanted envelopes
+        :param lane: priority lane of the inbox
+        :return: None
+        """
+        with self.__queues(caller).pipeline() as pipe:
+            for envelope in envelopes:
+                sender: str = self._sender_of(envelope)
+                if sender_set is None or sender in sender_set:
+                    result.append(envelope)
+                else:
+                    # not wanted now, keep it for later receive operations
+                    pipe.rpush(self._stash_key(caller, sender, lane), envelope)
+                    pipe.sadd(self._stashed_key(caller), sender + self._lane_suffix(lane))
+            pipe.execute()
+
+    def __receive_many(self, caller: str, sender_set, max_n: int, timeout: int) -> list:
+        """
+        Take up to max_n messages off the callers' inbox (or stashes) sent by any sender in sender_set.
+        Blocks until at least one message is available. Envelopes of other senders are stashed on the way.
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :param max_n: maximum number of messages
+        :param timeout: timeout for blocking read, 0 blocks forever
+        :return: list of (sender id, message) tuples, empty on timeout
+        """
+        start = time.perf_counter()
+        if self.prefetch:
+            envelopes = self.__prefetcher(caller).take(sender_set, max_n, timeout)
+            return self.__received(caller, envelopes, start, time.perf_counter() - start)
+        wait = 0.0
+        envelopes: list = self.__take(caller, sender_set, max_n)
+        deadline = time.monotonic() + timeout if timeout else None
+        while len(envelopes) == 0:
+            remaining = 0
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            # block until new msg appears in any lane of the inbox, control first
+            blocked = time.perf_counter()
+            result = self.__queues(caller).blpop([self._inbox_key(caller, lane) for lane in self.LANES],
+                                                 remaining)
+            wait += time.perf_counter() - blocked
+            if result is None:
+                break
+            self.__stash(caller, sender_set, [result[1]], envelopes, self._lane_of(result[0]))
+            if len(envelopes) > 0 and max_n > 1:
+                # pick up whatever has arrived meanwhile
+                envelopes += self.__take(caller, sender_set, max_n - 1)
+
+        return self.__received(caller, envelopes, start, wait)
+
+    def __prefetcher(self, caller: str) -> _Prefetcher:
+        """
+        Retrieve the prefetcher of a member, starting it on first use.
+        Envelopes stashed by receive operations before are buffered before fetching starts.
+        :param caller: member identifier of the receiver
+        :return: _Prefetcher instance
+        """
+        with self.__prefetchers_lock:
+            prefetcher = self.__prefetchers.get(caller)
+            if prefetcher is None:
+                prefetcher = self.__prefetchers[caller] = _Prefetcher(
+                    'vs2lab-prefetch-' + caller, lambda room: self.__fetch(caller, room), self.prefetch, self.logger)
+                # stashed envelopes were skipped before, so they keep their place ahead of all others
+                elements = sorted(self._decode_set(self.__queues(caller).smembers(self._stashed_key(caller))))
+                with self.__queues(caller).pipeline() as pipe:
+                    for element in elements:
+                        pipe.lrange(self._stash_key(caller, element), 0, -1)
+                    pipe.delete(self._stashed_key(caller), *[self._stash_key(caller, element) for element in elements])
+                    stashes = pipe.execute()[:-1]
+                for lane in self.LANES:
+                    prefetcher.put(lane, [envelope for element, envelopes in zip(elements, stashes)
+                                          if self._lane_of(element.encode()) == lane for envelope in envelopes])
+                prefetcher.start()
+            return prefetcher
+
+    def __fetch(self, caller: str, room: int) -> list:
+        """
+        Take up to room envelopes per lane off the inbox of a member, blocking up to a second for the first one.
+        :param caller: member identifier of the receiver
+        :param room: maximum number of envelopes per lane
+        :return: list of (lane, envelope) tuples
+        """
+        with self.__queues(caller).pipeline(transaction=False) as pipe:
+            for lane in self.LANES:
+                pipe.lpop(self._inbox_key(caller, lane), room)
+            popped = pipe.execute()
+        fetched = [(lane, envelope) for lane, envelopes in zip(self.LANES, popped) for envelope in envelopes or []]
+        if fetched:
+            return fetched
+        result = self.__queues(caller).blpop([self._inbox_key(caller, lane) for lane in self.LANES], 1)
+        return [] if result is None else [(self._lane_of(result[0]), result[1])]
+
+    def __stream(self, caller: str) -> dict:
+        """
+        Retrieve the stream receive state of a member.
+        On first use, the consumer group is created (if necessary) and all entries that have been delivered to
+        the member before but were never acknowledged (e.g. due to a crash) are loaded for redelivery.
+        :param caller: member identifier of the receiver
+        :return: dict with list of pending (entry id, envelope) tuples and list of entry ids to acknowledge
+        """
+        state = self.__streams.get(caller)
+        if state is not None:
+            return state
+        key = self._stream_key(caller)
+        try:
+            self.__queues(caller).xgroup_create(key, self.GROUP, id='0', mkstream=True)
+        except redis.ResponseError as error:
+            if 'BUSYGROUP' not in str(error):
+                raise
+        state = self.__streams[caller] = {'pending': [], 'unacked': []}
+        last = '0'
+        while True:
+            result = self.__queues(caller).xreadgroup(self.GROUP, caller, {key: last}, count=100)
+            entries = result[0][1] if result else []
+            if len(entries) == 0:
+                break
+            for entry_id, fields in entries:
+                if fields:
+                    state['pending'].append((entry_id, fields[b'e']))
+                else:
+                    state['unacked'].append(entry_id)  # deleted meanwhile
+            last = entries[-1][0]
+        return state
+
+    def ack(self) -> None:
+        """
+        Acknowledge all messages received by the calling member so far and delete them from its stream inbox.
+        This is done implicitly by every receive operation, too.
+        :return: None
+        """
+        caller: str = self.__caller()
+        if self.inbox == 'stream':
+            self.__ack(caller, self.__stream(caller))
+
+    def __ack(self, caller: str, state: dict) -> None:
+        if len(state['unacked']) > 0:
+            key = self._stream_key(caller)
+            with self.__queues(caller).pipeline(transaction=False) as pipe:
+                pipe.xack(key, self.GROUP, *state['unacked'])
+                pipe.xdel(key, *state['unacked'])
+                pipe.execute()
+            state['unacked'] = []
+
+    def __receive_batch(self, caller: str, sender_set, max_n: int, timeout: int) -> list:
+        """
+        Read up to max_n messages sent by any sender in sender_set from the callers' stream inbox.
+        Blocks until at least one message is available. Entries of other senders stay pending.
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :param max_n: maximum number of messages
+        :param timeout: timeout for blocking read, 0 blocks forever
+        :return: list of (sender id, message) tuples, empty on timeout
+        """
+        start = time.perf_counter()
+        wait = 0.0
+        state = self.__stream(caller)
+        self.__ack(caller, state)
+
+        def wanted(envelope):
+            return sender_set is None or self._sender_of(envelope) in sender_set
+
+        # serve skipped and redelivered entries first
+        batch = [entry for entry in state['pending'] if wanted(entry[1])][:max_n]
+        if len(batch) > 0:
+            taken = {entry_id for entry_id, _ in batch}
+            state['pending'] = [entry for entry in state['pending'] if entry[0] not in taken]
+
+        deadline = time.monotonic() + timeout if timeout else None
+        while len(batch) == 0:
+            block = 0
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                block = max(1, int(remaining * 1000))
+            blocked = time.perf_counter()
+            result = self.__queues(caller).xreadgroup(self.GROUP, caller, {self._stream_key(caller): '>'},
+                                                      count=max_n, block=block)
+            wait += time.perf_counter() - blocked
+            if not result:
+                break
+            for entry_id, fields in result[0][1]:
+                if wanted(fields[b'e']) and len(batch) < max_n:
+                    batch.append((entry_id, fields[b'e']))
+                else:
+                    state['pending'].append((entry_id, fields[b'e']))
+
+        state['unacked'] = [entry_id for entry_id, _ in batch]
+        return self.__received(caller, [envelope for _, envelope in batch], start, wait)
+
+    def receive_many(self, sender_set: set = None, max_n: int = 10, timeout: int = 0) -> list:
+        """
+        Make a blocking call to take up to max_n messages off the callers' inbox
+        sent by any of the members specified in sender_set (or by any member).
+        Blocks until at least one message is available, then returns all queued messages up to max_n.
+        If messages are queued already, this takes a single round trip.
+        :param sender_set: set of ids to watch for new messages, None for any member
+        :param max_n: maximum number of messages to return
+        :param timeout: optional timeout for blocking call
+        :return: list of (sender id, message) tuples in FIFO order per sender, empty on timeout
+        """
+        with self.metrics.timer('op_seconds', 'receive_many'):
+            # lookup member id by pid and validate it and all senders
+            caller: str = self.__caller()
+            assert self.__known([caller]), 'unknown receiver'
+            if sender_set is not None:
+                assert self.__known(sender_set), 'unknown sender'
+                sender_set = set(sender_set)
+            self.logger.debug("%s receives up to %d from %s", caller, max_n, sender_set or 'any')
+
+            if self.inbox == 'stream':
+                return self.__receive_batch(caller, sender_set, max_n, timeout)
+            return self.__receive_many(caller, sender_set, max_n, timeout)
+
+    def receive_batch(self, sender_set: set = None, max_n: int = 10, timeout: int = 0) -> list:
+        """
+        Read up to max_n messages off the callers' stream inbox (see receive_many).
+        :param sender_set: set of ids to watch for new messages, None for any member
+        :param max_n: maximum number of messages to return
+        :param timeout: optional timeout for blocking call
+        :return: list of (sender id, message) tuples in FIFO order per sender, empty on timeout
+        """
+        assert self.inbox == 'stream', 'receive_batch requires stream inboxes'
+        return self.receive_many(sender_set, max_n, timeout)
+
+    def receive_from_any(self, timeout: int = 0) -> tuple:
+        """
+        Make a blocking request to take the next message off the callers' inbox.
+        :param timeout: optional timeout for blocking read.
+        :return: tuple containing the sender id and message
+        """
+        with self.metrics.timer('op_seconds', 'receive_from_any'):
+            # lookup member id by pid and validate it
+            caller = self.__caller()
+            assert self.__known([caller]), 'unknown receiver'
+            self.logger.debug("%s receives from any", caller)
+
+            if self.inbox == 'stream':
+                batch = self.__receive_batch(caller, None, 1, timeout)
+            else:
+                batch = self.__receive_many(caller, None, 1, timeout)
+            return batch[0] if batch else None
+
+    def receive_from(self, sender_set: set, timeout: int = 0) -> tuple:
+        """
+        Make a blocking call to take the next message off the callers' inbox
+        sent by any of the members specified in the sender_set attribute.
+        :param sender_set: set of ids to watch for a new message
+        :param timeout: optional timeout for blocking call
+        :return: tuple containing the sender id and message
+        """
+        with self.metrics.timer('op_seconds', 'receive_from'):
+            assert (type(k) is str for k in sender_set), 'Address type mismatch.'
+
+            # lookup member id by pid and validate it
+            caller: str = self.__caller()
+            assert self.__known([caller]), 'unknown receiver'
+            self.logger.debug("%s receives from %s", caller, sender_set)
+
+            # validate all senders
+            assert self.__known(sender_set), 'unknown sender'
+
+            if self.inbox == 'stream':
+                batch = self.__receive_batch(caller, set(sender_set), 1, timeout)
+            else:
+                batch = self.__receive_many(caller, set(sender_set), 1, timeout)
+            return batch[0] if batch else None
+
+
+class Member:
+    """
+    Handle of a channel member, calling the operations of its channel as that member.
+    Handles let one os process host thousands of members sharing one channel (and one redis connection pool),
+    e.g. members driven by a scheduler, without binding each of them to a thread or task first:
+
+        nodes = [chan.member(chan.join('node')) for _ in range(1000)]
+        nodes[0].send_to({nodes[1].pid}, 'hello')
+
+    See Channel for the semantics of the operations.
+    """
+
+    def __init__(self, channel: Channel, pid: str):
+        """
+        :param channel: channel of the member
+        :param pid: member identifier
+        """
+        self.channel: Channel = channel
+        self.pid: str = pid
+
+    def __repr__(self) -> str:
+        return 'Member({})'.format(self.pid)
+
+    def send_to(self, destination_set: set, message: object, lane: str = 'data') -> None:
+        self.channel._call_as(self.pid, self.channel.send_to, destination_set, message, lane)
+
+    def send_many(self, batch: list, lane: str = 'data') -> None:
+        self.channel._call_as(self.pid, self.channel.send_many, batch, lane)
+
+    def send_to_all(self, message: object, lane: str = 'data') -> None:
+        self.channel._call_as(self.pid, self.channel.send_to_all, message, lane)
+
+    def receive_from(self, sender_set: set, timeout: int = 0) -> tuple:
+        return self.channel._call_as(self.pid, self.channel.receive_from, sender_set, timeout)
+
+    def receive_from_any(self, timeout: int = 0) -> tuple:
+        return self.channel._call_as(self.pid, self.channel.receive_from_any, timeout)
+
+    def receive_many(self, sender_set: set = None, max_n: int = 10, timeout: int = 0) -> list:
+        return self.channel._call_as(self.pid, self.channel.receive_many, sender_set, max_n, timeout)
+
+    def receive_batch(self, sender_set: set = None, max_n: int = 10, timeout: int = 0) -> list:
+        return self.channel._call_as(self.pid, self.channel.receive_batch, sender_set, max_n, timeout)
+
+    def ack(self) -> None:
+        self.channel._call_as(self.pid, self.channel.ack)
+
+    def leave(self, subgroup: str) -> None:
+        self.channel._call_as(self.pid, self.channel.leave, subgroup)
+
+    def limit_inbox(self, limit: int = None) -> None:
+        self.channel._call_as(self.pid, self.channel.limit_inbox, limit)
+
+    def new_trace(self) -> None:
+        self.channel._call_as(self.pid, self.channel.new_trace)
+
+    def inbox_depth(self) -> int:
+        return self.channel.inbox_depth(self.pid)
+
+
+class AsyncChannel(ChannelBase):
+    """
+    AsyncChannel is the asyncio variant of Channel, sharing its redis data structures.
+    Async and sync channel members can communicate with each other.
+
+    All operations except bind are coroutines. Blocking receive operations only suspend the calling task,
+    so a single event loop (and a single redis connection pool) can serve many concurrent operations.
+
+    Bindings are context-local instead of per os process: bind() inside an asyncio task binds that task
+    (and the tasks it creates later). Thus many logical members can live within one event loop,
+    each one running in its own task.
+
+    Membership is not cached; sends, receives and leave use the server-side scripts of Channel,
+    so every operation is validated by redis atomically in the same call as the operation itself.
+
+    backend='redis' connects to host_ip:port_no, any other value is used as the asyncio redis client
+    (e.g. fakeredis.aioredis.FakeRedis for tests).
+    """
+
+    def __init__(self, n_bits: int = 5, host_ip: str = 'localhost', port_no: int = 6379, codec='pickle',
+                 compression=None, level: int = None, threshold: int = 1024, trace=None, namespace: str = None,
+                 backend='redis'):
+        super().__init__(n_bits, codec, compression, level, threshold, trace=trace, namespace=namespace)
+        # create asyncio redis client (with its own connection pool), or use the given asyncio client
+        if backend == 'redis':
+            self.channel = redis.asyncio.StrictRedis(host=host_ip, port=port_no, db=0)
+        else:
+            self.channel = backend
+        # registered server-side scripts
+        self.__scripts = {name: self.channel.register_script(src) for name, src in self.SCRIPTS.items()}
+        # create instance logger
+        self.logger = logging.getLogger('vs2lab.channel.AsyncChannel')
+        self.logger.debug('New AsyncChannel created.')
+
+    async def close(self) -> None:
+        """
+        Close all connections of the channel.
+        :return: None
+        """
+        await self.channel.aclose()
+
+    async def clear(self, batch_size: int = 1000) -> int:
+        """
+        Delete all keys of the namespace of the channel (see Channel.clear).
+        :param batch_size: number of keys scanned and unlinked per round trip
+        :return: number of deleted keys
+        """
+        deleted = 0
+        batch = []
+        async for key in self.channel.scan_iter(match=self._pattern(), count=batch_size):
+            batch.append(key)
+            if len(batch) == batch_size:
+                deleted += await self.channel.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += await self.channel.unlink(*batch)
+        return deleted
+
+    async def join(self, subgroup: str) -> str:
+        """
+        Join a member to the global channel and associate it with a (sub)group (see Channel.join).
+        :param subgroup: an identifier for the grouping
+        :return: global member id
+        """
+        candidates = self._candidate_ids()
+        for new_pid in candidates:
+            if new_pid is None:
+                new_pid = candidates.send(self._decode_set(await self.channel.smembers(self._members)))
+            if await self.channel.sadd(self._members, new_pid) == 1:
+                break
+        async with self.channel.pipeline() as pipe:
+            pipe.sadd(self._key(subgroup), new_pid)
+            pipe.publish(self._events, 'join {} {}'.format(new_pid, subgroup))
+            await pipe.execute()
+        self.logger.info("Member %s joining %s.", new_pid, subgroup)
+        return new_pid
+
+    async def leave(self, subgroup: str) -> None:
+        """
+        Unregister the bound member from the global channel (and subgroup) and delete its queues.
+        :param subgroup: subgroup identifier
+        :return: None
+        """
+        pid: str = self.__caller()
+        self.logger.info("Member %s leaving %s", pid, subgroup)
+        await self.__call('leave', self._leave_call(pid, subgroup))
+
+    async def exists(self, pid: str) -> bool:
         """
         Check if pid is in global member set
         :param pid: process identifier
         :return: boolean value, true if pid is a member
         """
-        return self.channel.sismember('members', pid)
+        return bool(await self.channel.sismember(self._members, pid))
 
     def bind(self, pid: str) -> int:
         """
-        Associate os pid with channel member id.
-        Thus a caller does not need to provide its id for every subsequent call.
-        :param pid: identifier of process member
+        Associate the current context (e.g. asyncio task) with a channel member id.
+        :param pid: identifier of member
         :return: os pid value
         """
-        # retrieve os pid and map to given member id
-        os_pid: int = os.getpid()
-        self.os_members[os_pid] = pid
-        self.logger.debug("Member {} bound {}".format(pid, os_pid))
-        return os_pid
+        self._set_binding(pid)
+        self.logger.debug("Member %s bound to context", pid)
+        return os.getpid()
 
-    def subgroup(self, subgroup: str) -> set:
+    def __caller(self) -> str:
+        """
+        Look up the member bound to the current context.
+        :return: member id
+        """
+        pid = self._binding()
+        assert pid is not None, 'no member bound'
+        return pid
+
+    async def subgroup(self, subgroup: str) -> set:
         """
         Retrieve members of a subgroup.
         :param subgroup: subgroup string identifier
         :return: set of member process identifiers
         """
-        return self.__decode_set(self.channel.smembers(subgroup))
+        return self._decode_set(await self.channel.smembers(self._key(subgroup)))
 
-    @staticmethod
-    def __queue_key(sender: str, receiver: str) -> str:
+    async def __call(self, script: str, call: tuple):
         """
-        Construct queue name from sender and receiver ids.
-        :param sender: member identifier
-        :param receiver: member identifier
-        :return: redis key
+        Run a server-side script.
+        :param script: script name
+        :param call: tuple of keys and args
+        :return: script result
         """
-        return str([sender, receiver])
+        keys, args = call
+        try:
+            return await self.__scripts[script](keys=keys, args=args)
+        except redis.ResponseError as error:
+            self._script_failed(error)
 
-    def send_to(self, destination_set: set, message: object) -> None:
+    async def send_to(self, destination_set: set, message: object, lane: str = 'data') -> None:
         """
         Sends an asynchronous, persistent multicast message.
         :param destination_set: a set of member identifiers
-        :param message: the message object to be send (see 'message format' in class doc)
+        :param message: the message object to be send
+        :param lane: priority lane (see Channel)
         :return: None
         """
-        # destination_set needs to contain string identifiers
         assert all(type(k) is str for k in destination_set), 'type error'
+        assert lane in self.LANES, 'unknown lane'
+        caller: str = self.__caller()
+        self.logger.debug("%s sends %s to %s", caller, message, destination_set)
+        await self.__call('multicast', self._multicast_call(caller, [(set(destination_set),
+                                                                     self._envelope(caller, message))], lane=lane))
 
-        # lookup member id by pid and validate it
-        caller: str = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', caller), 'unknown sender'
-        self.logger.debug("{} sends {} to {}".format(caller, message, destination_set))
-
-        # push message to incoming queues of all destinations
-        for destination in destination_set:
-            assert self.channel.sismember('members', destination), 'unknown receiver'
-            self.channel.rpush(self.__queue_key(caller, destination), pickle.dumps(message))
+    async def send_many(self, batch: list, lane: str = 'data') -> None:
+        """
+        Sends a burst of asynchronous, persistent multicast messages in a single round trip.
+        :param batch: list of (destination_set, message) tuples
+        :param lane: priority lane (see Channel)
+        :return: None
+        """
+        assert all(type(k) is str for dests, _ in batch for k in dests), 'type error'
+        assert lane in self.LANES, 'unknown lane'
+        caller: str = self.__caller()
+        self.logger.debug("%s sends %d messages", caller, len(batch))
+        await self.__call('multicast', self._multicast_call(
+            caller, [(set(dests), self._envelope(caller, message)) for dests, message in batch], lane=lane))
 
-    def send_to_all(self, message: object) -> None:
+    async def send_to_all(self, message: object, lane: str = 'data') -> None:
         """
-        Sends an asynchronous, persistent broadcast message.
-        The message is delivered to all queues of currently registered members.
+        Sends an asynchronous, persistent broadcast message to all currently registered members.
         :param message: the message object to be send
+        :param lane: priority lane (see Channel)
         :return: None
         """
-        # lookup member id by pid and validate it
-        caller: str = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', caller), 'unknown sender'
-        self.logger.debug("{} sends {} to all members".format(caller, message))
+        assert lane in self.LANES, 'unknown lane'
+        caller: str = self.__caller()
+        self.logger.debug("%s sends %s to all members", caller, message)
+        await self.__call('broadcast', self._broadcast_call(caller, self._envelope(caller, message), lane=lane))
 
-        members = self.__decode_set(self.channel.smembers('members'))
-        # push message to incoming queues of all members
-        for destination in members:
-            self.channel.rpush([self.__queue_key(caller, destination)], pickle.dumps(message))
+    async def __receive_many(self, caller: str, sender_set, max_n: int, timeout: int) -> list:
+        """
+        Take up to max_n messages off the callers' inbox (or stashes) sent by any sender in sender_set
+        (see Channel.__receive_many).
+        :param caller: member identifier of the receiver
+        :param sender_set: set of sender ids or None for any sender
+        :param max_n: maximum number of messages
+        :param timeout: timeout for blocking read, 0 blocks forever
+        :return: list of (sender id, message) tuples, empty on timeout
+        """
+        started = time.time()
+        # take stashed envelopes or scan the inbox first
+        envelopes: list = await self.__call('receive', self._receive_call(caller, sender_set, max_n))
+        deadline = time.monotonic() + timeout if timeout else None
+        while len(envelopes) == 0:
+            remaining = 0
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            result = await self.channel.blpop([self._inbox_key(caller, lane) for lane in self.LANES], remaining)
+            if result is None:
+                break
+            envelope = result[1]
+            sender: str = self._sender_of(envelope)
+            if sender_set is not None and sender not in sender_set:
+                lane = self._lane_of(result[0])
+                async with self.channel.pipeline() as pipe:
+                    pipe.rpush(self._stash_key(caller, sender, lane), envelope)
+                    pipe.sadd(self._stashed_key(caller), sender + self._lane_suffix(lane))
+                    await pipe.execute()
+                continue
+            envelopes.append(envelope)
+            if max_n > 1:
+                envelopes += await self.__call('receive', self._receive_call(caller, sender_set, max_n - 1))
 
-    def receive_from_any(self, timeout: int = 0) -> tuple:
+        handles = self._handles(envelopes)
+        if handles:
+            payloads = await self.__scripts['resolve'](keys=list(handles.values()), args=['1'])
+            envelopes = self._resolved(envelopes, handles, payloads)
+        messages = [self._open(envelope) for envelope in envelopes]
+        if self.tracer is not None:
+            self.tracer.received(caller, envelopes, started)
+        self.logger.debug("%s received %s", caller, messages)
+        return messages
+
+    async def receive_from_any(self, timeout: int = 0) -> tuple:
         """
-        Make a blocking request to take the next message off any of the callers' incoming queues.
+        Wait for the next message in the inbox of the bound member.
         :param timeout: optional timeout for blocking read.
-        :return: list containing the queue name and message
-        """
-        # lookup member id by pid and validate it
-        caller = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', str(caller)), 'unknown receiver'
-
-        # decode member set binary elements
-        members: set = self.__decode_set(self.channel.smembers('members'))
-        # construct incoming message queues for all members
-        in_queues: set = {self.__queue_key(member, caller) for member in members}
-        self.logger.debug("{} receives from {}".format(caller, in_queues))
-
-        # block until new msg appears on one of the incoming queues
-        result = self.channel.blpop(in_queues, timeout)
-        if result is not None:
-            # extract sender id from key part
-            key: str = result[0].decode()
-            sender: str = key.split("'")[1]
-            # deserialize msg content
-            message = pickle.loads(result[1])
-            # log and return results
-            self.logger.debug("{} received {} from {}".format(caller, message, sender))
-            return sender, message
+        :return: tuple containing the sender id and message
+        """
+        caller: str = self.__caller()
+        assert await self.channel.sismember(self._members, caller), 'unknown receiver'
+        batch = await self.__receive_many(caller, None, 1, timeout)
+        return batch[0] if batch else None
 
-    def receive_from(self, sender_set: set, timeout: int = 0) -> tuple:
+    async def receive_from(self, sender_set: set, timeout: int = 0) -> tuple:
+        """
+        Wait for the next message in the inbox of the bound member sent by any of the members in sender_set.
+        :param sender_set: set of ids to watch for a new message
+        :param timeout: optional timeout for blocking call
+        :return: tuple containing the sender id and message
+        """
+        caller: str = self.__caller()
+        known = await self.channel.smismember(self._members, [caller] + list(sender_set))
+        assert known[0], 'unknown receiver'
+        assert all(known[1:]), 'unknown sender'
+        batch = await self.__receive_many(caller, set(sender_set), 1, timeout)
+        return batch[0] if batch else None
+
+    async def receive_many(self, sender_set: set = None, max_n: int = 10, timeout: int = 0) -> list:
         """
-        Make a blocking call to pop the next message off any of the callers' queues
-        from the members specified in the sender_set attribute.
-        :param sender_set: set of ids to watch respective incoming queues for a new message
+        Wait for messages in the inbox of the bound member and take up to max_n of them (see Channel.receive_many).
+        :param sender_set: set of ids to watch for new messages, None for any member
+        :param max_n: maximum number of messages to return
         :param timeout: optional timeout for blocking call
-        :return:
-        """
-        assert (type(k) is str for k in sender_set), 'Address type mismatch.'
-
-        # lookup member id by pid and validate it
-        caller: str = self.os_members[os.getpid()]
-        assert self.channel.sismember('members', caller), 'unknown receiver'
-        self.logger.debug("{} receives from {}".format(caller, sender_set))
-
-        # validate all senders and construct incoming queues for them
-        in_queues: set = set()
-        for sender in sender_set:
-            assert self.channel.sismember('members', sender), 'unknown sender'
-            in_queues.add(self.__queue_key(sender, caller))
-
-        # block until new msg appears on one of the queues
-        result = self.channel.blpop(in_queues, timeout)
-        if result is not None:
-            # extract sender id from key part
-            key: str = result[0].decode()
-            sender: str = key.split("'")[1]
-            # deserialize msg content
-            message = pickle.loads(result[1])
-            # log and return results
-            self.logger.debug("{} received {} from {}".format(caller, message, sender))
-            return sender, message
+        :return: list of (sender id, message) tuples, empty on timeout
+        """
+        caller: str = self.__caller()
+        known = await self.channel.smismember(self._members, [caller] + list(sender_set or ()))
+        assert known[0], 'unknown receiver'
+        assert all(known[1:]), 'unknown sender'
+        return await self.__receive_many(caller, None if sender_set is None else set(sender_set), max_n, timeout)
@@ -0,0 +1,431 @@
+import array
+import io
+import lzma
+import marshal
+import pickle
+import struct
+import zlib
+
+
+class Codec:
+    """
+    A codec serializes message objects for transfer over a channel.
+
+    Every codec is identified by a name (used to select it) and a single tag byte.
+    The tag is recorded in each envelope, so receivers always decode with the codec
+    the sender has used, no matter which codec their own channel has selected.
+    """
+
+    name: str = None
+    tag: bytes = None
+
+    def encode(self, message: object) -> bytes:
+        """
+        Serialize a message object.
+        :param message: the message object
+        :return: serialized message
+        """
+        raise NotImplementedError
+
+    def decode(self, data) -> object:
+        """
+        Deserialize a message object.
+        :param data: bytes-like serialized message
+        :return: the message object
+        """
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+    """
+    Plain pickle at the default protocol. Handles any picklable object.
+    """
+
+    name = 'pickle'
+    tag = b'p'
+
+    def encode(self, message: object) -> bytes:
+        return pickle.dumps(message)
+
+    def decode(self, data) -> object:
+        return pickle.loads(data)
+
+
+def _rebuild_bytes(buffer) -> bytes:
+    return bytes(buffer)
+
+
+def _rebuild_bytearray(buffer) -> bytearray:
+    return bytearray(buffer)
+
+
+def _rebuild_memoryview(buffer) -> memoryview:
+    return memoryview(buffer)
+
+
+def _rebuild_array(typecode: str, buffer) -> array.array:
+    result = array.array(typecode)
+    result.frombytes(buffer)
+    return result
+
+
+class _OutOfBandBytes:
+    """
+    Wrapper for top-level bytes and bytearray messages. Exact bytes and bytearray objects are pickled
+    by the C pickler directly, they never reach reducer_override.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        rebuild = _rebuild_bytes if type(self.data) is bytes else _rebuild_bytearray
+        return rebuild, (pickle.PickleBuffer(self.data),)
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickler handing memoryview and large array objects out-of-band.
+    """
+
+    def __init__(self, file, threshold: int, buffers: list):
+        super().__init__(file, protocol=5, buffer_callback=buffers.append)
+        self.threshold = threshold
+
+    def reducer_override(self, obj):
+        if type(obj) is memoryview:
+            # memoryviews cannot be pickled at all, so they are always sent out-of-band
+            return _rebuild_memoryview, (pickle.PickleBuffer(obj.cast('B')),)
+        if type(obj) is array.array and len(obj) * obj.itemsize >= self.threshold:
+            return _rebuild_array, (obj.typecode, pickle.PickleBuffer(obj))
+        return NotImplemented
+
+
+class Pickle5Codec(Codec):
+    """
+    Pickle protocol 5 with out-of-band buffers.
+
+    Large bytes and bytearray (as a message of its own), memoryview and large array objects are not
+    copied into the pickle stream, but appended to it as raw frames. On decoding, they are
+    rebuilt from slices of the received data. Memoryviews are passed on without any copy.
+    Bytes and bytearray objects within other objects are pickled in-band.
+
+    Frame layout: <number of buffers n:uint32> <n buffer lengths:uint64> <pickle> <buffer 1> ... <buffer n>
+    """
+
+    name = 'pickle5'
+    tag = b'5'
+
+    def __init__(self, threshold: int = 1024):
+        """
+        :param threshold: minimum size of buffers to be handed out-of-band
+        """
+        self.threshold: int = threshold
+
+    def encode(self, message: object) -> bytes:
+        if type(message) in (bytes, bytearray) and len(message) >= self.threshold:
+            message = _OutOfBandBytes(message)
+        buffers: list = []
+        stream = io.BytesIO()
+        _Pickler(stream, self.threshold, buffers).dump(message)
+        raws = [b.raw() for b in buffers]
+        header = struct.pack('!I{}Q'.format(len(raws)), len(raws), *[r.nbytes for r in raws])
+        return b''.join([header, stream.getbuffer()] + raws)
+
+    def decode(self, data) -> object:
+        view = memoryview(data)
+        (count,) = struct.unpack_from('!I', view)
+        lengths = struct.unpack_from('!{}Q'.format(count), view, 4)
+        end = len(view)
+        buffers = []
+        for length in reversed(lengths):
+            buffers.insert(0, view[end - length:end])
+            end -= length
+        return pickle.loads(view[4 + 8 * count:end], buffers=buffers)
+
+
+class MarshalCodec(Codec):
+    """
+    The marshal module. Fast, but restricted to core types (no class instances).
+    """
+
+    name = 'marshal'
+    tag = b'm'
+
+    def encode(self, message: object) -> bytes:
+        return marshal.dumps(message)
+
+    def decode(self, data) -> object:
+        return marshal.loads(data)
+
+
+class CompactCodec(Codec):
+    """
+    A compact binary codec using the msgpack format.
+
+    Supports None, bool, int (64 bit), float, str, bytes, list, dict and, as msgpack
+    extension types, tuple (1) and set (2), so that messages round-trip with their types.
+    Other objects raise a TypeError.
+    """
+
+    name = 'compact'
+    tag = b'c'
+
+    EXT_TUPLE = 1
+    EXT_SET = 2
+
+    def encode(self, message: object) -> bytes:
+        out = bytearray()
+        self.__pack(message, out)
+        return bytes(out)
+
+    def decode(self, data) -> object:
+        message, _ = self.__unpack(memoryview(data), 0)
+        return message
+
+    @staticmethod
+    def __pack_length(n: int, fix: int, fix_max: int, codes: tuple, out: bytearray) -> None:
+        # codes are the 8/16/32 bit length type codes of a msgpack type family (None if missing)
+        if fix is not None and n <= fix_max:
+            out.append(fix | n)
+        elif codes[0] is not None and n < 0x100:
+            out += struct.pack('!BB', codes[0], n)
+        elif n < 0x10000:
+            out += struct.pack('!BH', codes[1], n)
+        else:
+            out += struct.pack('!BI', codes[2], n)
+
+    def __pack(self, obj, out: bytearray) -> None:
+        if obj is None:
+            out.append(0xc0)
+        elif obj is True:
+            out.append(0xc3)
+        elif obj is False:
+            out.append(0xc2)
+        elif type(obj) is int:
+            if 0 <= obj < 0x80:
+                out.append(obj)
+            elif -0x20 <= obj < 0:
+                out += struct.pack('!b', obj)
+            elif -0x8000000000000000 <= obj < 0:
+                out += struct.pack('!Bq', 0xd3, obj)
+            elif 0 <= obj < 0x10000000000000000:
+                out += struct.pack('!BQ', 0xcf, obj)
+            else:
+                raise TypeError('integer out of range for compact codec')
+        elif type(obj) is float:
+            out += struct.pack('!Bd', 0xcb, obj)
+        elif type(obj) is str:
+            raw = obj.encode()
+            self.__pack_length(len(raw), 0xa0, 31, (0xd9, 0xda, 0xdb), out)
+            out += raw
+        elif type(obj) in (bytes, bytearray, memoryview):
+            raw = bytes(obj)
+            self.__pack_length(len(raw), None, 0, (0xc4, 0xc5, 0xc6), out)
+            out += raw
+        elif type(obj) is list:
+            self.__pack_length(len(obj), 0x90, 15, (None, 0xdc, 0xdd), out)
+            for item in obj:
+                self.__pack(item, out)
+        elif type(obj) is dict:
+            self.__pack_length(len(obj), 0x80, 15, (None, 0xde, 0xdf), out)
+            for key, value in obj.items():
+                self.__pack(key, out)
+                self.__pack(value, out)
+        elif type(obj) in (tuple, set, frozenset):
+            inner = bytearray()
+            self.__pack(list(obj), inner)
+            out += struct.pack('!BIb', 0xc9, len(inner), self.EXT_TUPLE if type(obj) is tuple else self.EXT_SET)
+            out += inner
+        else:
+            raise TypeError('compact codec cannot encode {}'.format(type(obj).__name__))
+
+    def __unpack(self, data: memoryview, pos: int) -> tuple:
+        code = data[pos]
+        pos += 1
+        if code < 0x80:
+            return code, pos
+        if code >= 0xe0:
+            return code - 0x100, pos
+        if 0xa0 <= code <= 0xbf:
+            return self.__str(data, pos, code & 0x1f)
+        if 0x90 <= code <= 0x9f:
+            return self.__list(data, pos, code & 0x0f)
+        if 0x80 <= code <= 0x8f:
+            return self.__dict(data, pos, code & 0x0f)
+        if code == 0xc0:
+            return None, pos
+        if code == 0xc2:
+            return False, pos
+        if code == 0xc3:
+            return True, pos
+        if code == 0xcb:
+            return struct.unpack_from('!d', data, pos)[0], pos + 8
+        if code == 0xd3:
+            return struct.unpack_from('!q', data, pos)[0], pos + 8
+        if code == 0xcf:
+            return struct.unpack_from('!Q', data, pos)[0], pos + 8
+        if code in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6, 0xdc, 0xdd, 0xde, 0xdf):
+            fmt = {0xd9: '!B', 0xc4: '!B', 0xda: '!H', 0xc5: '!H', 0xdc: '!H', 0xde: '!H'}.get(code, '!I')
+            (n,) = struct.unpack_from(fmt, data, pos)
+            pos += struct.calcsize(fmt)
+            if code in (0xd9, 0xda, 0xdb):
+                return self.__str(data, pos, n)
+            if code in (0xc4, 0xc5, 0xc6):
+                return bytes(data[pos:pos + n]), pos + n
+            if code in (0xdc, 0xdd):
+                return self.__list(data, pos, n)
+            return self.__dict(data, pos, n)
+        if code == 0xc9:
+            _, ext = struct.unpack_from('!Ib', data, pos)
+            items, pos = self.__unpack(data, pos + 5)
+            return (tuple(items) if ext == self.EXT_TUPLE else set(items)), pos
+        raise ValueError('unsupported compact type code {:#x}'.format(code))
+
+    @staticmethod
+    def __str(data: memoryview, pos: int, n: int) -> tuple:
+        return str(data[pos:pos + n], 'utf-8'), pos + n
+
+    def __list(self, data: memoryview, pos: int, n: int) -> tuple:
+        items = []
+        for _ in range(n):
+            item, pos = self.__unpack(data, pos)
+            items.append(item)
+        return items, pos
+
+    def __dict(self, data: memoryview, pos: int, n: int) -> tuple:
+        items = {}
+        for _ in range(n):
+            key, pos = self.__unpack(data, pos)
+            items[key], pos = self.__unpack(data, pos)
+        return items, pos
+
+
+class Compressor:
+    """
+    A compressor shrinks serialized messages before transfer.
+
+    Like codecs, compressors are identified by a name and a single tag byte, which is recorded in
+    compressed envelopes in place of the codec tag. Compressed data contains the codec tag and the
+    serialized message, so receivers decompress and decode any envelope without configuration.
+    """
+
+    name: str = None
+    tag: bytes = None
+
+    def __init__(self, level: int = None):
+        """
+        :param level: compression level (None for the default of the algorithm)
+        """
+        self.level: int = level
+
+    def compress(self, data) -> bytes:
+        """
+        Compress serialized data.
+        :param data: bytes-like data
+        :return: compressed data
+        """
+        raise NotImplementedError
+
+    def decompress(self, data) -> bytes:
+        """
+        Restore compressed data.
+        :param data: bytes-like compressed data
+        :return: original data
+        """
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    """
+    zlib (deflate). Fast, levels 0-9, default 6.
+    """
+
+    name = 'zlib'
+    tag = b'z'
+
+    def compress(self, data) -> bytes:
+        return zlib.compress(data, -1 if self.level is None else self.level)
+
+    def decompress(self, data) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCompressor(Compressor):
+    """
+    lzma (xz container). Slower but better compression, presets 0-9, default 6.
+    """
+
+    name = 'lzma'
+    tag = b'x'
+
+    def compress(self, data) -> bytes:
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data) -> bytes:
+        return lzma.decompress(data)
+
+
+COMPRESSORS: dict = {compressor.name: compressor for compressor in [ZlibCompressor, LzmaCompressor]}
+"""Built-in compressor classes by name"""
+
+_COMPRESSOR_BY_TAG: dict = {compressor.tag: compressor() for compressor in COMPRESSORS.values()}
+
+CODECS: dict = {codec.name: codec for codec in [PickleCodec(), Pickle5Codec(), MarshalCodec(), CompactCodec()]}
+"""Built-in codecs by name"""
+
+_BY_TAG: dict = {codec.tag: codec for codec in CODECS.values()}
+
+
+def get(codec) -> Codec:
+    """
+    Look up a codec.
+    :param codec: a codec name or a Codec instance
+    :return: Codec instance
+    """
+    if isinstance(codec, Codec):
+        return codec
+    return CODECS[codec]
+
+
+def register(codec: Codec) -> None:
+    """
+    Make a custom codec available by name and tag. Tags need to be unique.
+    :param codec: Codec instance
+    :return: None
+    """
+    assert codec.tag not in _BY_TAG or _BY_TAG[codec.tag] is codec, 'codec tag in use'
+    assert codec.tag not in _COMPRESSOR_BY_TAG, 'tag of a compressor'
+    assert codec.tag not in (b't', b'h', b's'), 'tag reserved for trace stamps and shared payload/memory handles'
+    CODECS[codec.name] = codec
+    _BY_TAG[codec.tag] = codec
+
+
+def by_tag(tag: bytes) -> Codec:
+    """
+    Look up the codec of an envelope.
+    :param tag: single tag byte
+    :return: Codec instance
+    """
+    return _BY_TAG[tag]
+
+
+def compressor(compression, level: int = None) -> Compressor:
+    """
+    Look up a compressor.
+    :param compression: a compressor name, a Compressor instance or None
+    :param level: compression level for compressors given by name
+    :return: Compressor instance or None (no compression)
+    """
+    if compression is None or isinstance(compression, Compressor):
+        return compression
+    return COMPRESSORS[compression](level)
+
+
+def compressor_by_tag(tag: bytes) -> Compressor:
+    """
+    Look up the compressor of an envelope.
+    :param tag: single tag byte
+    :return: Compressor instance or None if the envelope is not compressed
+    """
+    return _COMPRESSOR_BY_TAG.get(tag)
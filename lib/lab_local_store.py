@@ -0,0 +1,852 @@
+import atexit
+import collections
+import fnmatch
+import multiprocessing
+import os
+import pickle
+import struct
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+import redis
+
+from . import lab_shared_memory
+
+PREFIX = 'vs2lab.store-'
+"""Name prefix of the segments of shared stores (not removed by lab_shared_memory.sweep)"""
+
+
+def _b(value) -> bytes:
+    """
+    Encode a value the way redis-py does.
+    :param value: bytes, str or number
+    :return: bytes
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return str(value).encode()
+
+
+def _k(key) -> str:
+    """
+    Normalize a key name.
+    :param key: bytes or str
+    :return: str
+    """
+    return key.decode() if isinstance(key, bytes) else str(key)
+
+
+class LocalStore:
+    """
+    LocalStore is an in-memory replacement for redis, implementing the subset of redis commands
+    used by lab_channel. Use it to run channel members within one process (threads or tasks) without
+    a redis server. For members in several processes on the same host, see SharedStore.
+
+    Values are stored and returned as bytes, like redis-py does. Sets are python sets, lists are deques.
+    Keys with a time to live expire lazily, when they are accessed next. All commands are atomic.
+    Blocking pops wait on a condition variable that is notified by pushes.
+    Every write increments a version counter of the key, which implements WATCH for pipelines.
+    """
+
+    def __init__(self):
+        self._data: dict = {}
+        self._versions: dict = {}
+        # expiry times of keys with a time to live (time.monotonic)
+        self._expires: dict = {}
+        self._cond = threading.Condition(threading.RLock())
+
+    def _touch(self, key: str) -> None:
+        self._versions[key] = self._versions.get(key, 0) + 1
+        if key in self._data and len(self._data[key]) == 0:
+            del self._data[key]  # like redis, drop empty collections
+
+    def _expired(self, key: str) -> bool:
+        deadline = self._expires.get(key)
+        if deadline is None or deadline > time.monotonic():
+            return False
+        del self._expires[key]
+        self._data.pop(key, None)
+        self._touch(key)
+        return True
+
+    def _get(self, key: str, kind: type):
+        self._expired(key)
+        value = self._data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise redis.ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    # keys
+
+    def flushall(self) -> bool:
+        with self._cond:
+            for key in list(self._data):
+                del self._data[key]
+                self._touch(key)
+            self._expires.clear()
+            return True
+
+    def delete(self, *names) -> int:
+        with self._cond:
+            count = 0
+            for key in map(_k, names):
+                self._expires.pop(key, None)
+                if self._data.pop(key, None) is not None:
+                    count += 1
+                    self._touch(key)
+            return count
+
+    def exists(self, *names) -> int:
+        with self._cond:
+            return sum(1 for key in map(_k, names) if not self._expired(key) and key in self._data)
+
+    def keys(self, pattern='*') -> list:
+        with self._cond:
+            return [_b(key) for key in list(self._data)
+                    if fnmatch.fnmatchcase(key, _k(pattern)) and not self._expired(key)]
+
+    def scan_iter(self, match='*', count: int = None):
+        return iter(self.keys(match))
+
+    def unlink(self, *names) -> int:
+        return self.delete(*names)
+
+    def expire(self, name, seconds: int) -> bool:
+        return self.pexpire(name, seconds * 1000)
+
+    def pexpire(self, name, milliseconds: int) -> bool:
+        with self._cond:
+            key = _k(name)
+            if self._expired(key) or key not in self._data:
+                return False
+            self._expires[key] = time.monotonic() + milliseconds / 1000
+            return True
+
+    # strings
+
+    def set(self, name, value, ex=None, px=None) -> bool:
+        with self._cond:
+            key = _k(name)
+            self._data[key] = _b(value)
+            self._expires.pop(key, None)
+            if ex is not None or px is not None:
+                self._expires[key] = time.monotonic() + (ex if ex is not None else px / 1000)
+            self._touch(key)
+            return True
+
+    def get(self, name):
+        with self._cond:
+            return self._get(_k(name), bytes)
+
+    # sets
+
+    def sadd(self, name, *values) -> int:
+        with self._cond:
+            key = _k(name)
+            members = self._get(key, set)
+            if members is None:
+                members = self._data[key] = set()
+            before = len(members)
+            members.update(map(_b, values))
+            self._touch(key)
+            return len(members) - before
+
+    def srem(self, name, *values) -> int:
+        with self._cond:
+            key = _k(name)
+            members = self._get(key, set) or set()
+            before = len(members)
+            members.difference_update(map(_b, values))
+            self._touch(key)
+            return before - len(members)
+
+    def smembers(self, name) -> set:
+        with self._cond:
+            return set(self._get(_k(name), set) or ())
+
+    def scard(self, name) -> int:
+        with self._cond:
+            return len(self._get(_k(name), set) or ())
+
+    def sismember(self, name, value) -> bool:
+        with self._cond:
+            return _b(value) in (self._get(_k(name), set) or ())
+
+    def smismember(self, name, values, *args) -> list:
+        with self._cond:
+            members = self._get(_k(name), set) or ()
+            return [_b(value) in members for value in list(values) + list(args)]
+
+    # lists
+
+    def rpush(self, name, *values) -> int:
+        with self._cond:
+            key = _k(name)
+            items = self._get(key, collections.deque)
+            if items is None:
+                items = self._data[key] = collections.deque()
+            items.extend(map(_b, values))
+            length = len(items)
+            self._touch(key)
+            self._cond.notify_all()
+            return length
+
+    def lpush(self, name, *values) -> int:
+        with self._cond:
+            key = _k(name)
+            items = self._get(key, collections.deque)
+            if items is None:
+                items = self._data[key] = collections.deque()
+            items.extendleft(map(_b, values))
+            length = len(items)
+            self._touch(key)
+            self._cond.notify_all()
+            return length
+
+    def lpop(self, name, count=None):
+        with self._cond:
+            key = _k(name)
+            items = self._get(key, collections.deque)
+            if not items:
+                return None
+            if count is None:
+                value = items.popleft()
+            else:
+                value = [items.popleft() for _ in range(min(count, len(items)))]
+            self._touch(key)
+            return value
+
+    def llen(self, name) -> int:
+        with self._cond:
+            return len(self._get(_k(name), collections.deque) or ())
+
+    def lrange(self, name, start: int, end: int) -> list:
+        with self._cond:
+            items = list(self._get(_k(name), collections.deque) or ())
+            return items[start:None if end == -1 else end + 1]
+
+    def lrem(self, name, count: int, value) -> int:
+        with self._cond:
+            key = _k(name)
+            items = self._get(key, collections.deque)
+            if not items:
+                return 0
+            value = _b(value)
+            indices = [i for i, item in enumerate(items) if item == value]
+            if count < 0:
+                indices = indices[count:]
+            elif count > 0:
+                indices = indices[:count]
+            for i in reversed(indices):
+                del items[i]
+            self._touch(key)
+            return len(indices)
+
+    def ltrim(self, name, start: int, end: int) -> bool:
+        with self._cond:
+            key = _k(name)
+            items = self._get(key, collections.deque)
+            if items:
+                kept = list(items)[start:None if end == -1 else end + 1]
+                items.clear()
+                items.extend(kept)
+                self._touch(key)
+            return True
+
+    def blpop(self, keys, timeout=0):
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        keys = [_k(key) for key in keys]
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while True:
+                for key in keys:
+                    if self.llen(key):
+                        return _b(key), self.lpop(key)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    # hashes
+
+    def hset(self, name, key, value) -> int:
+        with self._cond:
+            name = _k(name)
+            fields = self._get(name, dict)
+            if fields is None:
+                fields = self._data[name] = {}
+            added = _b(key) not in fields
+            fields[_b(key)] = _b(value)
+            self._touch(name)
+            return int(added)
+
+    def hdel(self, name, *keys) -> int:
+        with self._cond:
+            name = _k(name)
+            fields = self._get(name, dict) or {}
+            count = sum(1 for key in map(_b, keys) if fields.pop(key, None) is not None)
+            self._touch(name)
+            return count
+
+    def hget(self, name, key):
+        with self._cond:
+            return (self._get(_k(name), dict) or {}).get(_b(key))
+
+    def hincrby(self, name, key, amount: int = 1) -> int:
+        with self._cond:
+            name = _k(name)
+            fields = self._get(name, dict)
+            if fields is None:
+                fields = self._data[name] = {}
+            value = int(fields.get(_b(key), 0)) + amount
+            fields[_b(key)] = _b(value)
+            self._touch(name)
+            return value
+
+    def hgetall(self, name) -> dict:
+        with self._cond:
+            return dict(self._get(_k(name), dict) or {})
+
+    # pub/sub (messages are not delivered, local stores are used without membership cache)
+
+    def publish(self, channel, message) -> int:
+        return 0
+
+    # transactions
+
+    def versions(self, keys) -> list:
+        """
+        Retrieve version counters of keys (for WATCH).
+        :param keys: key names
+        :return: list of counters
+        """
+        with self._cond:
+            return [self._versions.get(_k(key), 0) for key in keys]
+
+    def execute(self, commands: list, watched: dict = None) -> list:
+        """
+        Atomically execute a list of commands.
+        :param commands: list of (command name, args, kwargs) tuples
+        :param watched: dict of watched keys and their versions at WATCH time
+        :return: list of command results
+        """
+        with self._cond:
+            if watched and self.versions(watched.keys()) != list(watched.values()):
+                raise redis.WatchError('Watched variable changed.')
+            return [getattr(self, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class LocalPipeline:
+    """
+    Client side pipeline for a LocalStore (or a proxy of it).
+    Commands are buffered and executed atomically with a single call (i.e. round trip).
+    Before multi() is called, commands of a watching pipeline are executed immediately, like in redis-py.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.commands: list = []
+        self.watched: dict = None
+        self.immediate: bool = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def reset(self) -> None:
+        self.commands = []
+        self.watched = None
+        self.immediate = False
+
+    def watch(self, *names) -> None:
+        self.watched = dict(zip(names, self.store.versions(names)))
+        self.immediate = True
+
+    def multi(self) -> None:
+        self.immediate = False
+
+    def execute(self) -> list:
+        commands, watched = self.commands, self.watched
+        self.reset()
+        return self.store.execute(commands, watched)
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            if self.immediate:
+                return getattr(self.store, name)(*args, **kwargs)
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+
+class LocalClient:
+    """
+    redis-py like client for a LocalStore or a proxy of a served LocalStore.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def pipeline(self, transaction: bool = True) -> LocalPipeline:
+        return LocalPipeline(self.store)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+_STORE = LocalStore()
+
+
+def client() -> LocalClient:
+    """
+    Create a client of the process-wide LocalStore.
+    :return: redis-py like client
+    """
+    return LocalClient(_STORE)
+
+
+def _store() -> LocalStore:
+    return _STORE
+
+
+class _StoreManager(BaseManager):
+    pass
+
+
+_StoreManager.register('store', callable=_store)
+
+
+def serve(address: tuple = ('localhost', 6380), authkey: bytes = b'vs2lab') -> BaseManager:
+    """
+    Serve a LocalStore to other processes (on the same host) from a background server process.
+    Keep the returned manager referenced as long as the store is needed.
+    Limitation: clients reach the store through a multiprocessing manager proxy, every command (and every
+    pipeline command) is a round trip over a socket with pickling on both ends, about 1.5 ms per ping-pong
+    of channel members. That is not faster than a local redis server, members in several processes
+    of one host better use a SharedStore (about 0.4 ms).
+    :param address: (host, port) to listen on
+    :param authkey: shared secret of server and clients
+    :return: the running manager
+    """
+    manager = _StoreManager(address=address, authkey=authkey)
+    manager.start()
+    return manager
+
+
+def connect(address: tuple = ('localhost', 6380), authkey: bytes = b'vs2lab') -> LocalClient:
+    """
+    Connect to a served LocalStore.
+    :param address: (host, port) of the server
+    :param authkey: shared secret of server and clients
+    :return: redis-py like client
+    """
+    manager = _StoreManager(address=address, authkey=authkey)
+    manager.connect()
+    return LocalClient(manager.store())
+
+
+class _Ring:
+    """
+    List of byte strings in a shared memory segment: a ring buffer of length-prefixed records behind a header
+    with the capacity, the offset of the first record, the bytes used, the number of records and a version counter.
+    """
+
+    HEADER = struct.Struct('<QQQQQ')
+    LENGTH = struct.Struct('<I')
+
+    def __init__(self, segment: lab_shared_memory.Segment):
+        self.segment = segment
+        self.buffer: memoryview = segment.buffer
+        self.capacity: int = self.HEADER.unpack_from(self.buffer)[0]
+
+    @classmethod
+    def create(cls, capacity: int, version: int = 0) -> '_Ring':
+        segment = lab_shared_memory.Segment(size=cls.HEADER.size + capacity, prefix=PREFIX)
+        cls.HEADER.pack_into(segment.buffer, 0, capacity, 0, 0, 0, version)
+        return cls(segment)
+
+    def __len__(self) -> int:
+        return self.HEADER.unpack_from(self.buffer)[3]
+
+    @property
+    def version(self) -> int:
+        return self.HEADER.unpack_from(self.buffer)[4]
+
+    def needed(self, values: list) -> int:
+        """
+        Compute the capacity needed to add values.
+        :param values: byte strings
+        :return: bytes
+        """
+        return self.HEADER.unpack_from(self.buffer)[2] + sum(self.LENGTH.size + len(value) for value in values)
+
+    def __write(self, offset: int, data) -> int:
+        data = memoryview(data)
+        first = min(len(data), self.capacity - offset)
+        base = self.HEADER.size
+        self.buffer[base + offset:base + offset + first] = data[:first]
+        self.buffer[base:base + len(data) - first] = data[first:]
+        return (offset + len(data)) % self.capacity
+
+    def __read(self, offset: int, size: int) -> tuple:
+        first = min(size, self.capacity - offset)
+        base = self.HEADER.size
+        data = bytes(self.buffer[base + offset:base + offset + first])
+        if first < size:
+            data += bytes(self.buffer[base:base + size - first])
+        return data, (offset + size) % self.capacity
+
+    def __records(self, offset: int, count: int):
+        for _ in range(count):
+            length, offset = self.__read(offset, self.LENGTH.size)
+            value, offset = self.__read(offset, self.LENGTH.unpack(length)[0])
+            yield value, offset
+
+    def push(self, values: list, left: bool = False) -> None:
+        """
+        Add values at the tail (like RPUSH) or at the head (like LPUSH, in reversed order). Needs enough capacity.
+        :param values: byte strings
+        :param left: add at the head
+        :return: None
+        """
+        capacity, head, used, count, version = self.HEADER.unpack_from(self.buffer)
+        size = sum(self.LENGTH.size + len(value) for value in values)
+        if left:
+            head = offset = (head - size) % capacity
+        else:
+            offset = (head + used) % capacity
+        for value in reversed(values) if left else values:
+            offset = self.__write(offset, self.LENGTH.pack(len(value)))
+            offset = self.__write(offset, value)
+        self.HEADER.pack_into(self.buffer, 0, capacity, head, used + size, count + len(values), version + 1)
+
+    def pop(self, n: int) -> list:
+        """
+        Remove up to n values from the head.
+        :param n: number of values
+        :return: list of byte strings
+        """
+        capacity, head, used, count, version = self.HEADER.unpack_from(self.buffer)
+        values = []
+        for value, head in self.__records(head, min(n, count)):
+            values.append(value)
+            used -= self.LENGTH.size + len(value)
+        self.HEADER.pack_into(self.buffer, 0, capacity, head, used, count - len(values), version + 1)
+        return values
+
+    def items(self) -> list:
+        """
+        Read all values.
+        :return: list of byte strings
+        """
+        _, head, _, count, _ = self.HEADER.unpack_from(self.buffer)
+        return [value for value, _ in self.__records(head, count)]
+
+    def replace(self, values: list) -> None:
+        """
+        Replace all values (by fewer ones).
+        :param values: byte strings
+        :return: None
+        """
+        capacity, _, _, _, version = self.HEADER.unpack_from(self.buffer)
+        self.HEADER.pack_into(self.buffer, 0, capacity, 0, 0, 0, version)
+        self.push(values)
+
+
+class _SharedCondition:
+    """
+    Condition of a SharedStore, shared by all processes: the outermost acquisition within a process loads
+    the snapshot of the store if other processes have changed it, the outermost release saves it if changed.
+    """
+
+    def __init__(self, store: 'SharedStore', condition):
+        self.store = store
+        self.condition = condition
+        self.depth: int = 0
+
+    def __enter__(self):
+        self.condition.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            self.store._load()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.depth == 1:
+                self.store._save()
+        finally:
+            self.depth -= 1
+            self.condition.release()
+
+    def wait(self, timeout: float = None) -> bool:
+        self.store._save()
+        depth, self.depth = self.depth, 0
+        try:
+            return self.condition.wait(timeout)
+        finally:
+            self.depth = depth
+            self.store._load()
+
+    def notify_all(self) -> None:
+        self.condition.notify_all()
+
+
+class SharedStore(LocalStore):
+    """
+    SharedStore is a LocalStore in shared memory, for members in several processes on the same host.
+    Create it in the parent process, pass it to the member processes (as argument of multiprocessing.Process,
+    like a lock) and use it as backend of their channels, e.g. Channel(backend=store).
+
+    Lists (inboxes, stashes) are ring buffers in shared memory segments of their own, growing as needed,
+    so sending and receiving copy envelopes in and out without any round trip. All other keys (member sets,
+    hashes, strings) are kept by each process as a copy of a pickled snapshot in shared memory, which is
+    reloaded when another process has changed it and written after own changes. These change much less often
+    than inboxes, but keep large shared payloads out of them (share_threshold=None).
+    All commands are atomic under a lock shared by all processes, blocking pops wait on a shared condition.
+    Lists do not expire. The creating process removes all segments by close(), at the latest when it exits.
+    """
+
+    RING_SIZE = 4096
+    """Initial capacity of list rings in bytes (doubled when full)"""
+
+    SNAPSHOT_SIZE = 65536
+    """Initial size of the snapshot segment in bytes"""
+
+    # generation counter of the snapshot, its length and the name of its segment
+    ROOT = struct.Struct('<QQ64s')
+
+    def __init__(self, context=None):
+        """
+        Create a shared store.
+        :param context: multiprocessing context of the member processes, None for the default one
+        """
+        super().__init__()
+        context = context or multiprocessing.get_context()
+        # list key -> name of the ring segment
+        self._lists: dict = {}
+        self.__owner = os.getpid()
+        self.__root = lab_shared_memory.Segment(size=self.ROOT.size, prefix=PREFIX)
+        self.__attach(context.Condition(context.RLock()), 0)
+        self._dirty = True
+        with self._cond:
+            pass  # save the empty snapshot
+        atexit.register(self.close)
+
+    def __attach(self, condition, generation: int) -> None:
+        self._cond = _SharedCondition(self, condition)
+        self._dirty = False
+        self.__generation = generation
+        self.__snapshot: lab_shared_memory.Segment = None
+        # segment name -> mapped ring
+        self.__rings: dict = {}
+
+    def __getstate__(self) -> dict:
+        return {'condition': self._cond.condition, 'root': self.__root.name}
+
+    def __setstate__(self, state: dict) -> None:
+        LocalStore.__init__(self)
+        self._lists = {}
+        self.__owner = None
+        self.__root = lab_shared_memory.Segment(state['root'])
+        self.__attach(state['condition'], -1)
+
+    def pipeline(self, transaction: bool = True) -> LocalPipeline:
+        return LocalPipeline(self)
+
+    def close(self) -> None:
+        """
+        Unmap the store in this process. In the creating process, remove it (other processes need to be done).
+        :return: None
+        """
+        if self.__root is None:
+            return
+        names = [self.__root.name]
+        with self._cond:
+            names.extend(self._lists.values())
+            for ring in self.__rings.values():
+                ring.segment.close()
+            self.__rings.clear()
+            if self.__snapshot is not None:
+                names.append(self.__snapshot.name)
+                self.__snapshot.close()
+        self.__root.close()
+        self.__root = None
+        if self.__owner == os.getpid():
+            for name in names:
+                lab_shared_memory.unlink(name)
+
+    # snapshot of all keys but lists
+
+    def _touch(self, key: str) -> None:
+        self._dirty = True
+        super()._touch(key)
+
+    def _load(self) -> None:
+        generation, length, name = self.ROOT.unpack_from(self.__root.buffer)
+        if generation == self.__generation:
+            return
+        name = name.rstrip(b'\0').decode()
+        if self.__snapshot is None or self.__snapshot.name != name:
+            if self.__snapshot is not None:
+                self.__snapshot.close()
+            self.__snapshot = lab_shared_memory.Segment(name)
+        self._data, self._versions, self._expires, self._lists = pickle.loads(self.__snapshot.buffer[:length])
+        self.__generation = generation
+        # drop mappings of rings removed (or grown) by other processes
+        for name in set(self.__rings) - set(self._lists.values()):
+            self.__rings.pop(name).segment.close()
+
+    def _save(self) -> None:
+        if not self._dirty:
+            return
+        snapshot = pickle.dumps((self._data, self._versions, self._expires, self._lists), pickle.HIGHEST_PROTOCOL)
+        if self.__snapshot is None or len(snapshot) > len(self.__snapshot.buffer):
+            previous = self.__snapshot
+            self.__snapshot = lab_shared_memory.Segment(size=max(self.SNAPSHOT_SIZE, 2 * len(snapshot)),
+                                                        prefix=PREFIX)
+            if previous is not None:
+                previous.close()
+                lab_shared_memory.unlink(previous.name)
+        self.__snapshot.buffer[:len(snapshot)] = snapshot
+        self.__generation += 1
+        self.ROOT.pack_into(self.__root.buffer, 0, self.__generation, len(snapshot), self.__snapshot.name.encode())
+        self._dirty = False
+
+    # rings
+
+    def __ring(self, key: str, create: bool = False) -> _Ring:
+        name = self._lists.get(key)
+        if name is None:
+            if not create:
+                return None
+            self._get(key, _Ring)  # raises if the key holds another kind of value
+            ring = _Ring.create(self.RING_SIZE)
+            self._lists[key] = ring.segment.name
+            self.__rings[ring.segment.name] = ring
+            self._dirty = True
+            return ring
+        ring = self.__rings.get(name)
+        if ring is None:
+            ring = self.__rings[name] = _Ring(lab_shared_memory.Segment(name))
+        return ring
+
+    def __drop(self, key: str) -> None:
+        name = self._lists.pop(key)
+        ring = self.__rings.pop(name, None)
+        if ring is not None:
+            ring.segment.close()
+        lab_shared_memory.unlink(name)
+        self._dirty = True
+
+    def __push(self, name, values: tuple, left: bool) -> int:
+        with self._cond:
+            key = _k(name)
+            values = [_b(value) for value in values]
+            ring = self.__ring(key, create=True)
+            needed = ring.needed(values)
+            if needed > ring.capacity:
+                capacity = ring.capacity
+                while capacity < needed:
+                    capacity *= 2
+                grown = _Ring.create(capacity, ring.version)
+                grown.push(ring.items())
+                self.__drop(key)
+                self._lists[key] = grown.segment.name
+                self.__rings[grown.segment.name] = ring = grown
+            ring.push(values, left)
+            self._cond.notify_all()
+            return len(ring)
+
+    # keys
+
+    def flushall(self) -> bool:
+        with self._cond:
+            for key in list(self._lists):
+                self.delete(key)
+            return super().flushall()
+
+    def delete(self, *names) -> int:
+        with self._cond:
+            count = 0
+            for key in map(_k, names):
+                ring = self.__ring(key)
+                if ring is not None:
+                    count += 1 if len(ring) else 0
+                    self._versions[key] = self._versions.get(key, 0) + ring.version + 1
+                    self.__drop(key)
+            return count + super().delete(*names)
+
+    def exists(self, *names) -> int:
+        with self._cond:
+            return super().exists(*names) + sum(1 for name in names if self.llen(name))
+
+    def keys(self, pattern='*') -> list:
+        with self._cond:
+            return super().keys(pattern) + [_b(key) for key in self._lists
+                                            if fnmatch.fnmatchcase(key, _k(pattern)) and self.llen(key)]
+
+    # lists
+
+    def rpush(self, name, *values) -> int:
+        return self.__push(name, values, False)
+
+    def lpush(self, name, *values) -> int:
+        return self.__push(name, values, True)
+
+    def lpop(self, name, count=None):
+        with self._cond:
+            ring = self.__ring(_k(name))
+            if not ring:
+                return None
+            values = ring.pop(1 if count is None else count)
+            return values[0] if count is None else values
+
+    def llen(self, name) -> int:
+        with self._cond:
+            return len(self.__ring(_k(name)) or ())
+
+    def lrange(self, name, start: int, end: int) -> list:
+        with self._cond:
+            items = self.__ring(_k(name))
+            items = items.items() if items else []
+            return items[start:None if end == -1 else end + 1]
+
+    def lrem(self, name, count: int, value) -> int:
+        with self._cond:
+            ring = self.__ring(_k(name))
+            if not ring:
+                return 0
+            items, value = ring.items(), _b(value)
+            indices = [i for i, item in enumerate(items) if item == value]
+            if count < 0:
+                indices = indices[count:]
+            elif count > 0:
+                indices = indices[:count]
+            for i in reversed(indices):
+                del items[i]
+            ring.replace(items)
+            return len(indices)
+
+    def ltrim(self, name, start: int, end: int) -> bool:
+        with self._cond:
+            ring = self.__ring(_k(name))
+            if ring:
+                ring.replace(ring.items()[start:None if end == -1 else end + 1])
+            return True
+
+    # transactions
+
+    def versions(self, keys) -> list:
+        with self._cond:
+            versions = []
+            for key in map(_k, keys):
+                ring = self.__ring(key)
+                versions.append(self._versions.get(key, 0) + (ring.version if ring is not None else 0))
+            return versions
@@ -1,13 +1,195 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import threading
 
 
-def setup(stream_level=logging.WARNING, file_level=logging.DEBUG, file_postfix=''):
+class Lazy:
+    """
+    Log argument computed only when the record is formatted, i.e. never for disabled levels:
+    logger.debug("%s state %s", pid, Lazy(describe, state))
+    With queued logging (see setup), the function is called later by the listener thread,
+    so it must not depend on state that changes meanwhile.
+    """
+
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.function(*self.args))
+
+    __repr__ = __str__
+
+
+def lazy(function, *args) -> Lazy:
+    """
+    Defer a function call to the formatting of a log record (see Lazy).
+    :param function: function computing the argument
+    :param args: its arguments
+    :return: Lazy argument
+    """
+    return Lazy(function, *args)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats records as compact JSON objects, one per line: time, level, logger name, thread, message
+    and the formatted exception (if any).
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'t': round(record.created, 6), 'level': record.levelname, 'name': record.name,
+                 'thread': record.threadName, 'msg': record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class BatchFileHandler(logging.FileHandler):
+    """
+    File handler leaving flushes to its caller, so a batch of records costs a single write.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class _Snapshot:
+    """
+    Log argument formatted when the record was queued, standing in for a mutable argument next to Lazy ones.
+    """
+
+    __slots__ = ('text', 'representation')
+
+    def __init__(self, arg):
+        self.text = str(arg)
+        self.representation = repr(arg)
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return self.representation
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that formats messages (and exception tracebacks) before queueing them, like QueueHandler,
+    so later changes of log arguments do not show up. Only Lazy arguments are left to the listener thread:
+    messages with Lazy arguments are formatted there, their other mutable arguments are converted
+    to strings right away. The record layout (time, level, ...) is applied by the listener, too.
+    """
+
+    IMMUTABLE = (str, bytes, int, float, type(None), Lazy)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.args:
+            args = record.args
+            if any(isinstance(arg, Lazy) for arg in (args.values() if isinstance(args, dict) else args)):
+                if isinstance(args, dict):
+                    record.args = {key: self.__snapshot(arg) for key, arg in args.items()}
+                else:
+                    record.args = tuple(self.__snapshot(arg) for arg in args)
+            else:
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+    def __snapshot(self, arg):
+        return arg if isinstance(arg, self.IMMUTABLE) else _Snapshot(arg)
+
+
+class BatchListener:
+    """
+    Thread taking log records off a queue and passing them to handlers in batches
+    (everything queued meanwhile, up to batch_size records), flushing the handlers once per batch.
+    """
+
+    _STOP = None
+
+    def __init__(self, records: queue.SimpleQueue, handlers: list, batch_size: int = 256):
+        """
+        :param records: queue of log records
+        :param handlers: handlers of the records (filtered by their levels)
+        :param batch_size: maximum number of records per batch
+        """
+        self.queue = records
+        self.handlers: list = handlers
+        self.batch_size: int = batch_size
+        self.__thread = None
+
+    def start(self) -> None:
+        self.__thread = threading.Thread(target=self.__run, name='vs2lab-logging', daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Handle all records queued so far and stop the thread.
+        :return: None
+        """
+        if self.__thread is not None:
+            self.queue.put(self._STOP)
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is self._STOP:
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                handler.flush()
+            if batch[-1] is self._STOP:
+                return
+
+
+def setup(stream_level=logging.WARNING, file_level=logging.DEBUG, file_postfix='', queued=False,
+          json_lines=False, batch_size=256):
+    """
+    Configure the 'vs2lab' logger to log to the console and to file vs2lab<file_postfix>.log.
+    With queued=True, loggers just queue records. A listener thread formats them and writes them in batches,
+    so logging never blocks on file writes (the listener is stopped and drained at exit).
+    :param stream_level: level of console output
+    :param file_level: level of file output
+    :param file_postfix: postfix of the log file name
+    :param queued: log via a queue and listener thread
+    :param json_lines: write the log file as JSON lines (see JsonLinesFormatter)
+    :param batch_size: maximum number of records written at once by the listener
+    :return: the listener (BatchListener) if queued, else None
+    """
     # create logger with 'vs2lab'
     logger = logging.getLogger('vs2lab')
     logger.setLevel(logging.DEBUG)
 
     # create file handler which logs even debug messages
-    fh = logging.FileHandler('vs2lab' + file_postfix + '.log')
+    fh = BatchFileHandler('vs2lab' + file_postfix + '.log') if queued else \
+        logging.FileHandler('vs2lab' + file_postfix + '.log')
     fh.setLevel(file_level)
 
     # create console handler which logs even debug messages
@@ -17,9 +199,20 @@ def setup(stream_level=logging.WARNING, file_level=logging.DEBUG, file_postfix='
     # create formatter and add it to the handlers
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh.setFormatter(formatter)
+    fh.setFormatter(JsonLinesFormatter() if json_lines else formatter)
     ch.setFormatter(formatter)
 
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    if not queued:
+        # add the handlers to the logger
+        logger.addHandler(fh)
+        logger.addHandler(ch)
+        return None
+
+    # records below both levels are dropped before they are queued
+    logger.setLevel(min(file_level, stream_level))
+    records = queue.SimpleQueue()
+    listener = BatchListener(records, [fh, ch], batch_size)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(LazyQueueHandler(records))
+    return listener
@@ -0,0 +1,212 @@
+import bisect
+import os
+import threading
+import time
+
+
+class Histogram:
+    """
+    Latency histogram with fixed, roughly logarithmic buckets from 10us to 10s (in seconds).
+    Quantiles are estimated by the upper bound of the bucket they fall into.
+    """
+
+    BOUNDS: tuple = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                     0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        # the last bucket counts all values above the largest bound
+        self.buckets: list = [0] * (len(self.BOUNDS) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile.
+        :param q: quantile between 0 and 1
+        :return: upper bound of the bucket of the quantile (inf above the largest bound, None if empty)
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.BOUNDS + (float('inf'),), self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': dict(zip(self.BOUNDS + (float('inf'),), self.buckets))}
+
+
+class _Timer:
+    """
+    Context manager observing its duration in a histogram. Failed operations are counted separately.
+    """
+
+    __slots__ = ('metrics', 'name', 'label', 'start')
+
+    def __init__(self, metrics, name: str, label: str):
+        self.metrics = metrics
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, self.label, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.count(self.name + '_errors', self.label)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Metrics is a thread-safe registry of counters, gauges and latency histograms.
+    Every metric has a name and one label (e.g. 'op' or 'member'), its values are kept per label value.
+    Recording costs a lock acquisition and a few dict operations. A disabled registry records nothing.
+
+    snapshot() returns all values as nested dicts, prometheus() renders them in the Prometheus text
+    exposition format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled: bool = enabled
+        self.__lock = threading.Lock()
+        # name -> (label name, dict of label value -> value)
+        self.__counters: dict = {}
+        self.__gauges: dict = {}
+        self.__histograms: dict = {}
+
+    @staticmethod
+    def __family(families: dict, name: str, label: str) -> dict:
+        family = families.get(name)
+        if family is None:
+            family = families[name] = (label, {})
+        return family[1]
+
+    def count(self, name: str, value: str, amount: int = 1, label: str = 'member') -> None:
+        """
+        Increment a counter.
+        :param name: metric name
+        :param value: label value
+        :param amount: increment
+        :param label: label name (fixed on first use of the metric)
+        :return: None
+        """
+        if self.enabled:
+            with self.__lock:
+                values = self.__family(self.__counters, name, label)
+                values[value] = values.get(value, 0) + amount
+
+    def gauge(self, name: str, value: str, level: float, label: str = 'member') -> None:
+        """
+        Set a gauge.
+        :param name: metric name
+        :param value: label value
+        :param level: current level
+        :param label: label name (fixed on first use of the metric)
+        :return: None
+        """
+        if self.enabled:
+            with self.__lock:
+                self.__family(self.__gauges, name, label)[value] = level
+
+    def observe(self, name: str, value: str, seconds: float, label: str = 'op') -> None:
+        """
+        Record a duration in a histogram.
+        :param name: metric name
+        :param value: label value
+        :param seconds: duration
+        :param label: label name (fixed on first use of the metric)
+        :return: None
+        """
+        if self.enabled:
+            with self.__lock:
+                values = self.__family(self.__histograms, name, label)
+                histogram = values.get(value)
+                if histogram is None:
+                    histogram = values[value] = Histogram()
+                histogram.observe(seconds)
+
+    def timer(self, name: str, value: str):
+        """
+        Time a block of code: with metrics.timer('op_seconds', 'send_to'): ...
+        Exceptions are counted in <name>_errors.
+        :param name: histogram name
+        :param value: value of the 'op' label
+        :return: context manager
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, value)
+
+    def snapshot(self) -> dict:
+        """
+        Copy all current values.
+        :return: dict with 'counters', 'gauges' and 'histograms', each mapping metric names to dicts of label values
+        """
+        with self.__lock:
+            return {'counters': {name: dict(values) for name, (_, values) in self.__counters.items()},
+                    'gauges': {name: dict(values) for name, (_, values) in self.__gauges.items()},
+                    'histograms': {name: {value: histogram.snapshot() for value, histogram in values.items()}
+                                   for name, (_, values) in self.__histograms.items()}}
+
+    def prometheus(self, prefix: str = 'vs2lab_channel') -> str:
+        """
+        Render all metrics in the Prometheus text format.
+        :param prefix: prefix of metric names
+        :return: text
+        """
+        lines = []
+        with self.__lock:
+            for kind, families in (('counter', self.__counters), ('gauge', self.__gauges)):
+                for name, (label, values) in sorted(families.items()):
+                    lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+                    for value, level in sorted(values.items()):
+                        lines.append('{}_{}{{{}="{}"}} {}'.format(prefix, name, label, value, level))
+            for name, (label, values) in sorted(self.__histograms.items()):
+                lines.append('# TYPE {}_{} histogram'.format(prefix, name))
+                for value, histogram in sorted(values.items()):
+                    seen = 0
+                    for bound, n in zip(Histogram.BOUNDS + ('+Inf',), histogram.buckets):
+                        seen += n
+                        lines.append('{}_{}_bucket{{{}="{}",le="{}"}} {}'.format(
+                            prefix, name, label, value, bound, seen))
+                    lines.append('{}_{}_sum{{{}="{}"}} {}'.format(prefix, name, label, value, histogram.sum))
+                    lines.append('{}_{}_count{{{}="{}"}} {}'.format(prefix, name, label, value, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str, prefix: str = 'vs2lab_channel') -> None:
+        """
+        Write all metrics in the Prometheus text format to a file (e.g. for the node exporter textfile collector).
+        The file is replaced atomically, so readers never see partial content.
+        :param path: file name
+        :param prefix: prefix of metric names
+        :return: None
+        """
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as file:
+            file.write(self.prometheus(prefix))
+        os.replace(temp, path)
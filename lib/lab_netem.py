@@ -0,0 +1,248 @@
+"""
+Network condition emulation for channels
+
+Against a local redis, messages arrive almost instantly. EmulatedChannel wraps a Channel and
+holds back every message according to the conditions of its link (sender, receiver): a delay drawn
+from a distribution, reordering within a limit, a drop probability and partitions. A scheduler thread
+sends each message through the wrapped channel when it is due, so senders never sleep.
+
+Decisions are drawn from one random generator per link, seeded by the seed of the emulation and the
+link, so runs with the same seed (and member ids) see the same delays and drops on every link,
+regardless of how sender threads interleave.
+
+Usage:
+    chan = lab_netem.EmulatedChannel(lab_channel.Channel(), lab_netem.Conditions(delay=0.05, jitter=0.02), seed=1)
+    chan.link(a, b, lab_netem.Conditions(delay=0.2, loss=0.1))
+    chan.partition({a}, {b, c})
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import redis
+
+from . import lab_channel
+
+
+class Conditions:
+    """
+    Conditions of a link: delay distribution, reordering limit and drop probability.
+    """
+
+    DISTRIBUTIONS = ('constant', 'uniform', 'normal', 'exponential')
+
+    def __init__(self, delay: float = 0.0, jitter: float = 0.0, distribution='uniform', reorder: float = 0.0,
+                 loss: float = 0.0):
+        """
+        :param delay: mean one-way delay in seconds
+        :param jitter: spread of the delay in seconds: half width (uniform), standard deviation (normal)
+                       or mean of the exponential tail added to delay (exponential)
+        :param distribution: name of the delay distribution or a function drawing a delay from a random.Random
+        :param reorder: how many seconds a message may overtake earlier messages of the link
+                        (0 keeps the FIFO order of the link)
+        :param loss: drop probability
+        """
+        assert callable(distribution) or distribution in self.DISTRIBUTIONS, 'unknown delay distribution'
+        assert 0.0 <= loss <= 1.0, 'loss is a probability'
+        self.delay: float = delay
+        self.jitter: float = jitter
+        self.distribution = distribution
+        self.reorder: float = reorder
+        self.loss: float = loss
+
+    def __repr__(self) -> str:
+        return 'Conditions(delay={}, jitter={}, distribution={!r}, reorder={}, loss={})'.format(
+            self.delay, self.jitter, self.distribution, self.reorder, self.loss)
+
+    def draw(self, rng: random.Random) -> float:
+        """
+        Draw the delay of a message.
+        :param rng: random generator of the link
+        :return: delay in seconds (never negative)
+        """
+        if callable(self.distribution):
+            delay = self.distribution(rng)
+        elif self.distribution == 'uniform':
+            delay = rng.uniform(self.delay - self.jitter, self.delay + self.jitter)
+        elif self.distribution == 'normal':
+            delay = rng.gauss(self.delay, self.jitter)
+        elif self.distribution == 'exponential':
+            delay = self.delay + (rng.expovariate(1 / self.jitter) if self.jitter > 0 else 0.0)
+        else:
+            delay = self.delay
+        return max(0.0, delay)
+
+
+class EmulatedChannel:
+    """
+    Channel wrapper delaying, reordering and dropping messages per link.
+    Send operations schedule a delivery per receiver, all other operations go to the wrapped channel directly.
+    Messages are sent when they are due, so do not change them after sending.
+    Validation errors of the wrapped channel (e.g. a receiver that left meanwhile) show up at delivery
+    and are counted as failed, like messages lost on the way.
+    """
+
+    def __init__(self, channel: lab_channel.Channel, conditions: Conditions = None, seed: int = None):
+        """
+        :param channel: wrapped channel
+        :param conditions: conditions of all links without conditions of their own (None: no impairment)
+        :param seed: seed of the random generators of the links (None: not repeatable)
+        """
+        self.channel: lab_channel.Channel = channel
+        self.conditions: Conditions = conditions or Conditions()
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        # conditions, random generators and latest due time per link
+        self.__links: dict = {}
+        self.__rngs: dict = {}
+        self.__last: dict = {}
+        # partition groups (list of sets of member ids)
+        self.__groups: list = []
+        # scheduled deliveries: heap of (due time, sequence number, sender, receiver, message, lane)
+        self.__pending: list = []
+        self.__sequence = itertools.count()
+        self.__lock = threading.Condition()
+        self.__stopped: bool = False
+        self.stats: dict = {'scheduled': 0, 'delivered': 0, 'lost': 0, 'partitioned': 0, 'failed': 0}
+        self.logger = logging.getLogger('vs2lab.netem.EmulatedChannel')
+        self.__scheduler = threading.Thread(target=self.__run, name='vs2lab-netem', daemon=True)
+        self.__scheduler.start()
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+    def link(self, sender: str, receiver: str, conditions: Conditions = None, symmetric: bool = True) -> None:
+        """
+        Set the conditions of a link.
+        :param sender: member id
+        :param receiver: member id
+        :param conditions: conditions of the link, None to apply the default conditions again
+        :param symmetric: set the conditions of the reverse link, too
+        :return: None
+        """
+        with self.__lock:
+            for link in [(sender, receiver), (receiver, sender)][:2 if symmetric else 1]:
+                if conditions is None:
+                    self.__links.pop(link, None)
+                else:
+                    self.__links[link] = conditions
+
+    def partition(self, *groups) -> None:
+        """
+        Split the network: members of different groups cannot reach each other, messages between
+        them are dropped (in flight, too). Members not in any group reach everyone.
+        :param groups: sets of member ids
+        :return: None
+        """
+        with self.__lock:
+            self.__groups = [set(group) for group in groups]
+
+    def heal(self) -> None:
+        """
+        Remove all partitions.
+        :return: None
+        """
+        self.partition()
+
+    def member(self, pid: str) -> lab_channel.Member:
+        """
+        Get a handle of a member whose send operations are emulated (see Channel.member).
+        :param pid: identifier of member
+        :return: Member handle
+        """
+        self.channel.member(pid)
+        return lab_channel.Member(self, pid)
+
+    def __reachable(self, sender: str, receiver: str) -> bool:
+        # the caller holds the lock
+        sides = [i for i, group in enumerate(self.__groups) if sender in group or receiver in group]
+        return all(sender in self.__groups[i] and receiver in self.__groups[i] for i in sides)
+
+    def __schedule(self, sender: str, receivers, message: object, lane: str) -> None:
+        """
+        Draw the fate of a message on the link to each receiver and schedule its delivery.
+        :param sender: member id of the sender
+        :param receivers: iterable of receiver ids
+        :param message: message
+        :param lane: priority lane
+        :return: None
+        """
+        now = time.monotonic()
+        with self.__lock:
+            for receiver in receivers:
+                link = (sender, receiver)
+                conditions = self.__links.get(link, self.conditions)
+                rng = self.__rngs.get(link)
+                if rng is None:
+                    rng = self.__rngs[link] = random.Random('{}:{}:{}'.format(self.seed, sender, receiver))
+                if not self.__reachable(sender, receiver):
+                    self.stats['partitioned'] += 1
+                    continue
+                if conditions.loss > 0 and rng.random() < conditions.loss:
+                    self.stats['lost'] += 1
+                    continue
+                # a message may overtake earlier ones of the link by at most the reorder limit
+                due = max(now + conditions.draw(rng), self.__last.get(link, now) - conditions.reorder)
+                self.__last[link] = max(due, self.__last.get(link, due))
+                heapq.heappush(self.__pending, (due, next(self.__sequence), sender, receiver, message, lane))
+                self.stats['scheduled'] += 1
+            self.__lock.notify()
+
+    def send_to(self, destination_set: set, message: object, lane: str = 'data') -> None:
+        assert lane in self.channel.LANES, 'unknown lane'
+        self.__schedule(self.channel.caller(), destination_set, message, lane)
+
+    def send_many(self, batch: list, lane: str = 'data') -> None:
+        assert lane in self.channel.LANES, 'unknown lane'
+        sender = self.channel.caller()
+        for destination_set, message in batch:
+            self.__schedule(sender, destination_set, message, lane)
+
+    def send_to_all(self, message: object, lane: str = 'data') -> None:
+        assert lane in self.channel.LANES, 'unknown lane'
+        self.__schedule(self.channel.caller(), self.channel.members(), message, lane)
+
+    def in_flight(self) -> int:
+        """
+        Count the messages scheduled but not yet delivered.
+        :return: number of messages
+        """
+        with self.__lock:
+            return len(self.__pending)
+
+    def __run(self) -> None:
+        """
+        Send scheduled messages through the wrapped channel when they are due.
+        :return: None
+        """
+        while True:
+            with self.__lock:
+                while self.__pending and self.__pending[0][0] > time.monotonic() \
+                        or not self.__pending and not self.__stopped:
+                    self.__lock.wait(self.__pending[0][0] - time.monotonic() if self.__pending else None)
+                if not self.__pending:
+                    return
+                _, _, sender, receiver, message, lane = heapq.heappop(self.__pending)
+                if not self.__reachable(sender, receiver):
+                    self.stats['partitioned'] += 1
+                    continue
+            try:
+                self.channel._call_as(sender, self.channel.send_to, {receiver}, message, lane)
+                self.stats['delivered'] += 1
+            except (AssertionError, lab_channel.InboxFull, redis.RedisError) as error:
+                self.stats['failed'] += 1
+                self.logger.warning("Delivery from %s to %s failed: %s", sender, receiver, error)
+
+    def close(self) -> None:
+        """
+        Deliver all messages in flight (when they are due), stop the scheduler and close the wrapped channel.
+        :return: None
+        """
+        with self.__lock:
+            self.__stopped = True
+            self.__lock.notify()
+        self.__scheduler.join()
+        self.channel.close()
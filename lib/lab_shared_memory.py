@@ -0,0 +1,118 @@
+"""
+Shared memory side channel for large payloads between members on the same host
+
+Channels place the serialized message in a shared memory segment and send just a handle with the
+segment name through redis (see lab_channel). Receivers map the segment and decode the message
+from it without copying the data to their heap first.
+
+Segments are not tracked by the resource tracker of multiprocessing, which would unlink them when the
+creating (or any mapping) process exits, while receivers may still need them. Their lifetime is managed
+by reference counts in redis instead. Segments that were never received can be removed by sweep().
+"""
+
+import os
+import socket
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+PREFIX = 'vs2lab-'
+"""Name prefix of segments created by channels"""
+
+DIRECTORY = '/dev/shm'
+"""Directory of POSIX shared memory segments (on Linux)"""
+
+AVAILABLE: bool = os.name == 'posix'
+"""Segments outlive their creating process only with POSIX shared memory"""
+
+
+def _host() -> str:
+    """
+    Identify this host (or container): members with the same identity can map each others segments.
+    The boot id tells apart hosts that happen to have the same name.
+    :return: host identity
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            boot_id = file.read().strip()
+    except OSError:
+        boot_id = ''
+    return '{}/{}'.format(socket.gethostname(), boot_id)
+
+
+HOST: str = _host()
+"""Identity of this host"""
+
+
+class Segment:
+    """
+    A mapped shared memory segment.
+    """
+
+    def __init__(self, name: str = None, size: int = 0, prefix: str = PREFIX):
+        """
+        Create a new segment or map an existing one.
+        :param name: segment name, None to create a new segment
+        :param size: size of a new segment in bytes
+        :param prefix: name prefix of a new segment (sweep() only removes segments with prefix PREFIX)
+        """
+        create = name is None
+        if create:
+            name = '{}{}-{}'.format(prefix, os.getpid(), os.urandom(6).hex())
+        self.name: str = name
+        self.__memory = shared_memory.SharedMemory(name, create=create, size=size)
+        # lifetime is managed by reference counts, not by the processes mapping the segment
+        resource_tracker.unregister(self.__memory._name, 'shared_memory')
+
+    @property
+    def buffer(self) -> memoryview:
+        """
+        Memory of the segment (may be larger than requested, segments are rounded up to pages on some systems).
+        """
+        return self.__memory.buf
+
+    def close(self) -> bool:
+        """
+        Unmap the segment, unless memoryviews of it are still in use.
+        :return: True if the segment has been unmapped
+        """
+        try:
+            self.__memory.close()
+            return True
+        except BufferError:
+            return False
+
+
+def unlink(name: str) -> None:
+    """
+    Remove a segment. Processes that have mapped it keep their mappings.
+    :param name: segment name
+    :return: None
+    """
+    try:
+        memory = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    # unlink() unregisters the segment from the resource tracker, which opening it has registered
+    memory.close()
+    memory.unlink()
+
+
+def sweep(max_age: float) -> list:
+    """
+    Remove segments of channels that are older than max_age (e.g. their handles were dropped unreceived).
+    :param max_age: age in seconds
+    :return: list of removed segment names
+    """
+    if not os.path.isdir(DIRECTORY):
+        return []
+    removed = []
+    deadline = time.time() - max_age
+    for name in os.listdir(DIRECTORY):
+        if name.startswith(PREFIX):
+            try:
+                if os.stat(os.path.join(DIRECTORY, name)).st_mtime < deadline:
+                    unlink(name)
+                    removed.append(name)
+            except FileNotFoundError:
+                pass
+    return removed
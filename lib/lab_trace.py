@@ -0,0 +1,235 @@
+"""
+Message tracing for channel based protocols
+
+Tracing channels stamp each envelope with a trace id, the Lamport timestamp of the send event
+and the wall-clock send time, and record send and receive events to a binary ring buffer per
+os process (a memory-mapped file vs2lab-trace-<os pid>.bin, so records survive crashes).
+
+A trace is a causal lineage of messages: a member that receives a message continues its trace
+with every message it sends afterwards, until it receives a message of another trace or starts
+a new one. Members that have not received anything yet start a new trace.
+
+Merge the buffers of all processes offline into latency, queueing delay and critical path reports:
+
+Usage: python -m lib.lab_trace [trace files or directories (default: .)]
+"""
+
+import glob
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+
+TAG = b't'
+"""Envelope tag of the trace stamp (reserved, see lab_codec)"""
+
+STAMP = struct.Struct('!QQd')
+"""Trace stamp in envelopes: trace id, Lamport timestamp, send time"""
+
+HEADER = struct.Struct('<4sIIQ')
+"""Ring buffer file header: magic, record size, capacity, number of records written so far"""
+
+RECORD = struct.Struct('<B7xQQQQddd')
+"""Event record: kind, member, peer, trace id, Lamport timestamp of the message, send time, start, end"""
+
+MAGIC = b'VS2T'
+SEND = 1
+RECEIVE = 2
+
+
+class Tracer:
+    """
+    Tracer keeps the Lamport clocks and trace contexts of the members of an os process and
+    writes their events to the ring buffer of the process. Once full, the oldest records are overwritten.
+    """
+
+    def __init__(self, directory: str = '.', capacity: int = 65536):
+        """
+        :param directory: directory of the ring buffer file
+        :param capacity: number of records kept
+        """
+        self.path: str = os.path.join(directory, 'vs2lab-trace-{}.bin'.format(os.getpid()))
+        self.capacity: int = capacity
+        # per member: Lamport clock and current trace id
+        self.__clocks: dict = {}
+        self.__traces: dict = {}
+        self.__count: int = 0
+        self.__lock = threading.Lock()
+        with open(self.path, 'w+b') as file:
+            file.truncate(HEADER.size + capacity * RECORD.size)
+            self.__buffer = mmap.mmap(file.fileno(), 0)
+        HEADER.pack_into(self.__buffer, 0, MAGIC, RECORD.size, capacity, 0)
+
+    def __record(self, *fields) -> None:
+        # the caller holds the lock
+        RECORD.pack_into(self.__buffer, HEADER.size + (self.__count % self.capacity) * RECORD.size, *fields)
+        self.__count += 1
+        struct.pack_into('<Q', self.__buffer, HEADER.size - 8, self.__count)
+
+    def new_trace(self, member: str) -> None:
+        """
+        Let the next message of a member start a new trace.
+        :param member: member identifier
+        :return: None
+        """
+        with self.__lock:
+            self.__traces.pop(member, None)
+
+    def stamp(self, sender: str) -> bytes:
+        """
+        Record a send event of a member.
+        :param sender: member identifier
+        :return: trace stamp for the envelope
+        """
+        now = time.time()
+        with self.__lock:
+            lamport = self.__clocks[sender] = self.__clocks.get(sender, 0) + 1
+            trace = self.__traces.get(sender)
+            if trace is None:
+                trace = self.__traces[sender] = random.getrandbits(64)
+            self.__record(SEND, int(sender), 0, trace, lamport, now, now, now)
+        return STAMP.pack(trace, lamport, now)
+
+    def received(self, receiver: str, envelopes: list, started: float) -> None:
+        """
+        Record receive events of a member for all stamped envelopes.
+        :param receiver: member identifier
+        :param envelopes: envelopes returned by a receive operation
+        :param started: wall-clock start time of the receive operation
+        :return: None
+        """
+        now = time.time()
+        with self.__lock:
+            for envelope in envelopes:
+                split = envelope.index(b'\x00')
+                if envelope[split + 1:split + 2] != TAG:
+                    continue
+                trace, lamport, sent = STAMP.unpack_from(envelope, split + 2)
+                self.__clocks[receiver] = max(self.__clocks.get(receiver, 0), lamport) + 1
+                self.__traces[receiver] = trace
+                self.__record(RECEIVE, int(receiver), int(envelope[:split]), trace, lamport, sent, started, now)
+
+    def close(self) -> None:
+        self.__buffer.flush()
+        self.__buffer.close()
+
+
+_TRACERS: dict = {}
+_TRACERS_LOCK = threading.Lock()
+
+
+def tracer(directory: str = '.') -> Tracer:
+    """
+    Get the tracer of this os process for a directory (a new one after fork).
+    :param directory: directory of the ring buffer file
+    :return: Tracer instance
+    """
+    with _TRACERS_LOCK:
+        key = (os.getpid(), os.path.abspath(directory))
+        if key not in _TRACERS:
+            _TRACERS[key] = Tracer(directory)
+        return _TRACERS[key]
+
+
+def load(paths: list) -> list:
+    """
+    Read the records of ring buffer files.
+    :param paths: file names or directories with trace files
+    :return: list of event tuples (kind, member, peer, trace, lamport, sent, started, done), ordered by end time
+    """
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, 'vs2lab-trace-*.bin'))) if os.path.isdir(path) else [path]
+    events = []
+    for name in files:
+        with open(name, 'rb') as file:
+            data = file.read()
+        magic, size, capacity, count = HEADER.unpack_from(data)
+        assert magic == MAGIC and size == RECORD.size, 'not a trace file: ' + name
+        events += [RECORD.unpack_from(data, HEADER.size + i * size) for i in range(min(count, capacity))]
+    return sorted(events, key=lambda event: event[7])
+
+
+def _quantiles(values: list) -> str:
+    values = sorted(values)
+    if len(values) == 0:
+        return '-'
+    return 'p50 {:8.3f}  p99 {:8.3f}  max {:8.3f} ms'.format(
+        1000 * values[len(values) // 2], 1000 * values[min(len(values) - 1, int(0.99 * len(values)))],
+        1000 * values[-1])
+
+
+def critical_path(events: list, trace: int) -> list:
+    """
+    Find the chain of messages that led to the last receive event of a trace.
+    Walking backwards, each receive event is preceded by the matching send event, which is preceded
+    by the last receive event of the sender before sending (if any).
+    :param events: event tuples (see load)
+    :param trace: trace id
+    :return: list of (send event, receive event) hops, in causal order
+    """
+    events = [event for event in events if event[3] == trace]
+    sends = {(event[1], event[4]): event for event in events if event[0] == SEND}
+    receives = [event for event in events if event[0] == RECEIVE]
+    if len(receives) == 0:
+        return []
+    hops = []
+    receive = max(receives, key=lambda event: event[7])
+    while receive is not None:
+        send = sends.get((receive[2], receive[4]))
+        if send is None:
+            break
+        hops.insert(0, (send, receive))
+        earlier = [event for event in receives if event[1] == send[1] and event[7] <= send[5]]
+        receive = max(earlier, key=lambda event: event[7]) if earlier else None
+    return hops
+
+
+def report(events: list, top: int = 3) -> str:
+    """
+    Summarize traced events: message latency (send to end of receive), queueing delay
+    (send to start of the receive operation, if the message was waiting), per member pair and
+    critical paths of the longest traces.
+    :param events: event tuples (see load)
+    :param top: number of traces and member pairs to detail
+    :return: report text
+    """
+    receives = [event for event in events if event[0] == RECEIVE]
+    sends = [event for event in events if event[0] == SEND]
+    lines = ['{} send events, {} receive events, {} traces'.format(
+        len(sends), len(receives), len({event[3] for event in events}))]
+    lines.append('latency  ' + _quantiles([event[7] - event[5] for event in receives]))
+    lines.append('queueing ' + _quantiles([max(0.0, event[6] - event[5]) for event in receives]))
+
+    pairs: dict = {}
+    for event in receives:
+        pairs.setdefault((event[2], event[1]), []).append(event[7] - event[5])
+    lines.append('')
+    lines.append('slowest member pairs (sender -> receiver, latency):')
+    for (sender, receiver), latencies in sorted(pairs.items(), key=lambda item: -max(item[1]))[:top]:
+        lines.append('  {:>6} -> {:<6} {:6d} msgs  {}'.format(sender, receiver, len(latencies), _quantiles(latencies)))
+
+    durations: dict = {}
+    for event in events:
+        first, last = durations.get(event[3], (event[5], event[7]))
+        durations[event[3]] = (min(first, event[5]), max(last, event[7]))
+    for trace, (first, last) in sorted(durations.items(), key=lambda item: item[1][0] - item[1][1])[:top]:
+        hops = critical_path(events, trace)
+        lines.append('')
+        lines.append('trace {:016x}: {:.3f} ms, critical path of {} messages:'.format(
+            trace, 1000 * (last - first), len(hops)))
+        previous = None
+        for send, receive in hops:
+            if previous is not None:
+                lines.append('    processing at {:>6}: {:8.3f} ms'.format(send[1], 1000 * (send[5] - previous[7])))
+            lines.append('  {:>6} -> {:<6} lamport {:6d}  latency {:8.3f} ms  queueing {:8.3f} ms'.format(
+                send[1], receive[1], send[4], 1000 * (receive[7] - send[5]), 1000 * max(0.0, receive[6] - send[5])))
+            previous = receive
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    print(report(load(sys.argv[1:] or ['.'])))
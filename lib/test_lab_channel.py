@@ -0,0 +1,714 @@
+"""
+Channel unit tests
+Run against the in-process local backend and fakeredis (with lupa for the server-side scripts),
+so no redis server is needed.
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import random
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+try:
+    import fakeredis
+    import fakeredis.aioredis
+except ImportError:  # dev dependency, see Pipfile
+    fakeredis = None
+
+import redis
+
+from lib import lab_channel, lab_local_store, lab_netem, lab_trace
+
+
+class TestLocalChannel(unittest.TestCase):
+    """Channel operations between members living in threads of this process"""
+
+    def setUp(self):
+        super().setUp()
+        lab_channel.Channel(backend='local').channel.flushall()
+        self.chan_a = lab_channel.Channel(backend='local')  # one channel instance per member
+        self.chan_b = lab_channel.Channel(backend='local')
+        self.a = self.chan_a.join('server')
+        self.b = self.chan_b.join('client')
+        self.chan_a.bind(self.a)
+        self.chan_b.bind(self.b)
+
+    def test_send_receive(self):
+        """Point-to-point message"""
+        self.chan_a.send_to({self.b}, ('REQ', 1))
+        self.assertEqual(self.chan_b.receive_from_any(1), (self.a, ('REQ', 1)))
+
+    def test_receive_from_keeps_fifo_per_sender(self):
+        """Messages of unwanted senders are kept back in order"""
+        chan_c = lab_channel.Channel(backend='local')
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        self.chan_a.send_to({self.b}, 'a1')
+        chan_c.send_to({self.b}, 'c1')
+        self.chan_a.send_to({self.b}, 'a2')
+        self.assertEqual(self.chan_b.receive_from({c}, 1), (c, 'c1'))
+        self.assertEqual(self.chan_b.receive_from({self.a}, 1), (self.a, 'a1'))
+        self.assertEqual(self.chan_b.receive_from_any(1), (self.a, 'a2'))
+
+    def test_send_many_and_broadcast(self):
+        """Bursts and broadcasts reach every destination"""
+        self.chan_a.send_many([({self.b}, 1), ({self.a, self.b}, 2)])
+        self.chan_a.send_to_all(3)
+        self.assertEqual([self.chan_b.receive_from_any(1)[1] for _ in range(3)], [1, 2, 3])
+        self.assertEqual([self.chan_a.receive_from_any(1)[1] for _ in range(2)], [2, 3])
+
+    def test_receive_many(self):
+        """Queued messages are drained in one call, other senders are kept back"""
+        chan_c = lab_channel.Channel(backend='local')
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        self.chan_a.send_many([({self.b}, 1), ({self.b}, 2)])
+        chan_c.send_to({self.b}, 'c1')
+        self.chan_a.send_to({self.b}, 3)
+        self.assertEqual(self.chan_b.receive_many({self.a}, 2, 1), [(self.a, 1), (self.a, 2)])
+        self.assertEqual(self.chan_b.receive_many(None, 10, 1), [(c, 'c1'), (self.a, 3)])
+        self.assertEqual(self.chan_b.receive_many(None, 10, 0.1), [])
+
+    def test_control_lane_first(self):
+        """Control messages overtake queued data messages, each lane stays FIFO"""
+        self.chan_a.send_many([({self.b}, 'd1'), ({self.b}, 'd2')])
+        self.chan_a.send_to({self.b}, 'c1', lane='control')
+        self.chan_a.send_to_all('c2', lane='control')
+        self.assertEqual(self.chan_b.inbox_depth(), 4)
+        self.assertEqual(self.chan_b.receive_from({self.a}, 1), (self.a, 'c1'))
+        self.assertEqual(self.chan_b.receive_many(None, 10, 1), [(self.a, 'c2'), (self.a, 'd1'), (self.a, 'd2')])
+
+    def test_mixed_codecs(self):
+        """Receivers decode with the codec of the sender, whatever codec their own channel uses"""
+        chan_c = lab_channel.Channel(backend='local', codec='compact')
+        chan_m = lab_channel.Channel(backend='local', codec='marshal')
+        chan_c.bind(self.a)
+        chan_m.bind(self.b)
+        chan_c.send_to({self.b}, ('REQ', {1, 2}, [None, 2 ** 40]))
+        self.assertEqual(chan_m.receive_from({self.a}, 1), (self.a, ('REQ', {1, 2}, [None, 2 ** 40])))
+        chan_m.send_to({self.a}, {'reply': (1.5, b'ok')})
+        self.assertEqual(self.chan_a.receive_from({self.b}, 1), (self.b, {'reply': (1.5, b'ok')}))
+
+    def test_compression(self):
+        """Large messages are compressed transparently, small ones are not"""
+        chan_z = lab_channel.Channel(backend='local', compression='lzma', threshold=100)
+        chan_z.bind(self.a)
+        directory = {'name {}'.format(i): '0721 {}'.format(i) for i in range(500)}
+        chan_z.send_many([({self.b}, directory), ({self.b}, 'small')])
+        self.assertEqual(self.chan_b.receive_many(None, 2, 1), [(self.a, directory), (self.a, 'small')])
+        self.assertEqual(chan_z.compression_stats['compressed'], 1)
+        self.assertGreater(chan_z.compression_stats['saved'], 0)
+
+    def test_stats(self):
+        """Operations, traffic and inbox depths are counted"""
+        self.chan_a.send_to({self.b}, 'one')
+        self.chan_a.send_to({self.b}, 'two')
+        self.assertEqual(self.chan_b.stats()['gauges']['inbox_depth'], {self.b: 2})
+        self.chan_b.receive_from_any(1)
+        stats = self.chan_b.stats()
+        self.assertEqual(stats['counters']['messages_in'], {self.b: 1})
+        self.assertEqual(stats['histograms']['op_seconds']['receive_from_any']['count'], 1)
+        self.assertEqual(stats['gauges']['inbox_depth'], {self.b: 1})
+        self.assertEqual(self.chan_a.stats()['counters']['messages_out'], {self.a: 2})
+
+    def test_bounded_inbox(self):
+        """Overflow policies apply to full inboxes"""
+        self.chan_b.limit_inbox(2)
+        self.chan_a.send_many([({self.b}, 1), ({self.b}, 2)])
+        with self.assertRaises(lab_channel.InboxFull):
+            self.chan_a.send_to({self.b}, 3)
+        chan_drop = lab_channel.Channel(backend='local', overflow='drop_oldest')
+        chan_drop.bind(self.a)
+        chan_drop.send_to({self.b}, 3)
+        self.assertEqual(self.chan_a.inbox_depth(self.b), 2)
+        self.assertEqual(self.chan_b.receive_many(None, 10, 1), [(self.a, 2), (self.a, 3)])
+
+    def test_reap_expired_lease(self):
+        """Members whose lease has expired are removed with their queues"""
+        chan_c = lab_channel.Channel(backend='local', lease=10)
+        c = chan_c.join('client')
+        self.chan_a.send_to({c}, 'lost')
+        chan_c.channel.delete('lease:' + c)  # as if the member had not renewed its lease in time
+        self.assertEqual(self.chan_a.reap(), [c])
+        self.assertFalse(self.chan_a.exists(c))
+        self.assertEqual(self.chan_a.subgroup('client'), {self.b})
+        self.assertEqual(self.chan_a.inbox_depth(c), 0)
+        chan_c.close()
+
+    def test_tracing(self):
+        """Traced request and reply form a critical path of two messages"""
+        with tempfile.TemporaryDirectory() as directory:
+            chan_x = lab_channel.Channel(backend='local', trace=directory)
+            chan_y = lab_channel.Channel(backend='local', trace=directory)
+            chan_x.bind(self.a)
+            chan_y.bind(self.b)
+            chan_x.send_to({self.b}, 'request')
+            self.assertEqual(chan_y.receive_from_any(1), (self.a, 'request'))
+            chan_y.send_to({self.a}, 'reply')
+            self.assertEqual(self.chan_a.receive_from_any(1), (self.b, 'reply'))  # untraced receivers work, too
+            events = lab_trace.load([directory])
+            chan_x.tracer.close()
+        hops = lab_trace.critical_path(events, events[0][3])
+        self.assertEqual([(send[1], receive[1]) for send, receive in hops], [(int(self.a), int(self.b))])
+        self.assertEqual([event[0] for event in events], [lab_trace.SEND, lab_trace.RECEIVE, lab_trace.SEND])
+        self.assertEqual(events[2][4], 3)  # Lamport timestamp of the reply
+
+    def test_tracing_64_bit_ids(self):
+        """Member ids of the full 64 bit id space are recorded"""
+        with tempfile.TemporaryDirectory() as directory:
+            chan_x = lab_channel.Channel(backend='local', n_bits=64, trace=directory)
+            x = chan_x.join('server')
+            y = chan_x.join('client')
+            chan_x.member(x).send_to({y}, 'request')
+            self.assertEqual(chan_x.member(y).receive_from_any(1), (x, 'request'))
+            events = lab_trace.load([directory])
+            chan_x.tracer.close()
+        self.assertEqual([(event[0], event[1], event[2]) for event in events],
+                         [(lab_trace.SEND, int(x), 0), (lab_trace.RECEIVE, int(y), int(x))])
+
+    def test_shared_broadcast_payload(self):
+        """Large broadcasts store their payload once, the last receiver deletes it"""
+        chan_s = lab_channel.Channel(backend='local', share_threshold=100)
+        chan_s.bind(self.a)
+        payload = bytes(1000)
+        chan_s.send_to_all(payload)
+        self.assertEqual(len(chan_s.channel.keys('payload:*')), 1)
+        self.assertLess(len(chan_s.channel.lrange('inbox:' + self.b, 0, -1)[0]), 100)
+        self.assertEqual(self.chan_b.receive_from_any(1), (self.a, payload))
+        self.assertEqual(len(chan_s.channel.keys('payload:*')), 1)
+        self.assertEqual(self.chan_a.receive_from_any(1), (self.a, payload))
+        self.assertEqual(chan_s.channel.keys('payload:*'), [])
+
+    def test_broadcast_to_single_member_inline(self):
+        """Large broadcasts to a single member are sent inline, without a shared payload"""
+        chan = lab_channel.Channel(backend='local', share_threshold=100, namespace='single')
+        chan.bind(chan.join('server'))
+        chan.send_to_all(bytes(1000))
+        self.assertEqual(chan.channel.keys('single:payload:*'), [])
+        self.assertEqual(chan.receive_from_any(1)[1], bytes(1000))
+
+    def test_shared_memory_payload(self):
+        """Large messages to members on this host travel in a shared memory segment, views are not copied"""
+        chan_m = lab_channel.Channel(backend='local', codec='pickle5', shm_threshold=1000)
+        chan_m.bind(self.a)
+        chan_m.send_to({self.b}, ('BLOB', memoryview(bytes(range(256)) * 16)))
+        self.assertLess(len(chan_m.channel.lrange('inbox:' + self.b, 0, -1)[0]), 100)
+        sender, (kind, blob) = self.chan_b.receive_from_any(1)
+        self.assertEqual((sender, kind, blob.tobytes()), (self.a, 'BLOB', bytes(range(256)) * 16))
+        self.assertEqual(chan_m.channel.keys('segment:*'), [])  # unlinked, but still mapped
+        self.assertEqual(self.chan_b.release((kind, blob)), 0)
+        chan_m.send_to({self.b}, 'x' * 2000)
+        self.assertEqual(self.chan_b.receive_from_any(1), (self.a, 'x' * 2000))
+
+    def test_members_per_thread_and_handle(self):
+        """One channel serves members bound to threads and member handles"""
+        chan = lab_channel.Channel(backend='local')
+        nodes = [chan.member(chan.join('node')) for _ in range(3)]
+
+        def echo(pid):
+            chan.bind(pid)
+            sender, message = chan.receive_from_any(5)
+            chan.send_to({sender}, (message, pid))
+
+        threads = [threading.Thread(target=echo, args=(node.pid,)) for node in nodes[1:]]
+        for thread in threads:
+            thread.start()
+        nodes[0].send_to({node.pid for node in nodes[1:]}, 'ping')
+        replies = [nodes[0].receive_from_any(5) for _ in nodes[1:]]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(replies), sorted((node.pid, ('ping', node.pid)) for node in nodes[1:]))
+        chan.bind(nodes[0].pid)
+        bindings = lab_channel._BINDINGS.get()
+        nodes[1].send_to({nodes[0].pid}, 'direct')
+        self.assertIs(lab_channel._BINDINGS.get(), bindings)  # handles leave bindings alone
+        self.assertEqual(chan.receive_from_any(1), (nodes[1].pid, 'direct'))
+        nodes[2].leave('node')
+        self.assertEqual(chan.subgroup('node'), {nodes[0].pid, nodes[1].pid})
+        self.assertEqual(chan.caller(), nodes[0].pid)
+        chan.leave('node')
+        self.assertNotIn(chan._context_key, lab_channel._BINDINGS.get())  # removed, not set to None
+
+    def test_prefetch(self):
+        """Prefetched messages are filtered locally, in FIFO order per sender, and returned on close"""
+        chan_c = lab_channel.Channel(backend='local')
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        chan_p = lab_channel.Channel(backend='local', prefetch=4)
+        chan_p.bind(self.b)
+        self.chan_a.send_many([({self.b}, 'a1'), ({self.b}, 'a2')])
+        chan_c.send_to({self.b}, 'c1')
+        self.assertEqual(chan_p.receive_from({c}, 1), (c, 'c1'))
+        self.assertEqual(chan_p.receive_from({self.a}, 1), (self.a, 'a1'))
+        self.chan_a.send_to({self.b}, 'a3')
+        self.chan_a.send_to({self.b}, 'urgent', lane='control')
+        time.sleep(0.1)
+        self.assertEqual(chan_p.receive_from_any(1), (self.a, 'urgent'))
+        chan_p.close()
+        self.assertEqual(self.chan_b.receive_many(None, 10, 1), [(self.a, 'a2'), (self.a, 'a3')])
+
+    def test_shards(self):
+        """Queues are spread over shards, membership stays on the primary, blocking receives work"""
+        shards = [lab_local_store.LocalClient(lab_local_store.LocalStore()) for _ in range(3)]
+        chans = [lab_channel.Channel(shards=shards) for _ in range(8)]
+        pids = [chan.join('node') for chan in chans]
+        for chan, pid in zip(chans, pids):
+            chan.bind(pid)
+        sender = threading.Timer(0.1, chans[0].send_to_all, ('hello',))
+        sender.start()
+        self.assertEqual([chan.receive_from({pids[0]}, 5) for chan in chans], [(pids[0], 'hello')] * 8)
+        sender.join()
+        chans[1].send_many([({pids[2]}, 1), (set(pids[3:]), 2)])
+        self.assertEqual(chans[2].receive_many(None, 10, 1), [(pids[1], 1)])
+        self.assertEqual(chans[0].inbox_depth(pids[7]), 1)
+        # inboxes of 20 members are spread over more than one shard (5 members land on one shard too often)
+        chans[0].send_to(set(pids[3:] + [chans[0].join('node') for _ in range(15)]), 'spread')
+        self.assertGreater(sum(1 for shard in shards if shard.keys('inbox:*')), 1)
+        self.assertEqual([len(shard.keys('members')) for shard in shards], [1, 0, 0])
+
+    def test_namespaces(self):
+        """Channels of different namespaces share a store in isolation, clear() deletes a single namespace"""
+        chan_x = lab_channel.Channel(backend='local', namespace='x')
+        chan_y = lab_channel.Channel(backend='local', namespace='y')
+        x = chan_x.join('client')
+        y = chan_y.join('client')
+        chan_x.bind(x)
+        chan_y.bind(y)
+        chan_x.send_to_all('x only')
+        self.assertEqual(chan_x.subgroup('client'), {x})
+        self.assertIsNone(self.chan_b.receive_from_any(0.1))
+        self.assertTrue(chan_x.channel.keys('x:inbox:*'))
+        self.assertGreater(chan_x.clear(batch_size=2), 0)
+        self.assertEqual(chan_x.channel.keys('x:*'), [])
+        self.assertEqual(chan_y.subgroup('client'), {y})
+        self.assertEqual(self.chan_a.subgroup('client'), {self.b})
+
+    def test_network_emulation(self):
+        """Messages are delayed per link in FIFO order, lost links and partitions drop them"""
+        chan_e = lab_netem.EmulatedChannel(lab_channel.Channel(backend='local'),
+                                           lab_netem.Conditions(delay=0.1, jitter=0.05), seed=1)
+        a = chan_e.member(self.a)
+        a.send_many([({self.b}, i) for i in range(5)])
+        self.assertIsNone(self.chan_b.receive_from_any(0.01))
+        self.assertEqual([self.chan_b.receive_from_any(1)[1] for _ in range(5)], [0, 1, 2, 3, 4])
+        chan_e.link(self.a, self.b, lab_netem.Conditions(loss=1.0))
+        a.send_to({self.b}, 'lost')
+        chan_e.link(self.a, self.b)
+        chan_e.partition({self.a}, {self.b})
+        a.send_to_all('partitioned')
+        self.assertEqual(self.chan_a.receive_from_any(1), (self.a, 'partitioned'))
+        chan_e.close()
+        self.assertIsNone(self.chan_b.receive_from_any(0.1))
+        self.assertEqual((chan_e.stats['lost'], chan_e.stats['partitioned'], chan_e.stats['delivered']), (1, 1, 6))
+
+    def test_prefetch_full_of_other_senders(self):
+        """A full prefetch buffer of unwanted senders does not hide later messages of wanted ones"""
+        chan_c = lab_channel.Channel(backend='local')
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        chan_p = lab_channel.Channel(backend='local', prefetch=2)
+        chan_p.bind(self.b)
+        self.chan_a.send_many([({self.b}, 'a{}'.format(i)) for i in range(3)])
+        chan_c.send_to({self.b}, 'c0')
+        self.assertEqual(chan_p.receive_from({c}, 2), (c, 'c0'))
+        chan_c.send_to({self.b}, 'c1')
+        self.assertEqual(chan_p.receive_from({c}, 0), (c, 'c1'))
+        self.assertEqual(chan_p.receive_many({self.a}, 10, 1), [(self.a, 'a0'), (self.a, 'a1'), (self.a, 'a2')])
+        chan_p.close()
+
+    def test_prefetch_after_stash(self):
+        """Envelopes stashed before prefetching starts stay ahead of newer ones of the same sender"""
+        chan_c = lab_channel.Channel(backend='local')
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        self.chan_a.send_to({self.b}, 'a1')
+        chan_c.send_to({self.b}, 'c1')
+        self.assertEqual(self.chan_b.receive_from({c}, 1), (c, 'c1'))  # stashes a1
+        self.chan_a.send_to({self.b}, 'a2')
+        chan_p = lab_channel.Channel(backend='local', prefetch=4)
+        chan_p.bind(self.b)
+        self.assertEqual(chan_p.receive_many({self.a}, 2, 1), [(self.a, 'a1'), (self.a, 'a2')])
+        chan_p.close()
+
+    def test_unknown_receiver(self):
+        """Nothing is delivered if a destination is unknown"""
+        with self.assertRaises(AssertionError):
+            self.chan_a.send_to({self.b, 'unknown'}, 'lost')
+        self.assertIsNone(self.chan_b.receive_from_any(0.1))
+
+    def test_strict_send_validates_atomically(self):
+        """A receiver leaving between validation and push makes the send fail without delivering anything"""
+        smismember = lab_local_store.LocalStore.smismember
+
+        def leaving(store, key, values):
+            known = smismember(store, key, values)
+            store.srem(key, self.b)
+            return known
+
+        with unittest.mock.patch.object(lab_local_store.LocalStore, 'smismember', leaving):
+            with self.assertRaises(AssertionError):
+                self.chan_a.send_to({self.b}, 'lost')
+        self.assertEqual(self.chan_a.inbox_depth(self.b), 0)
+
+    def test_blocking_receive(self):
+        """A blocked receiver is woken up by a sender thread"""
+        sender = threading.Timer(0.1, self.chan_a.send_to, ({self.b}, 'late'))
+        sender.start()
+        self.assertEqual(self.chan_b.receive_from({self.a}, 5), (self.a, 'late'))
+        sender.join()
+
+    def test_subgroup_and_leave(self):
+        """Members can be looked up by subgroup until they leave"""
+        self.assertEqual(self.chan_a.subgroup('client'), {self.b})
+        self.chan_b.leave('client')
+        self.assertEqual(self.chan_a.subgroup('client'), set())
+        self.assertFalse(self.chan_a.exists(self.b))
+
+    def test_member_ids_full_space(self):
+        """All ids of a small id space are handed out once, then joining fails"""
+        chan = lab_channel.Channel(n_bits=2, backend='local', namespace='ids')
+        self.assertEqual({chan.join('node') for _ in range(4)}, {'0', '1', '2', '3'})
+        with self.assertRaises(AssertionError):
+            chan.join('node')
+
+    def test_member_ids_64_bits(self):
+        """Free ids of a 64 bit id space are found without enumerating it"""
+        chan = lab_channel.Channel(n_bits=64, backend='local', namespace='ids')
+        chan.PROBES = 0  # pick free ids from the member set right away
+        pids = {chan.join('node') for _ in range(100)}
+        self.assertEqual(len(pids), 100)
+        self.assertTrue(all(0 <= int(pid) < 2 ** 64 for pid in pids))
+
+    def test_member_ids_collision(self):
+        """Probing retries ids that are taken, and free ids are picked among the remaining ones"""
+        chan = lab_channel.Channel(n_bits=3, backend='local', namespace='ids')
+        taken = int(chan.join('node'))
+        free = (taken + 1) % 8
+        with unittest.mock.patch.object(lab_channel.random, 'randrange', side_effect=[taken, taken, free]):
+            self.assertEqual(chan.join('node'), str(free))
+        with unittest.mock.patch.object(lab_channel.random, 'randrange', side_effect=[free] * chan.PROBES + [0]):
+            # first free id after the probes: the smallest id other than the two members
+            self.assertEqual(chan.join('node'), str(min({0, 1, 2} - {taken, free})))
+
+
+def _echo(store: lab_local_store.SharedStore, pid: str) -> None:
+    """Echo member of TestSharedChannel, in a process of its own: send messages back until receiving None"""
+    chan = lab_channel.Channel(backend=store)
+    chan.bind(pid)
+    while True:
+        sender, message = chan.receive_from_any(10)
+        if message is None:
+            break
+        chan.send_to({sender}, message)
+    chan.leave('echo')
+
+
+class TestSharedChannel(unittest.TestCase):
+    """Channel operations between members in several processes, on a SharedStore"""
+
+    def setUp(self):
+        super().setUp()
+        self.context = multiprocessing.get_context('spawn')
+        self.store = lab_local_store.SharedStore(self.context)
+        self.addCleanup(self.store.close)
+
+    def test_processes(self):
+        """A member in another process is woken up by sends, replies with messages larger than a ring"""
+        chan = lab_channel.Channel(backend=self.store, share_threshold=None)
+        a = chan.join('server')
+        echo = chan.join('echo')
+        chan.bind(a)
+        process = self.context.Process(target=_echo, args=(self.store, echo))
+        process.start()
+        for message in ['ping', b'x' * 3 * lab_local_store.SharedStore.RING_SIZE, ('REQ', 2)]:
+            chan.send_to({echo}, message)
+            self.assertEqual(chan.receive_from({echo}, 10), (echo, message))
+        chan.send_to({echo}, None)
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(chan.subgroup('echo'), set())  # left in the other process
+        self.assertEqual(chan.subgroup('server'), {a})
+
+    def test_lists_like_local_store(self):
+        """List commands on rings (wrapping around, growing) give the results of a LocalStore"""
+        local, rnd = lab_local_store.LocalStore(), random.Random(0)
+        for _ in range(3000):
+            key, values = rnd.choice(['a', 'b']), [bytes([rnd.randrange(3)]) * rnd.randrange(300) for _ in range(2)]
+            command, *args = rnd.choice([('rpush', key, *values), ('lpush', key, *values), ('lpop', key),
+                                         ('lpop', key, 3), ('lrem', key, rnd.randrange(-2, 3), values[0]),
+                                         ('ltrim', key, 1, -1), ('llen', key), ('delete', key)])
+            self.assertEqual(getattr(self.store, command)(*args), getattr(local, command)(*args))
+            self.assertEqual(self.store.lrange(key, 0, -1), local.lrange(key, 0, -1))
+        self.assertEqual(sorted(self.store.keys()), sorted(local.keys()))
+
+    def test_versions_and_types(self):
+        """Writes and deleting a list change its version (for WATCH), keys hold one kind of value"""
+        versions = [self.store.versions(['l'])]
+        for command in [lambda: self.store.rpush('l', 1), lambda: self.store.lpop('l'),
+                        lambda: self.store.rpush('l', 1), lambda: self.store.delete('l')]:
+            command()
+            versions.append(self.store.versions(['l']))
+            self.assertGreater(versions[-1], versions[-2])
+        self.store.sadd('s', 1)
+        self.assertRaises(redis.ResponseError, self.store.rpush, 's', 1)
+        self.assertEqual(self.store.exists('l', 's'), 1)
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestRedisChannel(unittest.TestCase):
+    """Channel operations on a (fake) redis server: server-side scripts and the membership cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = fakeredis.FakeServer()
+        self.chan_a = self.channel()
+        self.chan_b = self.channel()
+        self.a = self.chan_a.join('server')
+        self.b = self.chan_b.join('client')
+        self.chan_a.bind(self.a)
+        self.chan_b.bind(self.b)
+
+    def tearDown(self):
+        self.chan_a.close()
+        self.chan_b.close()
+        super().tearDown()
+
+    def channel(self, **options) -> lab_channel.Channel:
+        return lab_channel.Channel(backend=fakeredis.FakeStrictRedis(server=self.server), **options)
+
+    def assertScriptsUsed(self, *names):
+        loaded = self.chan_a.channel.script_exists(*[hashlib.sha1(lab_channel.Channel.SCRIPTS[name].encode())
+                                                     .hexdigest() for name in names])
+        self.assertEqual(dict(zip(names, loaded)), {name: True for name in names})
+
+    def test_scripts_send_receive(self):
+        """Multicast, broadcast and selective receive scripts keep FIFO order per sender"""
+        chan_c = self.channel()
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        self.chan_a.send_many([({self.b}, 'a1'), ({self.b, c}, 'a2')])
+        chan_c.send_to({self.b}, 'c1')
+        self.chan_a.send_to_all('all')
+        self.assertEqual(self.chan_b.receive_from({c}, 1), (c, 'c1'))
+        self.assertEqual(self.chan_b.receive_many(None, 10, 1), [(self.a, 'a1'), (self.a, 'a2'), (self.a, 'all')])
+        self.assertEqual(chan_c.receive_many(None, 10, 1), [(self.a, 'a2'), (self.a, 'all')])
+        with self.assertRaises(AssertionError):
+            self.chan_a.send_to({self.b, '999'}, 'lost')
+        self.assertIsNone(self.chan_b.receive_from_any(0.1))
+        self.assertScriptsUsed('multicast', 'broadcast', 'receive')
+        chan_c.close()
+
+    def test_scripts_bounded_inbox(self):
+        """The multicast script applies inbox limits"""
+        self.chan_b.limit_inbox(1)
+        self.chan_a.send_to({self.b}, 1)
+        with self.assertRaises(lab_channel.InboxFull):
+            self.chan_a.send_to({self.b}, 2)
+        self.assertEqual(self.chan_b.receive_many(None, 10, 1), [(self.a, 1)])
+
+    def test_scripts_shared_payload(self):
+        """The resolve script fetches shared payloads and deletes them after the last receiver"""
+        chan_s = self.channel(share_threshold=100)
+        chan_s.bind(self.a)
+        chan_s.send_to_all(bytes(1000))
+        self.assertEqual(self.chan_b.receive_from_any(1), (self.a, bytes(1000)))
+        self.assertEqual(self.chan_a.receive_from_any(1), (self.a, bytes(1000)))
+        self.assertEqual(chan_s.channel.keys('payload:*'), [])
+        self.assertScriptsUsed('resolve')
+        chan_s.close()
+
+    def test_scripts_leave_and_reap(self):
+        """The leave and reap scripts remove members with their queues"""
+        chan_c = self.channel(lease=10)
+        c = chan_c.join('client')
+        self.chan_a.send_to({c}, 'lost')
+        chan_c.channel.delete('lease:' + c)
+        self.assertEqual(self.chan_a.reap(), [c])
+        self.assertEqual(self.chan_a.channel.keys('inbox:' + c), [])
+        self.assertFalse(self.chan_a.exists(c))
+        self.chan_b.leave('client')
+        self.assertEqual(self.chan_a.subgroup('client'), set())
+        with self.assertRaises(AssertionError):
+            self.chan_b.member(self.b).leave('client')
+        self.assertScriptsUsed('reap', 'leave')
+        chan_c.close()
+
+    def wait_for(self, condition, timeout: float = 5) -> bool:
+        """Poll a condition until it holds or the timeout has passed"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_membership_cache(self):
+        """Cached member and subgroup sets are refreshed by the membership events of peers"""
+        self.assertEqual(self.chan_a.members(), {self.a, self.b})
+        # changes without an event are not seen while the cache is valid
+        self.chan_a.channel.sadd(self.chan_a._members, '999')
+        self.assertEqual(self.chan_a.members(), {self.a, self.b})
+        chan_c = self.channel()
+        c = chan_c.join('client')
+        self.assertTrue(self.wait_for(lambda: self.chan_a.members() == {self.a, self.b, c, '999'}))
+        self.assertEqual(self.chan_a.subgroup('client'), {self.b, c})
+        chan_c.bind(c)
+        chan_c.leave('client')
+        self.assertTrue(self.wait_for(lambda: self.chan_a.subgroup('client') == {self.b}))
+        self.assertFalse(self.chan_a.exists(c))
+        chan_c.close()
+
+    def stream_channels(self, **options) -> tuple:
+        """Create sender and receiver channels with stream inboxes, bound to a and b"""
+        sender, receiver = self.channel(inbox='stream', **options), self.channel(inbox='stream', **options)
+        sender.bind(self.a)
+        receiver.bind(self.b)
+        self.addCleanup(sender.close)
+        self.addCleanup(receiver.close)
+        return sender, receiver
+
+    def test_stream_receive_batch(self):
+        """receive_batch takes up to max_n entries, selective receives leave other senders' entries pending"""
+        sender, receiver = self.stream_channels()
+        chan_c = self.channel(inbox='stream')
+        c = chan_c.join('client')
+        chan_c.bind(c)
+        sender.send_many([({self.b}, i) for i in range(3)])
+        chan_c.send_to({self.b}, 'c')
+        self.assertEqual(receiver.receive_from({c}, 1), (c, 'c'))
+        self.assertEqual(receiver.receive_batch(None, 2, 1), [(self.a, 0), (self.a, 1)])
+        self.assertEqual(receiver.receive_batch(None, 10, 1), [(self.a, 2)])
+        self.assertEqual(receiver.receive_batch(None, 10, 0.1), [])
+        chan_c.close()
+
+    def test_stream_redelivery(self):
+        """Entries received but not acknowledged are delivered again after a restart"""
+        sender, receiver = self.stream_channels()
+        sender.send_many([({self.b}, 1), ({self.b}, 2)])
+        self.assertEqual(receiver.receive_from_any(1), (self.a, 1))
+        restarted = self.channel(inbox='stream')
+        restarted.bind(self.b)
+        self.assertEqual(restarted.receive_batch(None, 10, 1), [(self.a, 1)])
+        self.assertEqual(restarted.receive_batch(None, 10, 1), [(self.a, 2)])
+        restarted.ack()
+        again = self.channel(inbox='stream')
+        again.bind(self.b)
+        self.assertEqual(again.receive_batch(None, 10, 0.1), [])
+        restarted.close()
+        again.close()
+
+    def test_stream_inbox_depth(self):
+        """Stream inbox depths and limits count undelivered entries only, with and without scripts"""
+        for scripts in (True, False):
+            with self.subTest(scripts=scripts):
+                sender, receiver = self.stream_channels(scripts=scripts)
+                receiver.limit_inbox(1)
+                sender.send_to({self.b}, 1)
+                self.assertEqual(sender.inbox_depth(self.b), 1)
+                with self.assertRaises(lab_channel.InboxFull):
+                    sender.send_to({self.b}, 2)
+                self.assertEqual(receiver.receive_from_any(1), (self.a, 1))
+                self.assertEqual(sender.inbox_depth(self.b), 0)
+                sender.send_to({self.b}, 2)
+                self.assertEqual(receiver.receive_from_any(1), (self.a, 2))
+                receiver.ack()
+
+    def test_stream_drop_oldest(self):
+        """drop_oldest drops the oldest undelivered entries and keeps delivered ones for redelivery"""
+        for scripts in (True, False):
+            with self.subTest(scripts=scripts):
+                sender, receiver = self.stream_channels(scripts=scripts, overflow='drop_oldest')
+                receiver.limit_inbox(2)
+                sender.send_to({self.b}, 0)
+                self.assertEqual(receiver.receive_from_any(1), (self.a, 0))
+                for i in range(1, 5):
+                    sender.send_to({self.b}, i)
+                self.assertEqual(sender.inbox_depth(self.b), 2)
+                restarted = self.channel(inbox='stream')
+                restarted.bind(self.b)
+                self.assertEqual(restarted.receive_batch(None, 10, 1), [(self.a, 0)])
+                self.assertEqual(restarted.receive_batch(None, 10, 1), [(self.a, 3), (self.a, 4)])
+                restarted.ack()
+                restarted.close()
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestAsyncChannel(unittest.TestCase):
+    """AsyncChannel operations on a (fake) redis server, together with a sync Channel"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = fakeredis.FakeServer()
+        self.chan = lab_channel.Channel(backend=fakeredis.FakeStrictRedis(server=self.server))
+
+    def tearDown(self):
+        self.chan.close()
+        super().tearDown()
+
+    def run_async(self, test) -> None:
+        async def main():
+            achan = lab_channel.AsyncChannel(backend=fakeredis.aioredis.FakeRedis(server=self.server))
+            try:
+                await test(achan)
+            finally:
+                await achan.close()
+        asyncio.run(main())
+
+    def test_join_and_leave(self):
+        """Members joined by an async channel are known to sync channels until they leave"""
+        async def test(achan):
+            pid = await achan.join('server')
+            self.assertTrue(await achan.exists(pid))
+            self.assertEqual(self.chan.subgroup('server'), {pid})
+            achan.bind(pid)
+            await achan.leave('server')
+            self.assertFalse(self.chan.exists(pid))
+            self.assertEqual(await achan.subgroup('server'), set())
+        self.run_async(test)
+
+    def test_send_receive(self):
+        """Tasks bound to different members exchange messages, receive_from keeps other senders' messages"""
+        async def test(achan):
+            a, b, c = [await achan.join('node') for _ in range(3)]
+
+            async def send(pid, message):
+                achan.bind(pid)
+                await achan.send_to({b}, message)
+
+            await asyncio.create_task(send(a, 'from a'))
+            await asyncio.create_task(send(c, 'from c'))
+            achan.bind(b)
+            self.assertEqual(await achan.receive_from({c}, 1), (c, 'from c'))
+            self.assertEqual(await achan.receive_from_any(1), (a, 'from a'))
+            self.assertIsNone(await achan.receive_from_any(0.1))
+
+            # a blocked receive is woken up by a send of another task
+            receiver = asyncio.create_task(achan.receive_from({a}, 5))
+            await asyncio.sleep(0.05)
+            await send(a, 'later')
+            self.assertEqual(await receiver, (a, 'later'))
+        self.run_async(test)
+
+    def test_sync_interop(self):
+        """Async and sync members communicate with each other"""
+        async def test(achan):
+            a = await achan.join('async')
+            b = self.chan.join('sync')
+            self.chan.bind(b)
+            achan.bind(a)
+            await achan.send_to({b}, 'ping')
+            self.assertEqual(self.chan.receive_from({a}, 1), (a, 'ping'))
+            self.chan.send_to({a}, 'pong')
+            self.chan.send_to_all('all')
+            self.assertEqual(await achan.receive_from({b}, 1), (b, 'pong'))
+            self.assertEqual(await achan.receive_from_any(1), (b, 'all'))
+            self.assertEqual(self.chan.receive_from_any(1), (b, 'all'))
+        self.run_async(test)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+Codec unit tests
+Round trips of the built-in codecs, the wire formats of the compact and pickle5 codecs and codec registration.
+"""
+
+import array
+import struct
+import unittest
+
+from lib import lab_codec
+
+
+class TestCompactCodec(unittest.TestCase):
+    """msgpack encoding, with tuples and sets as extension types"""
+
+    def setUp(self):
+        super().setUp()
+        self.codec = lab_codec.CODECS['compact']
+
+    def assertRoundTrip(self, message) -> None:
+        decoded = self.codec.decode(self.codec.encode(message))
+        self.assertEqual(decoded, message)
+        self.assertIs(type(decoded), type(message))
+
+    def test_encoding(self):
+        """Messages are encoded as the msgpack spec says"""
+        self.assertEqual(self.codec.encode({'a': [1, -1, None, True, False]}),
+                         b'\x81\xa1a\x95\x01\xff\xc0\xc3\xc2')
+        self.assertEqual(self.codec.encode(1.5), b'\xcb' + struct.pack('!d', 1.5))
+        self.assertEqual(self.codec.encode(b'\x00\x01'), b'\xc4\x02\x00\x01')
+        self.assertEqual(self.codec.encode('x' * 32), b'\xd9\x20' + b'x' * 32)
+        self.assertEqual(self.codec.encode(list(range(16)))[:3], b'\xdc\x00\x10')
+
+    def test_decoding(self):
+        """msgpack written by hand (or another implementation) is decoded"""
+        self.assertEqual(self.codec.decode(b'\x82\xa3key\x93\x00\x7f\xe0\xa1b\xc4\x01z'),
+                         {'key': [0, 127, -32], 'b': b'z'})
+        self.assertEqual(self.codec.decode(b'\xdd\x00\x00\x00\x01\xc0'), [None])
+        self.assertRaises(ValueError, self.codec.decode, b'\xcc\x01')  # uint8, not produced by the codec
+
+    def test_extension_types(self):
+        """Tuples and sets are extension types 1 and 2 wrapping an array, frozensets decode as sets"""
+        self.assertEqual(self.codec.encode((1, 2)), b'\xc9\x00\x00\x00\x03\x01\x92\x01\x02')
+        self.assertEqual(self.codec.encode({3}), b'\xc9\x00\x00\x00\x02\x02\x91\x03')
+        self.assertRoundTrip(('REQ', (1, {2, 3}), [()]))
+        self.assertRoundTrip({'members': {'a', 'b'}})
+        self.assertEqual(self.codec.decode(self.codec.encode(frozenset({1}))), {1})
+
+    def test_int_range(self):
+        """Ints at the edges of the encodings, out of range ints fail"""
+        for value in [0, 0x7f, 0x80, -1, -0x20, -0x21, 2 ** 63 - 1, 2 ** 64 - 1, -2 ** 63]:
+            with self.subTest(value=value):
+                self.assertRoundTrip(value)
+        self.assertEqual(self.codec.encode(0x80), b'\xcf' + struct.pack('!Q', 0x80))
+        self.assertEqual(self.codec.encode(-0x21), b'\xd3' + struct.pack('!q', -0x21))
+        self.assertRaises(TypeError, self.codec.encode, 2 ** 64)
+        self.assertRaises(TypeError, self.codec.encode, -2 ** 63 - 1)
+
+    def test_lengths(self):
+        """Strings, bytes, lists and dicts at the edges of the length encodings"""
+        for n in [0, 15, 16, 31, 32, 255, 256, 65535, 65536]:
+            with self.subTest(n=n):
+                self.assertRoundTrip('ä' * (n // 2) + 'x' * (n % 2))
+                self.assertRoundTrip(b'x' * n)
+                self.assertRoundTrip(list(range(n)))
+                self.assertRoundTrip({str(i): i for i in range(n)})
+
+    def test_unsupported(self):
+        """Other objects are rejected"""
+        self.assertRaises(TypeError, self.codec.encode, object())
+        self.assertRaises(TypeError, self.codec.encode, [1, 2j])
+
+
+class TestPickle5Codec(unittest.TestCase):
+    """Pickle protocol 5 with large buffers as out-of-band frames"""
+
+    def setUp(self):
+        super().setUp()
+        self.codec = lab_codec.Pickle5Codec(threshold=1024)
+
+    def frames(self, data: bytes) -> tuple:
+        """Split encoded data into the buffer lengths, the pickle and the buffers"""
+        (count,) = struct.unpack_from('!I', data)
+        lengths = struct.unpack_from('!{}Q'.format(count), data, 4)
+        end = len(data) - sum(lengths)
+        buffers, pos = [], end
+        for length in lengths:
+            buffers.append(data[pos:pos + length])
+            pos += length
+        return lengths, data[4 + 8 * count:end], buffers
+
+    def test_frame_layout(self):
+        """Large arrays follow the pickle as raw frames, in order, small ones and nested bytes stay in the pickle"""
+        first, second = array.array('d', range(200)), array.array('b', b'a' * 2000)
+        message = {'first': first, 'second': second, 'small': array.array('b', b'b' * 10), 'bytes': b'c' * 2000}
+        data = self.codec.encode(message)
+        lengths, stream, buffers = self.frames(data)
+        self.assertEqual(lengths, (1600, 2000))
+        self.assertEqual(buffers, [first.tobytes(), second.tobytes()])
+        self.assertNotIn(b'a' * 2000, stream)
+        self.assertIn(b'b' * 10, stream)
+        self.assertIn(b'c' * 2000, stream)
+        decoded = self.codec.decode(data)
+        self.assertEqual(decoded, message)
+        self.assertIs(type(decoded['first']), array.array)
+
+    def test_bytes(self):
+        """Large bytes and bytearray messages go out-of-band, small ones in-band"""
+        for message in [b'x' * 5000, bytearray(b'y' * 5000)]:
+            with self.subTest(type=type(message)):
+                lengths, _, buffers = self.frames(self.codec.encode(message))
+                self.assertEqual((lengths, buffers), ((5000,), [message]))
+                decoded = self.codec.decode(self.codec.encode(message))
+                self.assertEqual((decoded, type(decoded)), (message, type(message)))
+        self.assertEqual(self.frames(self.codec.encode(b'small'))[0], ())
+        self.assertEqual(self.codec.decode(self.codec.encode(b'small')), b'small')
+
+    def test_memoryview(self):
+        """Memoryviews (of any size) are decoded as views of the received data, without a copy"""
+        data = bytearray(self.codec.encode(('m', memoryview(b'abc'))))
+        self.assertEqual(self.frames(bytes(data))[0], (3,))
+        _, view = self.codec.decode(data)
+        self.assertIs(type(view), memoryview)
+        data[-3:] = b'xyz'
+        self.assertEqual(bytes(view), b'xyz')
+
+
+class TestMarshalCodec(unittest.TestCase):
+    """marshal round trips of core types"""
+
+    def test_round_trip(self):
+        codec = lab_codec.CODECS['marshal']
+        message = {'t': (1, 2.5, None), 's': {'a'}, 'f': frozenset({1}), 'b': b'\x00', 'l': [True, 2 ** 70, 1j]}
+        self.assertEqual(codec.decode(codec.encode(message)), message)
+        self.assertRaises(ValueError, codec.encode, object())
+
+    def test_pickle_round_trip(self):
+        codec = lab_codec.CODECS['pickle']
+        message = (lab_codec.ZlibCompressor(3).level, {'a': [1, b'x']})
+        self.assertEqual(codec.decode(codec.encode(message)), message)
+
+
+class TestRegister(unittest.TestCase):
+    """Registration of custom codecs"""
+
+    class Reversed(lab_codec.Codec):
+        name = 'reversed'
+        tag = b'r'
+
+        def encode(self, message: object) -> bytes:
+            return message[::-1]
+
+        def decode(self, data) -> object:
+            return bytes(data)[::-1]
+
+    def codec(self, name: str, tag: bytes) -> lab_codec.Codec:
+        codec = self.Reversed()
+        codec.name, codec.tag = name, tag
+        return codec
+
+    def test_register(self):
+        """Registered codecs are found by name and tag, registering them again is fine"""
+        codec = self.codec('reversed', b'r')
+        lab_codec.register(codec)
+        self.addCleanup(lab_codec._BY_TAG.pop, b'r')
+        self.addCleanup(lab_codec.CODECS.pop, 'reversed')
+        lab_codec.register(codec)
+        self.assertIs(lab_codec.get('reversed'), codec)
+        self.assertIs(lab_codec.get(codec), codec)
+        self.assertIs(lab_codec.by_tag(b'r'), codec)
+
+    def test_tags(self):
+        """Tags of other codecs, of compressors and of handles and trace stamps are refused"""
+        for tag in [b'p', b'5', b'm', b'c', b'z', b'x', b't', b'h', b's']:
+            with self.subTest(tag=tag):
+                self.assertRaises(AssertionError, lab_codec.register, self.codec('other', tag))
+        self.assertNotIn('other', lab_codec.CODECS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""
+Logging unit tests
+Lazy arguments, queued logging via LazyQueueHandler and BatchListener, and JSON lines log files.
+"""
+
+import json
+import logging
+import os
+import queue
+import tempfile
+import unittest
+
+from lib import lab_logging
+
+
+class Recorder(logging.Handler):
+    """Handler keeping formatted messages, and the number of records handled between flushes"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages: list = []
+        self.batches: list = []
+        self.pending: int = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(self.format(record))
+        self.pending += 1
+
+    def flush(self) -> None:
+        self.batches.append(self.pending)
+        self.pending = 0
+
+
+class TestLogging(unittest.TestCase):
+    """Records of a logger of its own, queued to a listener"""
+
+    def setUp(self):
+        super().setUp()
+        self.logger = logging.getLogger('vs2lab.test.{}'.format(self.id()))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.records = queue.SimpleQueue()
+        self.recorder = Recorder()
+        self.listener = lab_logging.BatchListener(self.records, [self.recorder], batch_size=10)
+        self.handler = lab_logging.LazyQueueHandler(self.records)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_lazy_disabled_level(self):
+        """Lazy arguments are computed when the record is formatted, never for disabled levels"""
+        calls = []
+
+        def describe(state):
+            calls.append(state)
+            return 'state {}'.format(state)
+
+        self.logger.debug('%s', lab_logging.lazy(describe, 1))
+        self.assertTrue(self.records.empty())
+        self.logger.info('%s', lab_logging.lazy(describe, 2))
+        self.assertEqual(calls, [])  # queued, not formatted yet
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual((calls, self.recorder.messages), ([2], ['state 2']))
+
+    def test_mutable_args_frozen(self):
+        """Later changes of mutable arguments do not show up, with or without Lazy arguments next to them"""
+        members, fields = ['a'], {'n': 1}
+        self.logger.info('members %s', members)
+        self.logger.info('members %s %s', members, lab_logging.Lazy(len, members))
+        self.logger.info('fields %(n)s %(all)r', {'n': lab_logging.Lazy(str, 'x'), 'all': fields})
+        members.append('b')
+        fields['n'] = 2
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual(self.recorder.messages, ["members ['a']", "members ['a'] 2", "fields x {'n': 1}"])
+
+    def test_exception_formatted_when_queued(self):
+        """Tracebacks are formatted before queueing"""
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            self.logger.exception('failed')
+        record = self.records.get_nowait()
+        self.assertIsNone(record.exc_info)
+        self.assertIn('ValueError: broken', record.exc_text)
+
+    def test_stop_flushes(self):
+        """stop() handles all records queued before"""
+        self.listener.start()
+        for i in range(1000):
+            self.logger.info('record %d', i)
+        self.listener.stop()
+        self.assertEqual(self.recorder.messages, ['record {}'.format(i) for i in range(1000)])
+        self.assertEqual(self.recorder.pending, 0)
+
+    def test_batches(self):
+        """Records queued meanwhile are handled in batches of up to batch_size, with one flush per batch"""
+        for i in range(25):
+            self.logger.info('record %d', i)
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual(self.recorder.batches[:3], [10, 10, 5])
+        self.assertEqual(sum(self.recorder.batches), 25)
+
+    def test_handler_levels(self):
+        """The listener passes records to handlers by their levels"""
+        self.recorder.setLevel(logging.WARNING)
+        self.logger.info('info')
+        self.logger.warning('warning')
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual(self.recorder.messages, ['warning'])
+
+
+class TestJsonLines(unittest.TestCase):
+    """JSON lines log files written in batches"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'vs2lab.log')
+
+    def read(self) -> list:
+        with open(self.path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_lines(self):
+        """Every record is one line of valid JSON, messages with line breaks and exceptions included"""
+        handler = lab_logging.BatchFileHandler(self.path, encoding='utf-8')
+        handler.setFormatter(lab_logging.JsonLinesFormatter())
+        self.addCleanup(handler.close)
+        logger = logging.getLogger('vs2lab.test.json')
+        messages = ['plain', 'two\nlines "quoted"', 'ünïcode {}']
+        for message in messages:
+            handler.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 1, message, None, None))
+        try:
+            raise KeyError('missing')
+        except KeyError as error:
+            handler.handle(logger.makeRecord(logger.name, logging.ERROR, __file__, 1, 'failed %s', (error,),
+                                             (type(error), error, error.__traceback__)))
+        handler.flush()
+        entries = self.read()
+        self.assertEqual([entry['msg'] for entry in entries], messages + ["failed 'missing'"])
+        self.assertEqual(entries[0]['level'], 'INFO')
+        self.assertEqual(entries[0]['name'], 'vs2lab.test.json')
+        self.assertIn("KeyError: 'missing'", entries[-1]['exc'])
+
+    def test_setup(self):
+        """setup(queued=True, json_lines=True) writes the file through the listener"""
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(self.path))
+        self.addCleanup(os.chdir, cwd)
+        logger = logging.getLogger('vs2lab')
+        handlers, level = list(logger.handlers), logger.level
+        listener = lab_logging.setup(stream_level=logging.CRITICAL, queued=True, json_lines=True)
+        for handler in listener.handlers:
+            self.addCleanup(handler.close)
+        self.addCleanup(setattr, logger, 'handlers', handlers)
+        self.addCleanup(logger.setLevel, level)
+        logging.getLogger('vs2lab.test.setup').debug('%s', lab_logging.Lazy(sum, [1, 2]))
+        listener.stop()
+        self.assertEqual([(entry['level'], entry['msg']) for entry in self.read()], [('DEBUG', '3')])
+
+
+if __name__ == '__main__':
+    unittest.main()